@@ -1,6 +1,11 @@
 """
 CPOL Level 1b main production line.
 
+The production module (and Py-ART with it) is only imported when
+production_line or process_and_save is first accessed, so that the
+lightweight modules (manifest, scheduling, taskqueue, ...) can be imported
+quickly.
+
 @title: CPOL_PROD_1b
 @author: Valentin Louf <valentin.louf@monash.edu>
 @institution: Bureau of Meteorology
@@ -11,5 +16,12 @@ CPOL Level 1b main production line.
     production_line
 """
 
-from .production import production_line
-from .production import process_and_save
+__all__ = ['production_line', 'process_and_save']
+
+
+def __getattr__(name):
+    if name in __all__:
+        from . import production
+
+        return getattr(production, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
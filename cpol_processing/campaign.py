@@ -0,0 +1,368 @@
+"""
+Campaign planning: inventory of the input radar files (INPATH/year/YYYYMMDD
+tree), and estimate of the resources needed to process them from the
+runtimes recorded in the manifest and the peak memory recorded in the stage
+profiles.
+
+@title: campaign
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    count_outputs
+    estimate_resources
+    get_day_files
+    get_inventory
+    get_output_ratio
+    group_by_month
+    load_peak_memory
+    makespan
+    pack_jobs
+    predict_file_runtimes
+"""
+# Python Standard Library
+import os
+import csv
+import glob
+import json
+import heapq
+import datetime
+import collections
+
+# Other Libraries
+import numpy as np
+
+from . import scheduling
+
+
+def get_day_files(inpath, day):
+    """
+    Input radar files of one day.
+
+    Parameters:
+    ===========
+    inpath: str
+        Input directory (INPATH/year/YYYYMMDD/ tree).
+    day: datetime
+        Date.
+
+    Returns:
+    ========
+    flist: list
+        Sorted input radar files.
+    """
+    input_dir = os.path.join(inpath, str(day.year), day.strftime("%Y%m%d"), "*.*")
+
+    return sorted(glob.glob(input_dir))
+
+
+def get_inventory(inpath, start, end):
+    """
+    Inventory of the input radar files between two dates.
+
+    Parameters:
+    ===========
+    inpath: str
+        Input directory (INPATH/year/YYYYMMDD/ tree).
+    start: datetime
+        First day.
+    end: datetime
+        Last day.
+
+    Returns:
+    ========
+    inventory: OrderedDict
+        (file name, size in bytes) of each input file, for each day with
+        files.
+    """
+    inventory = collections.OrderedDict()
+    for cnt in range(0, (end - start).days + 1):
+        day = start + datetime.timedelta(days=cnt)
+        flist = get_day_files(inpath, day)
+        if len(flist) == 0:
+            continue
+
+        files = []
+        for radar_file_name in flist:
+            try:
+                files.append((radar_file_name, os.path.getsize(radar_file_name)))
+            except OSError:
+                continue
+        inventory[day] = files
+
+    return inventory
+
+
+def group_by_month(inventory):
+    """
+    Group the inventory by month.
+
+    Parameters:
+    ===========
+    inventory: OrderedDict
+        Files of each day, see get_inventory.
+
+    Returns:
+    ========
+    months: OrderedDict
+        Files of each (year, month).
+    """
+    months = collections.OrderedDict()
+    for day, files in inventory.items():
+        months.setdefault((day.year, day.month), []).extend(files)
+
+    return months
+
+
+def count_outputs(outpath_ppi, day):
+    """
+    Output files already written for one day.
+
+    Parameters:
+    ===========
+    outpath_ppi: str
+        Output directory for the PPIs (OUTPATH/vYYYY/ppi).
+    day: datetime
+        Date.
+
+    Returns:
+    ========
+    noutputs: int
+        Number of output files.
+    nbytes: int
+        Size of the output files in bytes.
+    """
+    output_dir = os.path.join(outpath_ppi, str(day.year), day.strftime("%Y%m%d"))
+    noutputs, nbytes = 0, 0
+    for outfilename in glob.glob(os.path.join(output_dir, "*.nc")):
+        try:
+            nbytes += os.path.getsize(outfilename)
+        except OSError:
+            continue
+        noutputs += 1
+
+    return noutputs, nbytes
+
+
+def get_output_ratio(runs, max_runs=1000):
+    """
+    Median ratio of the output file size over the input file size, from the
+    successful runs of the manifest whose output still exists.
+
+    Parameters:
+    ===========
+    runs: dict
+        Runs of the manifest, see manifest.get_latest_runs.
+    max_runs: int
+        Maximum number of output files to look at.
+
+    Returns:
+    ========
+    ratio: float
+        Output size over input size (None if there is no output).
+    """
+    ratios = []
+    for run in runs.values():
+        if run['status'] != 'success' or not run['input_size'] or not run['output_path']:
+            continue
+        try:
+            ratios.append(os.path.getsize(run['output_path']) / run['input_size'])
+        except OSError:
+            continue
+        if len(ratios) >= max_runs:
+            break
+
+    if len(ratios) == 0:
+        return None
+
+    return float(np.median(ratios))
+
+
+def load_peak_memory(profile_file):
+    """
+    Peak RSS of the worker processing each file, from the stage profiles
+    (JSONL or CSV, see instrumentation.StageProfile.save).
+
+    Parameters:
+    ===========
+    profile_file: str
+        Profile file name.
+
+    Returns:
+    ========
+    peak_memory: dict
+        Peak RSS in bytes for each input file (absolute path).
+    """
+    if profile_file.endswith('.csv'):
+        with open(profile_file, newline='') as fid:
+            records = list(csv.DictReader(fid))
+    else:
+        records = []
+        with open(profile_file) as fid:
+            for line in fid:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    continue
+
+    peak_memory = dict()
+    for record in records:
+        if not record.get('input_file'):
+            # Worker warm-up.
+            continue
+        try:
+            input_file = os.path.abspath(record['input_file'])
+            peak_rss = float(record['peak_rss'])
+        except (KeyError, TypeError, ValueError):
+            continue
+        peak_memory[input_file] = max(peak_memory.get(input_file, 0), peak_rss)
+
+    return peak_memory
+
+
+def predict_file_runtimes(flist, runs=None, default_runtime=120):
+    """
+    Predict the processing time of each file in seconds (see
+    scheduling.predict_runtimes). Without enough history in the manifest, the
+    predictions are scaled so that the mean runtime is default_runtime.
+
+    Parameters:
+    ===========
+    flist: list
+        Input radar files.
+    runs: dict
+        Runs of the manifest, see manifest.get_latest_runs.
+    default_runtime: float
+        Mean processing time of a file without history, in seconds.
+
+    Returns:
+    ========
+    predictions: dict
+        Predicted runtime for each file.
+    """
+    if len(flist) == 0:
+        return dict()
+
+    predictions = scheduling.predict_runtimes(flist, runs, count_sweeps=False)
+    if runs is not None and scheduling.fit_runtime_model(runs) is not None:
+        return predictions
+
+    # Relative costs (file sizes) only.
+    mean_cost = np.mean(list(predictions.values()))
+    if mean_cost <= 0:
+        return {f: float(default_runtime) for f in flist}
+
+    return {f: default_runtime * cost / mean_cost for f, cost in predictions.items()}
+
+
+def makespan(runtimes, ncpus):
+    """
+    Time to process a list of files with ncpus workers, the longest files
+    first (as radar_pack.py does).
+
+    Parameters:
+    ===========
+    runtimes: list
+        Runtime of each file in seconds.
+    ncpus: int
+        Number of workers.
+
+    Returns:
+    ========
+    makespan: float
+        Time in seconds until the last file is done.
+    """
+    workers = [0.0] * max(ncpus, 1)
+    for runtime in sorted(runtimes, reverse=True):
+        heapq.heapreplace(workers, workers[0] + runtime)
+
+    return max(workers)
+
+
+def estimate_resources(runtimes, worker_memory, target_walltime=10 * 3600, max_ncpus=16, margin=1.2,
+                       startup=300, base_memory=2**30):
+    """
+    Fit the resources of a job: the smallest number of CPUs to process the
+    files within the target walltime, and the walltime and memory needed with
+    that number of CPUs.
+
+    Parameters:
+    ===========
+    runtimes: list
+        Predicted runtime of each file in seconds.
+    worker_memory: float
+        Peak memory of a worker in bytes.
+    target_walltime: float
+        Target walltime in seconds.
+    max_ncpus: int
+        Maximum number of CPUs of a job.
+    margin: float
+        Multiplicative margin on the walltime and the memory.
+    startup: float
+        Start time of the job in seconds (environment, imports, ...).
+    base_memory: float
+        Memory of the main process in bytes.
+
+    Returns:
+    ========
+    resources: dict
+        ncpus, walltime (s), memory (bytes) and cpu_hours (predicted CPU
+        time, without margin).
+    """
+    available = max(target_walltime / margin - startup, 1)
+    ncpus = min(max_ncpus, max(1, int(np.ceil(sum(runtimes) / available))))
+    while ncpus < max_ncpus and makespan(runtimes, ncpus) > available:
+        ncpus += 1
+
+    resources = {'ncpus': ncpus,
+                 'walltime': margin * (makespan(runtimes, ncpus) + startup),
+                 'memory': margin * (base_memory + ncpus * worker_memory),
+                 'cpu_hours': sum(runtimes) / 3600}
+
+    return resources
+
+
+def pack_jobs(groups, worker_memory, target_walltime=10 * 3600, max_ncpus=16, **kwargs):
+    """
+    Pack consecutive groups of files (e.g. months) into jobs, as long as a
+    job can still be processed within the target walltime.
+
+    Parameters:
+    ===========
+    groups: list
+        (label, runtimes) of each group, runtimes being the predicted
+        runtime of each file.
+    worker_memory: float
+        Peak memory of a worker in bytes.
+    target_walltime: float
+        Target walltime in seconds.
+    max_ncpus: int
+        Maximum number of CPUs of a job.
+    **kwargs:
+        See estimate_resources.
+
+    Returns:
+    ========
+    jobs: list
+        (labels, resources) of each job.
+    """
+    jobs = []
+    labels, runtimes, resources = [], [], None
+    for label, group_runtimes in groups:
+        candidate = estimate_resources(runtimes + list(group_runtimes), worker_memory, target_walltime,
+                                       max_ncpus, **kwargs)
+        if len(labels) > 0 and candidate['walltime'] > target_walltime:
+            jobs.append((labels, resources))
+            labels, runtimes = [], []
+            candidate = estimate_resources(list(group_runtimes), worker_memory, target_walltime,
+                                           max_ncpus, **kwargs)
+        labels.append(label)
+        runtimes += list(group_runtimes)
+        resources = candidate
+
+    if len(labels) > 0:
+        jobs.append((labels, resources))
+
+    return jobs
@@ -0,0 +1,175 @@
+"""
+Instrumentation of the processing stages: wall time, CPU time, peak RSS,
+memory allocated (tracemalloc) and size of the radar fields created by each
+stage. The records can be appended to a JSONL or a CSV file, to be
+aggregated over a campaign. Hooks can be called around each stage (see the
+profiling module).
+
+@title: instrumentation
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    _field_bytes
+    _peak_rss
+    StageProfile
+"""
+# Python Standard Library
+import os
+import csv
+import json
+import time
+import traceback
+import tracemalloc
+import contextlib
+
+
+def _peak_rss():
+    """
+    Peak resident set size of the process in bytes (None if unavailable).
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _field_bytes(radar):
+    """
+    Size in bytes of the (loaded) radar fields. Lazy fields are not loaded.
+    """
+    if radar is None:
+        return 0
+
+    nbytes = 0
+    for field in radar.fields.values():
+        if 'data' in getattr(field, '_lazyload', {}):
+            continue
+        try:
+            nbytes += field['data'].nbytes
+        except (KeyError, AttributeError):
+            continue
+
+    return nbytes
+
+
+class StageProfile:
+    """
+    Records of the processing stages. Use the stage context manager around
+    each stage.
+
+    Parameters:
+    ===========
+    trace_memory: bool
+        Record the memory allocated with tracemalloc (slows down the
+        processing).
+    hooks: list
+        Objects with on_stage_start(name) and on_stage_end(name, record)
+        methods, see profiling.StageHook.
+    """
+    def __init__(self, trace_memory=False, hooks=None):
+        self.trace_memory = trace_memory
+        self.hooks = list(hooks) if hooks is not None else []
+        self.records = []
+
+    def _call_hooks(self, method, *args):
+        # A failing hook must not stop the processing.
+        for hook in self.hooks:
+            try:
+                getattr(hook, method)(*args)
+            except Exception:
+                traceback.print_exc()
+
+    @contextlib.contextmanager
+    def stage(self, name, radar=None):
+        """
+        Record a stage.
+
+        Parameters:
+        ===========
+        name: str
+            Stage name.
+        radar:
+            Py-ART radar structure, to measure the size of the fields created
+            by the stage.
+        """
+        field_bytes = _field_bytes(radar)
+        peak_rss = _peak_rss()
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            traced_memory = tracemalloc.get_traced_memory()[0]
+
+        self._call_hooks('on_stage_start', name)
+        wall_tick = time.perf_counter()
+        cpu_tick = time.process_time()
+        try:
+            yield self
+        finally:
+            record = {'stage': name,
+                      'wall_time': time.perf_counter() - wall_tick,
+                      'cpu_time': time.process_time() - cpu_tick,
+                      'field_bytes': _field_bytes(radar) - field_bytes}
+            if peak_rss is not None:
+                record['peak_rss'] = _peak_rss()
+                record['peak_rss_increase'] = record['peak_rss'] - peak_rss
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                record['allocated'] = current - traced_memory
+                record['peak_allocated'] = peak - traced_memory
+            self._call_hooks('on_stage_end', name, record)
+            self.records.append(record)
+
+    def timings(self):
+        """
+        Wall time of each stage.
+
+        Returns:
+        ========
+        timings: dict
+            Wall time in seconds for each stage name.
+        """
+        timings = dict()
+        for record in self.records:
+            timings[record['stage']] = timings.get(record['stage'], 0) + record['wall_time']
+
+        return timings
+
+    def save(self, filename, **kwargs):
+        """
+        Append the records to a CSV file (if filename ends with .csv) or a
+        JSONL file (one JSON object per line otherwise).
+
+        Parameters:
+        ===========
+        filename: str
+            Output file name.
+        **kwargs:
+            Extra columns added to every record (e.g. input file name).
+        """
+        records = [dict(kwargs, **record) for record in self.records]
+        if len(records) == 0:
+            return None
+
+        if filename.endswith('.csv'):
+            fieldnames = list(kwargs.keys()) + ['stage', 'wall_time', 'cpu_time', 'field_bytes', 'peak_rss',
+                                                'peak_rss_increase', 'allocated', 'peak_allocated',
+                                                'numba_compile_time', 'cprofile']
+            write_header = not os.path.isfile(filename)
+            with open(filename, 'a', newline='') as fid:
+                writer = csv.DictWriter(fid, fieldnames=fieldnames, extrasaction='ignore')
+                if write_header:
+                    writer.writeheader()
+                writer.writerows(records)
+        else:
+            with open(filename, 'a') as fid:
+                for record in records:
+                    fid.write(json.dumps(record, default=str) + '\n')
+
+        return None
@@ -0,0 +1,258 @@
+"""
+Manifest of the processed files, stored in a local SQLite database. Each run
+of the production line is recorded with the input file signature, the code
+version and configuration, the output file, the timings and the status. It is
+used to select the files that need to be (re)processed.
+
+@title: manifest
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    connect
+    file_signature
+    get_latest_runs
+    record_run
+    select_files
+    stage_configuration
+"""
+# Python Standard Library
+import os
+import json
+import hashlib
+import sqlite3
+import datetime
+
+from .__version__ import __version__
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    input_path TEXT NOT NULL,
+    input_size INTEGER,
+    input_mtime REAL,
+    input_hash TEXT,
+    version TEXT,
+    config TEXT,
+    output_path TEXT,
+    timings TEXT,
+    status TEXT,
+    message TEXT,
+    processing_date TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_input_path ON runs (input_path);
+"""
+
+
+def connect(db_path):
+    """
+    Open (and create if needed) the manifest database.
+
+    Parameters:
+    ===========
+    db_path: str
+        Path to the SQLite database.
+
+    Returns:
+    ========
+    conn: sqlite3.Connection
+        Database connection.
+    """
+    # Several workers write in the same database, so wait for the lock.
+    conn = sqlite3.connect(db_path, timeout=120)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(_SCHEMA)
+
+    return conn
+
+
+def _config_to_str(config):
+    """
+    Serialize the stage configuration, so that it can be compared.
+    """
+    return json.dumps(config, sort_keys=True, default=str)
+
+
+def file_signature(input_path, use_hash=False):
+    """
+    Size, modification time and (optionally) MD5 hash of a file.
+
+    Parameters:
+    ===========
+    input_path: str
+        File name.
+    use_hash: bool
+        Compute the MD5 hash of the file (slow on large files).
+
+    Returns:
+    ========
+    size: int
+        File size in bytes.
+    mtime: float
+        Modification time.
+    md5: str
+        MD5 hash, None if use_hash is False.
+    """
+    stat = os.stat(input_path)
+    md5 = None
+    if use_hash:
+        hasher = hashlib.md5()
+        with open(input_path, 'rb') as fid:
+            for chunk in iter(lambda: fid.read(2**20), b''):
+                hasher.update(chunk)
+        md5 = hasher.hexdigest()
+
+    return stat.st_size, stat.st_mtime, md5
+
+
+def record_run(db_path, input_path, output_path, status, config, timings=None, message=None, use_hash=False):
+    """
+    Record a run of the production line.
+
+    Parameters:
+    ===========
+    db_path: str
+        Path to the SQLite database.
+    input_path: str
+        Input radar file.
+    output_path: str
+        Output file (None if it failed).
+    status: str
+        'success' or 'failed'.
+    config: dict
+        Stage configuration (instrument, dealiasing algorithm, ...).
+    timings: dict
+        Timings of the processing, in seconds.
+    message: str
+        Error message.
+    use_hash: bool
+        Store the MD5 hash of the input file.
+    """
+    try:
+        size, mtime, md5 = file_signature(input_path, use_hash)
+    except FileNotFoundError:
+        size, mtime, md5 = None, None, None
+
+    row = (os.path.abspath(input_path), size, mtime, md5, __version__, _config_to_str(config),
+           output_path, json.dumps(timings), status, message, datetime.datetime.utcnow().isoformat())
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            conn.execute("""INSERT INTO runs (input_path, input_size, input_mtime, input_hash, version, config,
+                            output_path, timings, status, message, processing_date)
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", row)
+    finally:
+        conn.close()
+
+    return None
+
+
+def get_latest_runs(db_path):
+    """
+    Get the latest run of each input file.
+
+    Parameters:
+    ===========
+    db_path: str
+        Path to the SQLite database.
+
+    Returns:
+    ========
+    runs: dict
+        Latest run (as a dict) for each input file path.
+    """
+    conn = connect(db_path)
+    try:
+        cursor = conn.execute("""SELECT * FROM runs WHERE id IN
+                                 (SELECT MAX(id) FROM runs GROUP BY input_path)""")
+        runs = dict()
+        for row in cursor:
+            run = dict(row)
+            run['config'] = json.loads(run['config']) if run['config'] else None
+            run['timings'] = json.loads(run['timings']) if run['timings'] else None
+            runs[run['input_path']] = run
+    finally:
+        conn.close()
+
+    return runs
+
+
+def select_files(db_path, flist, config, version=__version__, use_hash=False):
+    """
+    Select the files that need processing: new files, files that failed and
+    files that are stale, i.e. processed with another version or
+    configuration, or that have changed since.
+
+    Parameters:
+    ===========
+    db_path: str
+        Path to the SQLite database.
+    flist: list
+        Input radar files.
+    config: dict
+        Current stage configuration.
+    version: str
+        Current code version.
+    use_hash: bool
+        Compare MD5 hashes of the input files instead of size/mtime.
+
+    Returns:
+    ========
+    todo: list
+        Input files to process.
+    """
+    runs = get_latest_runs(db_path)
+    config = json.loads(_config_to_str(config))
+
+    todo = []
+    for input_path in flist:
+        try:
+            run = runs[os.path.abspath(input_path)]
+        except KeyError:
+            todo.append(input_path)
+            continue
+
+        if run['status'] != 'success' or run['version'] != version or run['config'] != config:
+            todo.append(input_path)
+            continue
+
+        size, mtime, md5 = file_signature(input_path, use_hash)
+        if use_hash:
+            has_changed = md5 != run['input_hash']
+        else:
+            has_changed = size != run['input_size'] or mtime != run['input_mtime']
+        if has_changed:
+            todo.append(input_path)
+
+    return todo
+
+
+def stage_configuration(sound_dir=None, instrument='CPOL', use_unravel=True, products=None):
+    """
+    Configuration of the processing stages, as recorded in the manifest.
+
+    Parameters:
+    ===========
+    sound_dir: str
+        Path to radiosoundings directory.
+    instrument: str
+        Name of radar.
+    use_unravel: bool
+        Dealiasing algorithm.
+    products: list
+        Output products (None for all of them).
+
+    Returns:
+    ========
+    config: dict
+        Stage configuration.
+    """
+    config = {'instrument': instrument, 'use_unravel': use_unravel, 'sound_dir': sound_dir}
+    if products is not None:
+        config['products'] = list(products)
+
+    return config
@@ -0,0 +1,723 @@
+"""
+Writing the level 1b radar data. CF/Radial writer with tunable compression:
+deflate level, shuffle, chunk shape, least significant digit quantization,
+and optional packing as int16 with scale/offset. Optional Zarr writer, with
+one group per volume in a daily store. Daily time-stacked netCDF writer, with
+all the volumes of a day in one file.
+
+@title: output
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    _quantize
+    _scale_and_offset
+    _to_json
+    benchmark_write
+    has_stacked_volume
+    set_field_encoding
+    write
+    write_cfradial
+    write_zarr
+    DailyStackWriter
+    WriteBehind
+"""
+# Python Standard Library
+import os
+import copy
+import fcntl
+import time
+import queue
+import threading
+import traceback
+import concurrent.futures
+
+# Other Libraries
+import netCDF4
+import numpy as np
+import pyart
+
+# The netCDF/HDF5 libraries are not thread-safe, and netCDF4 releases the GIL.
+# Every file access that may run concurrently with a WriteBehind thread must
+# hold this lock.
+NETCDF_LOCK = threading.RLock()
+
+
+def _quantize(data, least_significant_digit):
+    """
+    Quantize data to a number of significant digits (same algorithm as in
+    netCDF4), so that it compresses much better. Works in place.
+
+    Parameters:
+    ===========
+    data: ndarray
+        Float data.
+    least_significant_digit: int
+        Power of ten of the smallest decimal place to keep.
+
+    Returns:
+    ========
+    data: ndarray
+        Quantized data.
+    """
+    bits = np.ceil(np.log2(10 ** least_significant_digit))
+    scale = 2 ** bits
+    raw = np.ma.getdata(data)
+    np.multiply(raw, scale, out=raw)
+    np.around(raw, out=raw)
+    np.divide(raw, scale, out=raw)
+
+    return data
+
+
+def _scale_and_offset(data, dtype=np.int16):
+    """
+    Compute the scale factor and offset to pack data into integers.
+
+    Parameters:
+    ===========
+    data: ndarray
+        Float data.
+    dtype: type
+        Integer type.
+
+    Returns:
+    ========
+    scale: float
+        Scale factor.
+    offset: float
+        Offset.
+    fill_value: int
+        Fill value (minimum of the integer type, not used for data).
+    """
+    info = np.iinfo(dtype)
+    vmin = np.nanmin(np.ma.filled(data.astype(np.float64), np.NaN))
+    vmax = np.nanmax(np.ma.filled(data.astype(np.float64), np.NaN))
+    if not np.isfinite(vmin) or not np.isfinite(vmax):
+        vmin, vmax = 0, 1
+
+    # Keep the minimum of the integer type for the fill value, with a margin
+    # of one step for the float32 rounding of the scale and offset.
+    nsteps = float(info.max) - float(info.min) - 2
+    scale = (vmax - vmin) / nsteps
+    if scale == 0:
+        scale = 1
+    offset = (vmax + vmin) / 2
+
+    return np.float32(scale), np.float32(offset), dtype(info.min)
+
+
+def set_field_encoding(radar, field_encoding=None, deflate_level=4, shuffle=True, chunksizes=None,
+                       quantize=True, pack_int16=False):
+    """
+    Set the compression parameters of the radar fields. These are special keys
+    of the field dictionaries, understood by Py-ART netCDF writer. The radar
+    fields are not modified.
+
+    Parameters:
+    ===========
+    radar:
+        Py-ART radar structure.
+    field_encoding: dict
+        Per-field parameters, overriding the defaults, e.g.
+        {'reflectivity': {'deflate_level': 9, 'pack_int16': True}}.
+    deflate_level: int
+        zlib compression level (0 for no compression).
+    shuffle: bool
+        Use the HDF5 shuffle filter.
+    chunksizes: tuple
+        Chunk shape (rays, gates). None uses one sweep by the full range.
+    quantize: bool
+        Quantize the data using the _Least_significant_digit of the fields
+        (done by netCDF4 when writing). If False, the
+        _Least_significant_digit is removed from the written fields.
+    pack_int16: bool
+        Encode the float fields as int16 with scale/offset.
+
+    Returns:
+    ========
+    radar_out:
+        Shallow copy of the radar, with new field dictionaries.
+    """
+    if field_encoding is None:
+        field_encoding = dict()
+
+    if chunksizes is None:
+        chunksizes = (int(np.max(radar.rays_per_sweep['data'])), radar.ngates)
+    chunksizes = (min(chunksizes[0], radar.nrays), min(chunksizes[1], radar.ngates))
+
+    radar_out = copy.copy(radar)
+    radar_out.fields = dict()
+    for name, field in radar.fields.items():
+        encoding = {'deflate_level': deflate_level,
+                    'shuffle': shuffle,
+                    'chunksizes': chunksizes,
+                    'quantize': quantize,
+                    'pack_int16': pack_int16}
+        encoding.update(field_encoding.get(name, dict()))
+
+        newfield = dict(field)
+        newfield['_Zlib'] = encoding['deflate_level'] > 0
+        if encoding['deflate_level'] > 0:
+            newfield['_DeflateLevel'] = encoding['deflate_level']
+        newfield['_Shuffle'] = encoding['shuffle']
+        newfield['_ChunkSizes'] = encoding['chunksizes']
+
+        data = field['data']
+        is_float = np.issubdtype(data.dtype, np.floating)
+        if not encoding['quantize']:
+            # Py-ART passes it to netCDF4 as least_significant_digit.
+            newfield.pop('_Least_significant_digit', None)
+
+        if is_float and encoding['pack_int16']:
+            data = np.ma.masked_invalid(data)
+            scale, offset, fill_value = _scale_and_offset(data)
+            newfield['data'] = data
+            newfield['_Write_as_dtype'] = 'int16'
+            newfield['scale_factor'] = scale
+            newfield['add_offset'] = offset
+            newfield['_FillValue'] = fill_value
+            newfield.pop('_Least_significant_digit', None)
+            # Valid range is in packed units (CF convention).
+            for key in ['valid_min', 'valid_max']:
+                if key in newfield:
+                    packed = np.round((newfield[key] - offset) / scale)
+                    newfield[key] = np.int16(np.clip(packed, fill_value + 1, np.iinfo(np.int16).max))
+
+        radar_out.fields[name] = newfield
+
+    return radar_out
+
+
+def write_cfradial(outfilename, radar, **kwargs):
+    """
+    Write the radar in a CF/Radial netCDF4 file, with tunable compression.
+
+    Parameters:
+    ===========
+    outfilename: str
+        Output file name.
+    radar:
+        Py-ART radar structure.
+    **kwargs:
+        Compression parameters, see set_field_encoding.
+    """
+    radar_out = set_field_encoding(radar, **kwargs)
+    pyart.io.write_cfradial(outfilename, radar_out, format='NETCDF4')
+
+    return None
+
+
+def _to_json(value):
+    """
+    Convert a metadata value into a JSON serializable type.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    elif isinstance(value, np.generic):
+        return value.item()
+    elif isinstance(value, bytes):
+        return value.decode('utf-8', errors='replace')
+
+    return value
+
+
+def write_zarr(outfilename, radar, range_block=256, cname='zstd', clevel=5, quantize=True, nthreads=4):
+    """
+    Write the radar in a group of a Zarr store. The fields are chunked by
+    sweep and range block, compressed with Blosc, and written in parallel.
+    The group is replaced if it already exists, the rest of the store is
+    kept, so that a store can hold all the volumes of a day.
+
+    Parameters:
+    ===========
+    outfilename: str
+        Store path and group name, e.g. 'cpol.20060120.zarr/100000'.
+    radar:
+        Py-ART radar structure.
+    range_block: int
+        Number of gates per chunk.
+    cname: str
+        Blosc compressor name.
+    clevel: int
+        Blosc compression level.
+    quantize: bool
+        Quantize the data using the _Least_significant_digit of the fields.
+    nthreads: int
+        Number of fields written in parallel.
+    """
+    import zarr
+
+    store, group_name = os.path.split(outfilename)
+    is_zarr_v3 = int(zarr.__version__.split('.')[0]) >= 3
+    if is_zarr_v3:
+        codec = {'compressors': zarr.codecs.BloscCodec(cname=cname, clevel=clevel, shuffle='shuffle')}
+    else:
+        from numcodecs import Blosc
+        codec = {'compressor': Blosc(cname=cname, clevel=clevel, shuffle=Blosc.SHUFFLE)}
+
+    root = zarr.open_group(store, mode='a')
+    group = root.create_group(group_name, overwrite=True)
+    group.attrs.update({k: _to_json(v) for k, v in radar.metadata.items()})
+
+    def _create(name, data, dims, chunks, attrs, fill_value=None):
+        kwargs = dict(codec)
+        if is_zarr_v3:
+            kwargs['dimension_names'] = dims
+            array = group.create_array(name, shape=data.shape, chunks=chunks, dtype=data.dtype,
+                                       fill_value=fill_value, **kwargs)
+        else:
+            array = group.create_dataset(name, shape=data.shape, chunks=chunks, dtype=data.dtype,
+                                         fill_value=fill_value, **kwargs)
+            attrs = dict(attrs, _ARRAY_DIMENSIONS=dims)
+        array.attrs.update({k: _to_json(v) for k, v in attrs.items() if not k.startswith('_') or k == '_ARRAY_DIMENSIONS'})
+        return array
+
+    # Coordinates and sweep informations.
+    coordinates = {'time': (radar.time, ['time']),
+                   'range': (radar.range, ['range']),
+                   'azimuth': (radar.azimuth, ['time']),
+                   'elevation': (radar.elevation, ['time']),
+                   'fixed_angle': (radar.fixed_angle, ['sweep']),
+                   'sweep_number': (radar.sweep_number, ['sweep']),
+                   'sweep_start_ray_index': (radar.sweep_start_ray_index, ['sweep']),
+                   'sweep_end_ray_index': (radar.sweep_end_ray_index, ['sweep']),
+                   'latitude': (radar.latitude, []),
+                   'longitude': (radar.longitude, []),
+                   'altitude': (radar.altitude, [])}
+    for name, (coord, dims) in coordinates.items():
+        data = np.ma.getdata(coord['data'])
+        if not dims:
+            data = np.atleast_1d(data)[:1].reshape(())
+        array = _create(name, data, dims, data.shape, {k: v for k, v in coord.items() if k != 'data'})
+        array[...] = data
+
+    # Fields: chunk by sweep and range block.
+    chunks = (int(np.max(radar.rays_per_sweep['data'])), min(range_block, radar.ngates))
+    jobs = []
+    for name, field in radar.fields.items():
+        data = field['data']
+        attrs = {k: v for k, v in field.items() if k != 'data'}
+        fill_value = field.get('_FillValue', None)
+        if np.issubdtype(data.dtype, np.floating):
+            lsd = field.get('_Least_significant_digit', None)
+            if quantize and lsd is not None:
+                data = _quantize(data.copy(), lsd)
+            if fill_value is None:
+                fill_value = np.NaN
+        if fill_value is not None:
+            # The fill value is stored as a property of the Zarr array.
+            fill_value = data.dtype.type(fill_value)
+            data = np.ma.filled(data, fill_value)
+        else:
+            data = np.ma.getdata(data)
+        array = _create(name, data, ['time', 'range'], chunks, attrs, fill_value)
+        jobs.append((array, data))
+
+    # Blosc releases the GIL, so the fields are compressed in parallel.
+    def _write(job):
+        array, data = job
+        array[...] = data
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=nthreads) as executor:
+        list(executor.map(_write, jobs))
+
+    return None
+
+
+def write(outfilename, radar, output_format='cfradial', **kwargs):
+    """
+    Write the radar in the given output format.
+
+    Parameters:
+    ===========
+    outfilename: str
+        Output file name (store path and group name for Zarr).
+    radar:
+        Py-ART radar structure.
+    output_format: str
+        'cfradial', 'zarr' or 'daily'.
+    **kwargs:
+        Encoding parameters, see write_cfradial, write_zarr or
+        DailyStackWriter.
+    """
+    if output_format == 'cfradial':
+        with NETCDF_LOCK:
+            write_cfradial(outfilename, radar, **kwargs)
+    elif output_format == 'zarr':
+        write_zarr(outfilename, radar, **kwargs)
+    elif output_format == 'daily':
+        with DailyStackWriter(**kwargs) as stack:
+            stack.write(outfilename, radar)
+    else:
+        raise ValueError(f"Unknown output format: {output_format}.")
+
+    return None
+
+
+def benchmark_write(radar, outpath, settings):
+    """
+    Write the radar with different compression settings and report the write
+    time and the file size of each of them.
+
+    Parameters:
+    ===========
+    radar:
+        Py-ART radar structure.
+    outpath: str
+        Directory for the temporary output files.
+    settings: list
+        List of dict of compression parameters (see set_field_encoding).
+
+    Returns:
+    ========
+    results: list
+        For each setting, dict with the setting, the write time in s and the
+        file size in bytes.
+    """
+    results = []
+    for cnt, setting in enumerate(settings):
+        outfilename = os.path.join(outpath, f"benchmark_{cnt}.nc")
+        tick = time.time()
+        radar_out = set_field_encoding(radar, **setting)
+        pyart.io.write_cfradial(outfilename, radar_out, format='NETCDF4')
+        write_time = time.time() - tick
+
+        results.append({'setting': setting,
+                        'write_time': write_time,
+                        'file_size': os.path.getsize(outfilename)})
+        os.remove(outfilename)
+
+    return results
+
+
+def has_stacked_volume(outfilename, radar_start_date):
+    """
+    Check if a volume is already in a daily time-stacked file.
+
+    Parameters:
+    ===========
+    outfilename: str
+        Daily file name.
+    radar_start_date: datetime
+        Start time of the volume.
+
+    Returns:
+    ========
+        True if the file contains a volume with this start time.
+    """
+    if not os.path.isfile(outfilename):
+        return False
+
+    try:
+        with netCDF4.Dataset(outfilename) as ncid:
+            times = ncid['time'][:]
+            if len(times) == 0:
+                return False
+            start_time = netCDF4.date2num(radar_start_date, ncid['time'].units)
+            is_present = np.any(np.abs(times - start_time) < 1)
+    except Exception:
+        return False
+
+    return bool(is_present)
+
+
+class DailyStackWriter:
+    """
+    Write all the volumes of a day in one netCDF file, with an unlimited time
+    dimension (one entry per volume). The coordinates and metadata are
+    written once, when the file is created, and the file is kept open
+    between volumes. Rays and sweeps are padded to the largest volume. The
+    volumes must all have the same range coordinate. A volume with the same
+    start time as an existing one replaces it. The daily file is locked
+    (with a .lock file next to it) while it is open, so that processes
+    writing the same day, e.g. radar_single.py runs on several files, take
+    turns instead of corrupting it.
+
+    Parameters:
+    ===========
+    deflate_level: int
+        zlib compression level.
+    shuffle: bool
+        Use the HDF5 shuffle filter.
+    quantize: bool
+        Quantize the data using the _Least_significant_digit of the fields.
+    """
+    time_units = 'seconds since 1970-01-01T00:00:00Z'
+
+    def __init__(self, deflate_level=4, shuffle=True, quantize=True):
+        self.deflate_level = deflate_level
+        self.shuffle = shuffle
+        self.quantize = quantize
+        self.outfilename = None
+        self._ncid = None
+        self._lockfile = None
+
+    def _lock(self, outfilename):
+        """
+        Wait for the exclusive lock of the daily file.
+        """
+        self._lockfile = open(outfilename + '.lock', 'a')
+        fcntl.lockf(self._lockfile, fcntl.LOCK_EX)
+
+    def _unlock(self):
+        if self._lockfile is not None:
+            fcntl.lockf(self._lockfile, fcntl.LOCK_UN)
+            self._lockfile.close()
+        self._lockfile = None
+
+    def _create(self, outfilename, radar):
+        """
+        Create the daily file, with the coordinates and metadata of radar.
+        """
+        ncid = netCDF4.Dataset(outfilename, 'w', format='NETCDF4')
+        ncid.setncatts({k: v for k, v in radar.metadata.items() if isinstance(v, (str, int, float, np.number))})
+        ncid.setncattr('featureType', 'timeSeriesProfile')
+
+        ncid.createDimension('time', None)
+        ncid.createDimension('ray', None)
+        ncid.createDimension('sweep', None)
+        ncid.createDimension('range', radar.ngates)
+
+        ncid.createVariable('time', 'f8', ('time',))
+        ncid['time'].setncatts({'standard_name': 'time', 'long_name': 'Volume start time',
+                                'units': self.time_units})
+        # The default chunks along several unlimited dimensions are huge.
+        ray_chunks = (1, radar.nrays)
+        sweep_chunks = (1, radar.nsweeps)
+        ncid.createVariable('ray_time', 'f8', ('time', 'ray'), fill_value=-9999.0, zlib=True,
+                            chunksizes=ray_chunks)
+        ncid['ray_time'].setncatts({'long_name': 'Ray time', 'units': self.time_units})
+        for name, dims, dtype, chunks in [('azimuth', ('time', 'ray'), 'f4', ray_chunks),
+                                          ('elevation', ('time', 'ray'), 'f4', ray_chunks),
+                                          ('fixed_angle', ('time', 'sweep'), 'f4', sweep_chunks),
+                                          ('sweep_start_ray_index', ('time', 'sweep'), 'i4', sweep_chunks),
+                                          ('sweep_end_ray_index', ('time', 'sweep'), 'i4', sweep_chunks)]:
+            ncid.createVariable(name, dtype, dims, fill_value=-9999, zlib=True, chunksizes=chunks)
+            ncid[name].setncatts(self._get_attributes(getattr(radar, name)))
+        ncid.createVariable('nrays', 'i4', ('time',))
+        ncid['nrays'].long_name = 'Number of rays of the volume'
+        ncid.createVariable('nsweeps', 'i4', ('time',))
+        ncid['nsweeps'].long_name = 'Number of sweeps of the volume'
+
+        ncid.createVariable('range', 'f4', ('range',))
+        ncid['range'].setncatts(self._get_attributes(radar.range))
+        ncid['range'][:] = radar.range['data']
+        for name in ['latitude', 'longitude', 'altitude']:
+            coord = getattr(radar, name)
+            ncid.createVariable(name, 'f8', ())
+            ncid[name].setncatts(self._get_attributes(coord))
+            ncid[name].assignValue(np.ma.getdata(coord['data']).flat[0])
+
+        return ncid
+
+    @staticmethod
+    def _get_attributes(var):
+        return {k: v for k, v in var.items() if k != 'data' and not k.startswith('_')
+                and isinstance(v, (str, int, float, np.number, np.ndarray))}
+
+    def _create_field(self, name, field, max_rays):
+        """
+        Create the variable of a new field.
+        """
+        data = field['data']
+        fill_value = field.get('_FillValue', -9999)
+        var = self._ncid.createVariable(name, data.dtype, ('time', 'ray', 'range'),
+                                        fill_value=data.dtype.type(fill_value),
+                                        zlib=self.deflate_level > 0,
+                                        complevel=max(self.deflate_level, 1),
+                                        shuffle=self.shuffle,
+                                        chunksizes=(1, max_rays, self._ncid.dimensions['range'].size))
+        var.setncatts(self._get_attributes(field))
+
+        return var
+
+    def write(self, outfilename, radar, **kwargs):
+        """
+        Write a volume in the daily file.
+
+        Parameters:
+        ===========
+        outfilename: str
+            Daily file name. The current file is closed if it is different.
+        radar:
+            Py-ART radar structure.
+        """
+        with NETCDF_LOCK:
+            if outfilename != self.outfilename:
+                self.close()
+                self._lock(outfilename)
+                if os.path.isfile(outfilename):
+                    self._ncid = netCDF4.Dataset(outfilename, 'a')
+                else:
+                    self._ncid = self._create(outfilename, radar)
+                self.outfilename = outfilename
+            ncid = self._ncid
+
+            if ncid.dimensions['range'].size != radar.ngates or \
+                    not np.allclose(ncid['range'][:], radar.range['data'], atol=1):
+                raise ValueError(f"Range of the volume differs from the range of {outfilename}.")
+
+            ray_time = netCDF4.num2date(radar.time['data'], radar.time['units'])
+            ray_time = netCDF4.date2num(ray_time, self.time_units)
+            times = ncid['time'][:]
+            index = np.where(np.abs(times - ray_time[0]) < 1)[0]
+            if len(index) > 0:
+                # Replacing a volume: clear it first.
+                index = index[0]
+                previous_nrays = int(ncid['nrays'][index])
+                previous_nsweeps = int(ncid['nsweeps'][index])
+                for var in ncid.variables.values():
+                    if var.dimensions[:2] == ('time', 'ray'):
+                        var[index, :previous_nrays] = np.ma.masked
+                    elif var.dimensions == ('time', 'sweep'):
+                        var[index, :previous_nsweeps] = np.ma.masked
+            else:
+                index = len(times)
+
+            nrays = radar.nrays
+            nsweeps = radar.nsweeps
+            ncid['time'][index] = ray_time[0]
+            ncid['nrays'][index] = nrays
+            ncid['nsweeps'][index] = nsweeps
+            ncid['ray_time'][index, :nrays] = ray_time
+            for name in ['azimuth', 'elevation']:
+                ncid[name][index, :nrays] = getattr(radar, name)['data']
+            for name in ['fixed_angle', 'sweep_start_ray_index', 'sweep_end_ray_index']:
+                ncid[name][index, :nsweeps] = getattr(radar, name)['data']
+
+            max_rays = int(np.max(radar.rays_per_sweep['data']))
+            for name, field in radar.fields.items():
+                if name in ncid.variables:
+                    var = ncid[name]
+                else:
+                    var = self._create_field(name, field, max_rays)
+
+                data = field['data']
+                lsd = field.get('_Least_significant_digit', None)
+                if self.quantize and lsd is not None and np.issubdtype(data.dtype, np.floating):
+                    data = _quantize(data.copy(), lsd)
+                var[index, :nrays, :] = data
+
+            ncid.sync()
+
+        return None
+
+    def close(self):
+        """
+        Close the current daily file.
+        """
+        if self._ncid is not None:
+            with NETCDF_LOCK:
+                self._ncid.close()
+        self._unlock()
+        self._ncid = None
+        self.outfilename = None
+
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class WriteBehind:
+    """
+    Write the radar files in a background thread, so that the output of a
+    volume overlaps with the processing of the next one. The compression is
+    done in C (releasing the GIL), but the file accesses of the main thread
+    must be serialized with the writes using NETCDF_LOCK. The number of
+    radars in flight (queued or being written) is bounded to cap the memory
+    usage.
+
+    Parameters:
+    ===========
+    max_in_flight: int
+        Maximum number of radars queued or being written. submit blocks when
+        this number is reached.
+    write_function: function
+        Called as write_function(outfilename, radar, **kwargs). Default is
+        write, e.g. DailyStackWriter.write can be used instead.
+    """
+    def __init__(self, max_in_flight=2, write_function=write):
+        self.errors = []
+        self._write_function = write_function
+        self._queue = queue.Queue()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            outfilename, radar, callback, kwargs = item
+            error = None
+            try:
+                self._write_function(outfilename, radar, **kwargs)
+            except Exception as err:
+                traceback.print_exc()
+                error = err
+                self.errors.append((outfilename, err))
+
+            if callback is not None:
+                try:
+                    callback(outfilename, error)
+                except Exception:
+                    traceback.print_exc()
+
+            del radar, item
+            self._slots.release()
+
+        return None
+
+    def submit(self, outfilename, radar, callback=None, **kwargs):
+        """
+        Queue a radar for writing.
+
+        Parameters:
+        ===========
+        outfilename: str
+            Output file name.
+        radar:
+            Py-ART radar structure. It must not be modified afterward.
+        callback: function
+            Called as callback(outfilename, error) once written, error being
+            None on success.
+        **kwargs:
+            Output format and encoding parameters, see write.
+        """
+        if not self._thread.is_alive():
+            raise RuntimeError("WriteBehind has been closed.")
+
+        self._slots.acquire()
+        self._queue.put((outfilename, radar, callback, kwargs))
+
+        return None
+
+    def close(self):
+        """
+        Wait for all the queued radars to be written and stop the thread.
+
+        Returns:
+        ========
+        errors: list
+            List of (outfilename, exception) of the failed writes.
+        """
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+
+        return self.errors
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,389 @@
+"""
+Processing stages of the production line, declared as a DAG: each stage has
+its input and output fields (or products like the gatefilter). The
+scheduler only runs the stages needed for the requested products, and frees
+each field as soon as no later stage needs it.
+
+@title: pipeline
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    _attenuation_zdr
+    _attenuation_zh
+    _dsd
+    _gatefilter
+    _hydrometeors
+    _phase
+    _rainfall
+    _rhohv
+    _sounding
+    _velocity
+    _zdr
+    get_input_fields
+    get_last_use
+    resolve_stages
+    run_stages
+"""
+# Python Standard Library
+import time
+import traceback
+import collections
+
+# Other Libraries
+import pyart
+import numpy as np
+
+# Custom modules.
+from . import output
+from .processing import attenuation
+from .processing import filtering
+from .processing import hydrometeors
+from .processing import phase
+from .processing import radar_codes
+from .processing import velocity
+
+
+Stage = collections.namedtuple('Stage', ['name', 'function', 'inputs', 'outputs'])
+
+
+def _sounding(radar, context):
+    """
+    Compute SNR and extract radiosounding temperature (requires
+    radiosoundings).
+    """
+    if context['sound_dir'] is None:
+        return None
+
+    radiosonde_fname = radar_codes.get_radiosoundings(context['sound_dir'], context['radar_start_date'])
+    try:
+        with output.NETCDF_LOCK:
+            height, temperature, snr = radar_codes.snr_and_sounding(radar, radiosonde_fname)
+    except ValueError:
+        traceback.print_exc()
+        print(f"Impossible to compute SNR {context['radar_file_name']}")
+        return False
+
+    radar.add_field('temperature', temperature, replace_existing=True)
+    radar.add_field('height', height, replace_existing=True)
+    if 'SNR' not in radar.fields.keys():
+        radar.add_field('SNR', snr, replace_existing=True)
+
+    return None
+
+
+def _rhohv(radar, context):
+    """
+    Correct RHOHV.
+    """
+    # For CPOL, season 09/10, there are no RHOHV fields before March!!!!
+    if 'RHOHV' not in radar.fields.keys():
+        # Creating a fake RHOHV field (removed from the output).
+        context['fake_rhohv'] = True
+        rho = pyart.config.get_metadata('cross_correlation_ratio')
+        rho['data'] = np.ones_like(radar.fields['DBZ']['data'])
+        radar.add_field('RHOHV_CORR', rho)
+        return None
+
+    rho_corr = radar_codes.correct_rhohv(radar)
+    radar.add_field_like('RHOHV', 'RHOHV_CORR', rho_corr, replace_existing=True)
+
+    return None
+
+
+def _zdr(radar, context):
+    """
+    Correct ZDR.
+    """
+    corr_zdr = radar_codes.correct_zdr(radar)
+    radar.add_field_like('ZDR', 'ZDR_CORR', corr_zdr, replace_existing=True)
+
+    return None
+
+
+def _gatefilter(radar, context):
+    """
+    GateFilter.
+    """
+    if context['is_cpol']:
+        gatefilter = filtering.do_gatefilter_cpol(radar,
+                                                  refl_name='DBZ',
+                                                  phidp_name="PHIDP",
+                                                  rhohv_name='RHOHV_CORR',
+                                                  zdr_name="ZDR")
+    else:
+        gatefilter = filtering.do_gatefilter(radar,
+                                             refl_name='DBZ',
+                                             phidp_name="PHIDP",
+                                             rhohv_name='RHOHV_CORR',
+                                             zdr_name="ZDR")
+    context['gatefilter'] = gatefilter
+
+    return None
+
+
+def _phase(radar, context):
+    """
+    Process and unfold raw PHIDP, and compute KDP.
+    """
+    phidp, kdp = phase.valentin_phase_processing(radar, context['gatefilter'], phidp_name='PHIDP')
+    radar.add_field('PHIDP_VAL', phidp)
+    radar.add_field('KDP_VAL', kdp)
+
+    return None
+
+
+def _velocity(radar, context):
+    """
+    Unfold the Doppler velocity.
+    """
+    if 'VEL' not in radar.fields.keys():
+        return None
+
+    # Correct Doppler velocity units, and check the nyquist velocity.
+    radar.fields['VEL']['units'] = "m/s"
+    velocity.check_nyquist_velocity(radar)
+
+    unfvel_tick = time.time()
+    vdop_unfold = None
+    velocity_reference = context['velocity_reference']
+    if velocity_reference is not None:
+        # Warm start using the previous volume.
+        vdop_unfold = velocity.unfold_from_reference(radar, context['gatefilter'], velocity_reference)
+    if vdop_unfold is None:
+        if context['use_unravel']:
+            vdop_unfold = velocity.unravel(radar, context['gatefilter'])
+        else:
+            vdop_unfold = velocity.unfold_velocity(radar, context['gatefilter'])
+    radar.add_field('VEL_UNFOLDED', vdop_unfold, replace_existing=True)
+    print('Doppler velocity unfolded in %0.2f s.' % (time.time() - unfvel_tick))
+
+    if velocity_reference is not None:
+        velocity.update_velocity_reference(velocity_reference, radar, 'VEL_UNFOLDED')
+
+    return None
+
+
+def _attenuation_zh(radar, context):
+    """
+    Correct attenuation of ZH.
+    """
+    zh_corr = attenuation.correct_attenuation_zh_pyart(radar, phidp_field='PHIDP_VAL')
+    radar.add_field('DBZ_CORR', zh_corr, replace_existing=True)
+
+    return None
+
+
+def _attenuation_zdr(radar, context):
+    """
+    Correct attenuation of ZDR.
+    """
+    zdr_corr = attenuation.correct_attenuation_zdr(radar, gatefilter=context['gatefilter'],
+                                                   phidp_name='PHIDP_VAL', zdr_name='ZDR_CORR')
+    radar.add_field('ZDR_CORR_ATTEN', zdr_corr)
+
+    return None
+
+
+def _hydrometeors(radar, context):
+    """
+    Hydrometeors classification using csu toolbox.
+    """
+    hydro_class = hydrometeors.hydrometeor_classification(radar,
+                                                          context['gatefilter'],
+                                                          kdp_name='KDP_VAL',
+                                                          zdr_name='ZDR_CORR_ATTEN')
+    radar.add_field('radar_echo_classification', hydro_class, replace_existing=True)
+
+    return None
+
+
+def _rainfall(radar, context):
+    """
+    Rainfall rate using csu toolbox.
+    """
+    rainfall = hydrometeors.rainfall_rate(radar, context['gatefilter'], kdp_name='KDP_VAL',
+                                          refl_name='DBZ_CORR', zdr_name='ZDR_CORR_ATTEN')
+    radar.add_field("radar_estimated_rain_rate", rainfall)
+
+    return None
+
+
+def _dsd(radar, context):
+    """
+    DSD retrieval using csu toolbox.
+    """
+    nw_dict, d0_dict = hydrometeors.dsd_retrieval(radar, context['gatefilter'], kdp_name='KDP_VAL',
+                                                  zdr_name='ZDR_CORR_ATTEN')
+    radar.add_field("D0", d0_dict)
+    radar.add_field("NW", nw_dict)
+
+    return None
+
+
+# Stages in execution order. Inputs and outputs are field names, except the
+# gatefilter. Fields created and removed within a stage are not declared.
+STAGES = [Stage('sounding', _sounding, ['DBZ'], ['temperature', 'height', 'SNR']),
+          Stage('rhohv', _rhohv, ['RHOHV', 'SNR', 'DBZ'], ['RHOHV_CORR']),
+          Stage('zdr', _zdr, ['ZDR', 'SNR'], ['ZDR_CORR']),
+          Stage('gatefilter', _gatefilter, ['DBZ', 'PHIDP', 'RHOHV_CORR', 'ZDR', 'SNR'], ['gatefilter']),
+          Stage('phase', _phase, ['PHIDP', 'DBZ', 'gatefilter'], ['PHIDP_VAL', 'KDP_VAL']),
+          Stage('velocity', _velocity, ['VEL', 'DBZ', 'gatefilter'], ['VEL_UNFOLDED']),
+          Stage('attenuation_zh', _attenuation_zh, ['DBZ', 'RHOHV_CORR', 'PHIDP_VAL'], ['DBZ_CORR']),
+          Stage('attenuation_zdr', _attenuation_zdr, ['ZDR_CORR', 'PHIDP_VAL', 'gatefilter'], ['ZDR_CORR_ATTEN']),
+          Stage('hydrometeors', _hydrometeors,
+                ['DBZ_CORR', 'ZDR_CORR_ATTEN', 'KDP_VAL', 'RHOHV_CORR', 'temperature', 'gatefilter'],
+                ['radar_echo_classification']),
+          Stage('rainfall', _rainfall,
+                ['DBZ_CORR', 'ZDR_CORR_ATTEN', 'KDP_VAL', 'radar_echo_classification', 'temperature', 'gatefilter'],
+                ['radar_estimated_rain_rate']),
+          Stage('dsd', _dsd, ['DBZ_CORR', 'ZDR_CORR_ATTEN', 'KDP_VAL', 'gatefilter'], ['D0', 'NW'])]
+
+# Output products (Py-ART standard names) and the fields they come from.
+OUTPUT_FIELDS = collections.OrderedDict([('radar_echo_classification', 'radar_echo_classification'),
+                                         ('D0', 'D0'),
+                                         ('NW', 'NW'),
+                                         ('velocity', 'VEL_UNFOLDED'),
+                                         ('total_power', 'DBZ'),
+                                         ('raw_velocity', 'VEL'),
+                                         ('reflectivity', 'DBZ_CORR'),
+                                         ('cross_correlation_ratio', 'RHOHV_CORR'),
+                                         ('corrected_differential_reflectivity', 'ZDR_CORR_ATTEN'),
+                                         ('radar_estimated_rain_rate', 'radar_estimated_rain_rate'),
+                                         ('corrected_differential_phase', 'PHIDP_VAL'),
+                                         ('corrected_specific_differential_phase', 'KDP_VAL'),
+                                         ('spectrum_width', 'WIDTH')])
+
+# Fields of the input files used by the stages or kept in the output. DBZ is
+# always read (to check the file).
+RAW_FIELDS = ['DBZ', 'ZDR', 'VEL', 'PHIDP', 'RHOHV', 'SNR', 'WIDTH']
+
+# Products masked with the gatefilter in the output.
+HARDCODED_FIELDS = ["reflectivity", "radar_echo_classification", "corrected_differential_reflectivity",
+                    "region_dealias_velocity", "D0", "NW"]
+
+
+def resolve_stages(products, stages=STAGES):
+    """
+    Select the stages needed to compute the requested products.
+
+    Parameters:
+    ===========
+    products: list
+        Output products (keys of OUTPUT_FIELDS).
+    stages: list
+        All the stages, in execution order.
+
+    Returns:
+    ========
+    selected: list
+        Needed stages, in execution order.
+    needed: set
+        Fields (and products like the gatefilter) needed, including the
+        input fields.
+    """
+    for product in products:
+        if product not in OUTPUT_FIELDS:
+            raise ValueError(f"Unknown product: {product}. Available products: {', '.join(OUTPUT_FIELDS)}.")
+
+    needed = set(OUTPUT_FIELDS[product] for product in products)
+    if any(product in HARDCODED_FIELDS for product in products):
+        needed.add('gatefilter')
+
+    selected = []
+    for stage in reversed(stages):
+        if needed.intersection(stage.outputs):
+            selected.insert(0, stage)
+            needed.update(stage.inputs)
+
+    return selected, needed
+
+
+def get_input_fields(products=None):
+    """
+    Fields to read from the input file for the requested products.
+
+    Parameters:
+    ===========
+    products: list
+        Output products (keys of OUTPUT_FIELDS). None for all of them.
+
+    Returns:
+    ========
+    fields: list
+        Input field names.
+    """
+    if products is None:
+        return list(RAW_FIELDS)
+
+    _, needed = resolve_stages(products)
+    return [name for name in RAW_FIELDS if name == 'DBZ' or name in needed]
+
+
+def get_last_use(stages):
+    """
+    Index of the last stage using each field.
+
+    Parameters:
+    ===========
+    stages: list
+        Stages, in execution order.
+
+    Returns:
+    ========
+    last_use: dict
+        For each field, index of the last stage using it.
+    """
+    last_use = dict()
+    for cnt, stage in enumerate(stages):
+        for name in stage.inputs:
+            last_use[name] = cnt
+
+    return last_use
+
+
+def run_stages(radar, context, products, profile):
+    """
+    Run the stages needed for the requested products, freeing the fields
+    (and the gatefilter) as soon as they are not needed anymore.
+
+    Parameters:
+    ===========
+    radar:
+        Py-ART radar structure.
+    context: dict
+        Processing parameters and products that are not fields (gatefilter).
+    products: list
+        Output products (keys of OUTPUT_FIELDS).
+    profile: instrumentation.StageProfile
+        Records the stages.
+
+    Returns:
+    ========
+    success: bool
+        False if a stage failed.
+    """
+    stages, _ = resolve_stages(products)
+    last_use = get_last_use(stages)
+    keep = set(OUTPUT_FIELDS[product] for product in products)
+    if any(product in HARDCODED_FIELDS for product in products):
+        keep.add('gatefilter')
+
+    def _free(index):
+        for name in list(radar.fields.keys()):
+            if name not in keep and last_use.get(name, -1) <= index:
+                radar.fields.pop(name)
+        if 'gatefilter' not in keep and last_use.get('gatefilter', -1) <= index:
+            context.pop('gatefilter', None)
+
+    # Fields read but not used.
+    _free(-1)
+    for cnt, stage in enumerate(stages):
+        with profile.stage(stage.name, radar):
+            if stage.function(radar, context) is False:
+                return False
+            _free(cnt)
+
+    return True
@@ -16,6 +16,8 @@ Codes for correcting and estimating attenuation on ZH and ZDR.
 import pyart
 import numpy as np
 
+from .fields import to_nan_array
+
 
 def correct_gaseous_attenuation(radar):
     """
@@ -69,15 +71,14 @@ def correct_attenuation_zdr(radar, gatefilter, zdr_name='ZDR_CORR', phidp_name='
     Returns:
     ========
         zdr_corr: array
-            Attenuation corrected differential reflectivity.
+            Attenuation corrected differential reflectivity (float32, NaN for
+            invalid gates).
     """
-    zdr = radar.fields[zdr_name]['data'].copy()
-    phi = radar.fields[phidp_name]['data'].copy()
+    zdr = to_nan_array(radar.fields[zdr_name]['data'], copy=False)
+    phi = to_nan_array(radar.fields[phidp_name]['data'], copy=False)
 
     zdr_corr = zdr + 0.016 * phi
     zdr_corr[gatefilter.gate_excluded] = np.NaN
-    zdr_corr = np.ma.masked_invalid(zdr_corr)
-    np.ma.set_fill_value(zdr_corr, np.NaN)
     # Z-PHI coefficient from Bringi et al. 2001
     zdr_meta = pyart.config.get_metadata('differential_reflectivity')
     zdr_meta['description'] = 'Attenuation corrected differential reflectivity using Bringi et al. 2001.'
@@ -120,5 +121,6 @@ def correct_attenuation_zh_pyart(radar, refl_field='DBZ', ncp_field='NCP',
                                                      phidp_field=phidp_field)
 
     zh_corr['_Least_significant_digit'] = 2
+    zh_corr['data'] = to_nan_array(zh_corr['data'])
     zh_corr['data'] += atten_gas
     return zh_corr
@@ -0,0 +1,81 @@
+"""
+Internal representation of the radar fields. The fields computed by the
+processing stages are contiguous float32 arrays, with NaN for the invalid
+gates (the NaN are the mask), instead of masked arrays. They are converted
+to Py-ART masked arrays only before writing.
+
+@title: fields
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institutions: Monash University and the Australian Bureau of Meteorology
+@date: 18/10/2026
+
+.. autosummary::
+    :toctree: generated/
+
+    to_masked
+    to_nan_array
+"""
+# Other Libraries
+import numpy as np
+
+
+def to_nan_array(data, dtype=np.float32, copy=True):
+    """
+    Convert a (masked) array to the internal representation: contiguous
+    float array with NaN for the masked gates.
+
+    Parameters:
+    ===========
+        data: array
+            Field data, masked or not.
+        dtype: type
+            Output type.
+        copy: bool
+            Always return a new array. If False, data is returned as is if it
+            is already a contiguous array of type dtype without mask, so it
+            must not be modified.
+
+    Returns:
+    ========
+        out: ndarray
+            Contiguous array with NaN for the masked gates.
+    """
+    mask = np.ma.getmask(data)
+    raw = np.ma.getdata(data)
+    out = np.ascontiguousarray(raw, dtype=dtype)
+    if (copy or mask is not np.ma.nomask) and np.shares_memory(out, raw):
+        out = out.copy()
+    if mask is not np.ma.nomask:
+        out[mask] = np.NaN
+
+    return out
+
+
+def to_masked(field):
+    """
+    Convert a field dictionary to Py-ART masked array, in place: the NaN
+    (and inf) of float fields, and the _FillValue of integer fields, are
+    masked. Fields that are already masked arrays are left as is.
+
+    Parameters:
+    ===========
+        field: dict
+            Py-ART field dictionary.
+
+    Returns:
+    ========
+        field: dict
+            Same field dictionary.
+    """
+    data = field['data']
+    if isinstance(data, np.ma.MaskedArray):
+        return field
+
+    if np.issubdtype(data.dtype, np.floating):
+        data = np.ma.masked_array(data, mask=~np.isfinite(data))
+        np.ma.set_fill_value(data, np.NaN)
+    elif '_FillValue' in field:
+        data = np.ma.masked_equal(data, field['_FillValue'])
+    field['data'] = data
+
+    return field
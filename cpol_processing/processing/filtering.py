@@ -13,6 +13,7 @@ Codes for creating and manipulating gate filters.
     do_gatefilter_cpol
     do_gatefilter
     filter_hardcoding
+    filter_hardcoding_fields
     velocity_texture
 """
 # Libraries
@@ -208,6 +209,39 @@ def filter_hardcoding(my_array, nuke_filter, bad=-9999):
     return np.ma.masked_where(filt_array == bad, filt_array)
 
 
+def filter_hardcoding_fields(radar, field_names, nuke_filter, bad=-9999):
+    """
+    Harcoding GateFilter into several fields, in place. Same result as
+    filter_hardcoding, without the temporary copies: the data of the gates
+    excluded by the filter or masked are set to the fill value, and masked.
+
+    Parameters:
+    ===========
+        radar:
+            Py-ART radar structure.
+        field_names: list
+            Names of the fields to clean out (missing fields are ignored).
+        nuke_filter: gatefilter
+            Filter we want to apply to the data.
+        bad: float
+            Fill value.
+    """
+    excluded = nuke_filter.gate_excluded
+    for name in field_names:
+        if name not in radar.fields.keys():
+            continue
+        field = radar.fields[name]
+        data = np.ma.getdata(field['data'])
+        mask = np.ma.getmask(field['data'])
+        if mask is np.ma.nomask:
+            data[excluded] = bad
+        else:
+            data[excluded | mask] = bad
+        field['data'] = np.ma.masked_array(data, mask=(data == bad), copy=False)
+
+    return None
+
+
 def velocity_texture(radar, vel_name='VEL'):
     """
     Compute velocity texture using new Bobby Jackson function in Py-ART.
@@ -20,7 +20,7 @@ Codes for estimating various parameters related to Hydrometeors.
 import pyart
 import numpy as np
 
-from csu_radartools import csu_liquid_ice_mass, csu_fhc, csu_blended_rain, csu_dsd
+from .fields import to_nan_array
 
 
 def dsd_retrieval(radar, gatefilter, kdp_name, zdr_name, refl_name='DBZ_CORR'):
@@ -41,27 +41,23 @@ def dsd_retrieval(radar, gatefilter, kdp_name, zdr_name, refl_name='DBZ_CORR'):
     Returns:
     ========
         nw_dict: dict
-            Normalized Intercept Parameter.
+            Normalized Intercept Parameter (float32, NaN for invalid gates).
         d0_dict: dict
-            Median Volume Diameter.
+            Median Volume Diameter (float32, NaN for invalid gates).
     """
-    dbz = radar.fields[refl_name]['data'].copy().filled(np.NaN)
-    zdr = radar.fields[zdr_name]['data'].copy()
-    try:
-        kdp = radar.fields[kdp_name]['data'].copy().filled(np.NaN)
-    except AttributeError:
-        kdp = radar.fields[kdp_name]['data'].copy()
+    dbz = to_nan_array(radar.fields[refl_name]['data'])
+    zdr = to_nan_array(radar.fields[zdr_name]['data'])
+    kdp = to_nan_array(radar.fields[kdp_name]['data'])
+
+    from csu_radartools import csu_dsd
 
     d0, Nw, mu = csu_dsd.calc_dsd(dz=dbz, zdr=zdr, kdp=kdp, band='C')
 
-    Nw = np.log10(Nw)
+    Nw = np.log10(Nw).astype(np.float32)
     Nw[gatefilter.gate_excluded] = np.NaN
-    Nw = np.ma.masked_invalid(Nw).astype(np.float32)
-    np.ma.set_fill_value(Nw, np.NaN)
 
+    d0 = d0.astype(np.float32)
     d0[gatefilter.gate_excluded] = np.NaN
-    d0 = np.ma.masked_invalid(d0).astype(np.float32)
-    np.ma.set_fill_value(d0, np.NaN)
 
     nw_dict = {'data': Nw,
                'units': 'AU', 'long_name': 'Normalized Intercept Parameter',
@@ -107,11 +103,11 @@ def hydrometeor_classification(radar, gatefilter, kdp_name, zdr_name, refl_name=
     Returns:
     ========
         hydro_meta: dict
-            Hydrometeor classification.
+            Hydrometeor classification (int16, 0 for invalid gates).
     """
-    refl = radar.fields[refl_name]['data'].copy().filled(np.NaN)
-    zdr = radar.fields[zdr_name]['data'].copy().filled(np.NaN)
-    kdp = radar.fields[kdp_name]['data'].copy().filled(np.NaN)
+    refl = to_nan_array(radar.fields[refl_name]['data'])
+    zdr = to_nan_array(radar.fields[zdr_name]['data'])
+    kdp = to_nan_array(radar.fields[kdp_name]['data'])
     rhohv = radar.fields[rhohv_name]['data']
     try:
         radar_T = radar.fields[temperature_name]['data']
@@ -119,14 +115,15 @@ def hydrometeor_classification(radar, gatefilter, kdp_name, zdr_name, refl_name=
     except Exception:
         use_temperature = False
 
+    from csu_radartools import csu_fhc
+
     if use_temperature:
         scores = csu_fhc.csu_fhc_summer(dz=refl, zdr=zdr, rho=rhohv, kdp=kdp, use_temp=True, band='C', T=radar_T)
     else:
         scores = csu_fhc.csu_fhc_summer(dz=refl, zdr=zdr, rho=rhohv, kdp=kdp, use_temp=False, band='C')
 
-    hydro = np.argmax(scores, axis=0) + 1
-    hydro[gatefilter.gate_excluded] = 0
-    hydro_data = np.ma.masked_equal(hydro.astype(np.int16), 0)
+    hydro_data = (np.argmax(scores, axis=0) + 1).astype(np.int16)
+    hydro_data[gatefilter.gate_excluded] = 0
 
     the_comments = "1: Drizzle; 2: Rain; 3: Ice Crystals; 4: Aggregates; " +\
                    "5: Wet Snow; 6: Vertical Ice; 7: LD Graupel; 8: HD Graupel; 9: Hail; 10: Big Drops"
@@ -205,13 +202,12 @@ def rainfall_rate(radar, gatefilter, kdp_name, zdr_name, refl_name='DBZ_CORR',
         rainrate: dict
             Rainfall rate.
     """
-    dbz = radar.fields[refl_name]['data'].filled(np.NaN)
-    zdr = radar.fields[zdr_name]['data'].filled(np.NaN)
+    dbz = to_nan_array(radar.fields[refl_name]['data'], copy=False)
+    zdr = to_nan_array(radar.fields[zdr_name]['data'], copy=False)
     fhc = radar.fields[hydro_name]['data']
-    try:
-        kdp = radar.fields[kdp_name]['data'].filled(np.NaN)
-    except AttributeError:
-        kdp = radar.fields[kdp_name]['data']
+    kdp = to_nan_array(radar.fields[kdp_name]['data'], copy=False)
+
+    from csu_radartools import csu_blended_rain
 
     rain, _ = csu_blended_rain.calc_blended_rain_tropical(dz=dbz, zdr=zdr, kdp=kdp, fhc=fhc, band='C')
 
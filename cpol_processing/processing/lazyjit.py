@@ -0,0 +1,46 @@
+"""
+Numba compilation on the first call: numba is only imported when a compiled
+kernel is first used, not when the processing modules are imported.
+
+@title: lazyjit
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institutions: Monash University and the Australian Bureau of Meteorology
+@date: 18/10/2026
+
+.. autosummary::
+    :toctree: generated/
+
+    lazy_jit
+"""
+# Python Standard Library
+import functools
+
+
+def lazy_jit(function):
+    """
+    Decorator equivalent to numba.jit(nopython=True, cache=True), except that
+    numba is imported and the function is compiled (or loaded from the cache)
+    on its first call.
+
+    Parameters:
+    ===========
+        function: function
+            Python function to compile.
+
+    Returns:
+    ========
+        wrapper: function
+            Function calling the compiled function.
+    """
+    compiled = None
+
+    @functools.wraps(function)
+    def wrapper(*args):
+        nonlocal compiled
+        if compiled is None:
+            from numba import jit
+
+            compiled = jit(nopython=True, cache=True)(function)
+        return compiled(*args)
+
+    return wrapper
@@ -26,14 +26,12 @@ import scipy
 import netCDF4
 import numpy as np
 
-from numba import jit
 from scipy import integrate, ndimage
 from scipy.interpolate import interp1d
-from csu_radartools import csu_kdp
 
 from pyart.correct.phase_proc import smooth_and_trim_scan
-from sklearn.linear_model import LinearRegression
-from sklearn.isotonic import IsotonicRegression
+
+from .lazyjit import lazy_jit
 
 
 def fix_phidp_from_kdp(phidp, kdp, r, gatefilter):
@@ -103,6 +101,8 @@ def phidp_bringi(radar, gatefilter, unfold_phidp_name="PHI_UNF", refl_field='DBZ
     [R, A] = np.meshgrid(rng, azi)
 
     # Compute KDP bringi.
+    from csu_radartools import csu_kdp
+
     kdpb, phidpb, _ = csu_kdp.calc_kdp_bringi(dp, dz, R / 1e3, gs=dgate, bad=-9999, thsd=12, window=3.0, std_gate=11)
 
     # Mask array
@@ -254,6 +254,8 @@ def valentin_phase_processing(radar, gatefilter, phidp_name='PHIDP', dbz_name='D
         phitot: dict
             Processed differential phase.
     """
+    from sklearn.isotonic import IsotonicRegression
+
     # Check if PHIDP is in a 180 deg or 360 deg interval.
     nyquist = 90
     cutoff = 80
@@ -269,7 +271,11 @@ def valentin_phase_processing(radar, gatefilter, phidp_name='PHIDP', dbz_name='D
     unfphidict = pyart.correct.dealias_unwrap_phase(radar, gatefilter=gatefilter, skip_checks=True,
                                                     vel_field=phidp_name, nyquist_vel=90)
     # pyart.correct.dealias_region_based(radar, gatefilter=gatefilter, vel_field=phidp_name, nyquist_vel=nyquist)
-    unfphi = unfphidict['data']
+    # Data and mask are handled separately, the mask being the gates masked
+    # by the dealiasing. float32 whatever the Py-ART version, as compiled by
+    # warmup for elim_isolated.
+    unfphi = np.ma.getdata(unfphidict['data']).astype(np.float32, copy=False)
+    invalid = np.ma.getmaskarray(unfphidict['data'])
     if scale_phi:
         radar.fields[phidp_name]['data'] += 90
         unfphi += 90
@@ -280,20 +286,20 @@ def valentin_phase_processing(radar, gatefilter, phidp_name='PHIDP', dbz_name='D
     phitot = np.zeros_like(unfphi) + np.NaN
     unfphi[gatefilter.gate_excluded] = np.NaN
     nraymax, ngatemax = unfphi.shape
-    x = radar.range['data'].copy()
+    x = np.ma.getdata(radar.range['data']).copy()
+    near = x < 5e3
 
     for ray in range(0, nraymax):
         # Taking the average the direct neighbours of each ray.
         y = unfphi[ray, :]
-        y[x < 5e3] = 0  # Close to the radar is always extremly noisy
+        y[near] = 0  # Close to the radar is always extremly noisy
 
         y = elim_isolated(y)
 
-        y = np.ma.masked_invalid(y)
-        pos = ~y.mask
+        pos = ~((invalid[ray, :] & ~near) | np.isnan(y))
 
-        x_nomask = x[pos].filled(np.NaN)
-        y_nomask = y[pos].filled(np.NaN)
+        x_nomask = x[pos]
+        y_nomask = y[pos]
 
         if len(y_nomask[x_nomask > 5e3]) == 0:
             phitot[ray, :] = 0
@@ -318,8 +324,6 @@ def valentin_phase_processing(radar, gatefilter, phidp_name='PHIDP', dbz_name='D
 
     phitot = phitot.astype(np.float32)
     # phitot[gatefilter.gate_excluded] = np.NaN
-    phitot = np.ma.masked_invalid(phitot)
-    np.ma.set_fill_value(phitot, np.NaN)
     phi_unfold['data'] = phitot
     phi_unfold['_FillValue'] = np.NaN
     phi_unfold['_Least_significant_digit'] = 2
@@ -329,8 +333,6 @@ def valentin_phase_processing(radar, gatefilter, phidp_name='PHIDP', dbz_name='D
     kdp = kdp.astype(np.float32)
     # kdp[gatefilter.gate_excluded] = np.NaN
     kdp_meta = pyart.config.get_metadata('specific_differential_phase')
-    kdp = np.ma.masked_invalid(kdp)
-    np.ma.set_fill_value(kdp, np.NaN)
     kdp_meta['data'] = kdp
     kdp_meta['_FillValue'] = np.NaN
     kdp_meta['_Least_significant_digit'] = 4
@@ -339,7 +341,7 @@ def valentin_phase_processing(radar, gatefilter, phidp_name='PHIDP', dbz_name='D
     return phi_unfold, kdp_meta
 
 
-@jit(nopython=True)
+@lazy_jit
 def populate_radials(y_map, ngatemax):
     ygrad = np.diff(y_map)
     pos = np.where(ygrad > 12)[0]
@@ -359,7 +361,7 @@ def populate_radials(y_map, ngatemax):
     return y_rslt
 
 
-@jit(nopython=True)
+@lazy_jit
 def elim_isolated(mydata):
     for idx in range(1, len(mydata) - 1):
         if np.isnan(mydata[idx - 1]) and np.isnan(mydata[idx + 1]):
@@ -10,13 +10,17 @@ Codes for correcting and estimating various radar and meteorological parameters.
 .. autosummary::
     :toctree: generated/
 
+    _get_odim_field_data
     _my_snr_from_reflectivity
     _nearest
+    _read_odim_h5_lazy
     check_azimuth
     check_reflectivity
     check_year
     correct_rhohv
     correct_zdr
+    get_field_aliases
+    get_radar_start_date
     get_radiosoundings
     read_radar
     snr_and_sounding
@@ -28,6 +32,7 @@ import glob
 import time
 import fnmatch
 import datetime
+import functools
 
 from copy import deepcopy
 
@@ -37,6 +42,31 @@ import scipy
 import netCDF4
 import numpy as np
 
+from .fields import to_nan_array
+
+
+# Field names used by other radars (e.g. SEAPOL) and their production line
+# equivalent.
+FIELD_ALIASES = [('SQIH', 'NCP'),
+                 ('NCPH', "NCP"),
+                 ('SNRH', 'SNR'),
+                 ('normalized_coherent_power', "NCP"),
+                 ('DBZH', "DBZ"),
+                 ("DBZH_CLEAN", "DBZ"),
+                 ('reflectivity', "DBZ"),
+                 ('WRADH', "WIDTH"),
+                 ('WIDTHH', "WIDTH"),
+                 ('sprectrum_width', "WIDTH"),
+                 ('UH', "DBZ"),
+                 ('total_power', "DBZ"),
+                 ("differential_reflectivity", "ZDR"),
+                 ("VRADH", "VEL"),
+                 ('VELH', "VEL"),
+                 ('velocity', "VEL"),
+                 ("cross_correlation_ratio", "RHOHV"),
+                 ("differential_phase", "PHIDP"),
+                 ("specific_differential_phase", "KDP")]
+
 
 def _my_snr_from_reflectivity(radar, refl_field='DBZ'):
     """
@@ -91,8 +121,9 @@ def _nearest(items, pivot):
 
 def check_azimuth(radar, refl_field_name='DBZ'):
     """
-    Checking if radar has a proper reflectivity field.  It's a minor problem
-    concerning a few days in 2011 for CPOL.
+    Checking if radar has a proper azimuth field.  It's a minor problem
+    concerning a few days in 2011 for CPOL. Only the metadata are used, so
+    that no field is loaded.
 
     Parameters:
     ===========
@@ -105,7 +136,7 @@ def check_azimuth(radar, refl_field_name='DBZ'):
     =======
         True if radar has a proper azimuth field.
     """
-    if radar.fields[refl_field_name]['data'].shape[0] < 360:
+    if len(radar.azimuth['data']) < 360:
         return False
 
     return True
@@ -255,10 +286,11 @@ def correct_zdr(radar, zdr_name='ZDR', snr_name='SNR'):
     Returns:
     ========
         corr_zdr: array
-            Corrected differential reflectivity.
+            Corrected differential reflectivity (float32, NaN for invalid
+            gates).
     """
-    zdr = radar.fields[zdr_name]['data'].copy()
-    snr = radar.fields[snr_name]['data'].copy()
+    zdr = to_nan_array(radar.fields[zdr_name]['data'], copy=False)
+    snr = to_nan_array(radar.fields[snr_name]['data'], copy=False)
     alpha = 1.48
     natural_zdr = 10**(0.1 * zdr)
     natural_snr = 10**(0.1 * snr)
@@ -267,6 +299,69 @@ def correct_zdr(radar, zdr_name='ZDR', snr_name='SNR'):
     return corr_zdr
 
 
+def get_radar_start_date(radar_file_name):
+    """
+    Get the radar start time by reading only the metadata of the input file.
+    The same corrections as in the production line are applied (time units
+    and century).
+
+    Parameter:
+    ==========
+        radar_file_name: str
+            Radar file name.
+
+    Return:
+    =======
+        radar_start_date: datetime
+            Radar start time, None if it could not be read.
+    """
+    try:
+        if ".h5" in radar_file_name or ".hdf" in radar_file_name:
+            radar = pyart.aux_io.read_odim_h5(radar_file_name, file_field_names=True, include_fields=[])
+            time_data = radar.time['data'][0]
+            time_units = radar.time['units']
+        elif ".nc" in radar_file_name:
+            with netCDF4.Dataset(radar_file_name) as ncid:
+                time_data = ncid['time'][0]
+                time_units = ncid['time'].units
+        else:
+            radar = pyart.io.read(radar_file_name, include_fields=[], delay_field_loading=True)
+            time_data = radar.time['data'][0]
+            time_units = radar.time['units']
+
+        time_units = time_units.replace("since", "since ")
+        dtime = netCDF4.num2date(time_data, time_units)
+        if dtime.year >= 2050:
+            time_units = time_units.replace(str(dtime.year), str(dtime.year - 100))
+            dtime = netCDF4.num2date(time_data, time_units)
+    except Exception:
+        return None
+
+    return dtime
+
+
+def get_field_aliases(field_names):
+    """
+    Add to a list of field names all their known aliases in the input files.
+
+    Parameters:
+    ===========
+        field_names: list
+            Field names, as used in the production line.
+
+    Returns:
+    ========
+        all_names: list
+            Field names and their aliases.
+    """
+    all_names = list(field_names)
+    for mykey, newkey in FIELD_ALIASES:
+        if newkey in field_names and mykey not in all_names:
+            all_names.append(mykey)
+
+    return all_names
+
+
 def get_radiosoundings(sound_dir, radar_start_date):
     """
     Find the radiosoundings
@@ -303,7 +398,104 @@ def get_radiosoundings(sound_dir, radar_start_date):
     return sonde_name
 
 
-def read_radar(radar_file_name):
+def _get_odim_field_data(radar_file_name, data_key, rays_per_sweep, ngates):
+    """
+    Decode one field of an ODIM H5 file, sweep by sweep. This is the same
+    decoding as in Py-ART ODIM reader.
+
+    Parameters:
+    ===========
+        radar_file_name: str
+            Radar file name.
+        data_key: str
+            Name of the data group of the field (e.g. data1).
+        rays_per_sweep: array
+            Number of rays in each sweep.
+        ngates: int
+            Maximum number of gates.
+
+    Returns:
+    ========
+        fdata: masked array
+            Field data.
+    """
+    import h5py
+
+    fdata = np.ma.zeros((np.sum(rays_per_sweep), ngates), dtype=np.float32)
+    with h5py.File(radar_file_name, 'r') as hfile:
+        datasets = sorted([k for k in hfile if k.startswith("dataset")], key=lambda x: int(x[7:]))
+        start = 0
+        for dset, nrays in zip(datasets, rays_per_sweep):
+            try:
+                group = hfile[dset][data_key]
+            except KeyError:
+                fdata[start: start + nrays] = np.NaN
+                start += nrays
+                continue
+
+            what = group['what'].attrs
+            sweep_data = np.ma.masked_array(group['data'][:])
+            if 'nodata' in what:
+                sweep_data = np.ma.masked_equal(sweep_data, what['nodata'])
+            if 'undetect' in what:
+                sweep_data[sweep_data == what['undetect']] = np.ma.masked
+            sweep_data = sweep_data * what.get('gain', 1.0) + what.get('offset', 0.0)
+
+            nbins = sweep_data.shape[1]
+            fdata[start: start + nrays, :nbins] = sweep_data
+            fdata[start: start + nrays, nbins:] = np.NaN
+            start += nrays
+
+    return fdata
+
+
+def _read_odim_h5_lazy(radar_file_name, include_fields=None):
+    """
+    Read an ODIM H5 file. Only the reflectivity is decoded, the other fields
+    are loaded on first access.
+
+    Parameter:
+    ==========
+        radar_file_name: str
+            Radar file name.
+        include_fields: list
+            Field names (as in the file) to read. None reads every field.
+
+    Return:
+    =======
+        radar: struct
+            Py-ART radar structure.
+    """
+    import h5py
+    from pyart.lazydict import LazyLoadDict
+
+    with h5py.File(radar_file_name, 'r') as hfile:
+        data_keys = [k for k in hfile['dataset1'] if k.startswith('data')]
+        quantities = []
+        for k in data_keys:
+            quantity = hfile['dataset1'][k]['what'].attrs['quantity']
+            if isinstance(quantity, bytes):
+                quantity = quantity.decode('utf-8')
+            quantities.append(quantity)
+
+    refl_names = [q for q in get_field_aliases(['DBZ']) if q in quantities]
+    radar = pyart.aux_io.read_odim_h5(radar_file_name, file_field_names=True, include_fields=refl_names[:1])
+
+    rays_per_sweep = radar.sweep_end_ray_index['data'] - radar.sweep_start_ray_index['data'] + 1
+    for data_key, quantity in zip(data_keys, quantities):
+        if quantity in radar.fields:
+            continue
+        if include_fields is not None and quantity not in include_fields:
+            continue
+        field_dic = LazyLoadDict({'_FillValue': pyart.config.get_fillvalue()})
+        field_dic.set_lazy('data', functools.partial(_get_odim_field_data, radar_file_name, data_key,
+                                                     rays_per_sweep, radar.ngates))
+        radar.fields[quantity] = field_dic
+
+    return radar
+
+
+def read_radar(radar_file_name, include_fields=None, lazy=False):
     """
     Read the input radar file.
 
@@ -311,20 +503,34 @@ def read_radar(radar_file_name):
     ==========
         radar_file_name: str
             Radar file name.
+        include_fields: list
+            Fields to read (using the names of the production line, i.e. DBZ,
+            VEL, ...). Their aliases in the file are automatically added. None
+            reads every field.
+        lazy: bool
+            Only read the metadata, fields are loaded on first access (only
+            the reflectivity is decoded right away for ODIM files).
 
     Return:
     =======
         radar: struct
             Py-ART radar structure.
     """
+    if include_fields is not None:
+        include_fields = get_field_aliases(include_fields)
+
     # Read the input radar file.
     try:
-        if ".h5" in radar_file_name:
-            radar = pyart.aux_io.read_odim_h5(radar_file_name, file_field_names=True)
-        elif ".hdf" in radar_file_name:
-            radar = pyart.aux_io.read_odim_h5(radar_file_name, file_field_names=True)
+        if ".h5" in radar_file_name or ".hdf" in radar_file_name:
+            if lazy:
+                radar = _read_odim_h5_lazy(radar_file_name, include_fields=include_fields)
+            else:
+                radar = pyart.aux_io.read_odim_h5(radar_file_name, file_field_names=True,
+                                                  include_fields=include_fields)
+        elif lazy:
+            radar = pyart.io.read(radar_file_name, include_fields=include_fields, delay_field_loading=True)
         else:
-            radar = pyart.io.read(radar_file_name)
+            radar = pyart.io.read(radar_file_name, include_fields=include_fields)
     except Exception:
         raise
 
@@ -332,30 +538,11 @@ def read_radar(radar_file_name):
     try:
         radar.fields['DBZ']
     except KeyError:
-        myfields = [('SQIH', 'NCP'),
-                    ('NCPH', "NCP"),
-                    ('SNRH', 'SNR'),
-                    ('normalized_coherent_power', "NCP"),
-                    ('DBZH', "DBZ"),
-                    ("DBZH_CLEAN", "DBZ"),
-                    ('reflectivity', "DBZ"),
-                    ('WRADH', "WIDTH"),
-                    ('WIDTHH', "WIDTH"),
-                    ('sprectrum_width', "WIDTH"),
-                    ('UH', "DBZ"),
-                    ('total_power', "DBZ"),
-                    ("differential_reflectivity", "ZDR"),
-                    ("VRADH", "VEL"),
-                    ('VELH', "VEL"),
-                    ('velocity', "VEL"),
-                    ("cross_correlation_ratio", "RHOHV"),
-                    ("differential_phase", "PHIDP"),
-                    ("specific_differential_phase", "KDP")]
-        for mykey, newkey in myfields:
-            try:
-                radar.add_field(newkey, radar.fields.pop(mykey))
-            except Exception:
+        for mykey, newkey in FIELD_ALIASES:
+            if mykey not in radar.fields or newkey in radar.fields:
                 continue
+            # Not using add_field, it would trigger the loading of lazy fields.
+            radar.fields[newkey] = radar.fields.pop(mykey)
 
     return radar
 
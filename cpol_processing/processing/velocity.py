@@ -10,14 +10,25 @@ Codes for correcting Doppler velocity.
 .. autosummary::
     :toctree: generated/
 
+    _geometry_key
+    _read_wind_profile
+    _simulate_compact_velocity
+    _unfold_ambiguous_gates
     corr_velocity_from_phidp_artifacts
     correct_velocity_unfolding
     get_simulated_wind_profile
+    unfold_from_reference
     unfold_velocity
+    update_velocity_reference
 """
 
 # Python Standard Library
+import os
+import hashlib
+import functools
+
 from copy import deepcopy
+from collections import OrderedDict
 
 # Other Libraries
 import pyart
@@ -25,7 +36,13 @@ import netCDF4
 import numpy as np
 
 from netCDF4 import num2date
-from unravel.dealias import process_3D
+
+from .lazyjit import lazy_jit
+
+# Horizontal winds interpolated on the gates of each sweep (see
+# _simulate_compact_velocity), keyed by radiosonde and scan strategy.
+_SIMVEL_CACHE = OrderedDict()
+_SIMVEL_CACHE_SIZE = 32
 
 
 def check_nyquist_velocity(radar, vel_name='VEL'):
@@ -68,6 +85,8 @@ def unravel(radar, gatefilter, vel_name='VEL', dbz_name='DBZ'):
     vel_meta: dict
         Unfolded Doppler velocity.
     """
+    from unravel.dealias import process_3D
+
     unfvel = process_3D(radar, velname=vel_name, dbzname=dbz_name, do_3D=False)
     np.ma.set_fill_value(unfvel, np.NaN)
     vel_meta = pyart.config.get_metadata('velocity')
@@ -126,9 +145,125 @@ def correct_velocity_unfolding(radar, vel_name="VEL_UNFOLDED", simvel_name="sim_
     return velmeta
 
 
+def _geometry_key(radar):
+    """
+    Build a hashable signature of the radar scan geometry, from the values
+    that do not change from one volume to the next of the same scan strategy
+    (the actual azimuths and elevations do).
+
+    Parameters:
+    ===========
+    radar:
+        Py-ART radar data structure.
+
+    Returns:
+    ========
+    key: str
+        Digest of the range gates, fixed angles, rays per sweep and radar
+        altitude.
+    """
+    md5 = hashlib.md5()
+    md5.update(np.ascontiguousarray(np.ma.getdata(radar.range['data']), dtype=np.float32).tobytes())
+    md5.update(np.round(np.ma.getdata(radar.fixed_angle['data']).astype(np.float64), 2).tobytes())
+    md5.update(np.ascontiguousarray(np.ma.getdata(radar.rays_per_sweep['data']), dtype=np.int64).tobytes())
+    md5.update(np.round(np.ma.getdata(radar.altitude['data']).astype(np.float64).ravel()[:1]).tobytes())
+
+    return md5.hexdigest()
+
+
+@functools.lru_cache(maxsize=16)
+def _read_wind_profile(radiosonde_fname, mtime, height_name="height", speed_name="wspeed", wdir_name="wdir"):
+    """
+    Read the radiosonde and build its horizontal wind profile. The result is
+    cached per file, the modification time being part of the cache key so
+    that an updated sounding is read again.
+
+    Parameters:
+    ===========
+    radiosonde_fname: str
+        Radiosonde file name.
+    mtime: float
+        Modification time of the radiosonde file.
+
+    Returns:
+    ========
+    hwind_prof: HorizontalWindProfile
+        Py-ART horizontal wind profile.
+    """
+    from ..output import NETCDF_LOCK
+
+    # Serialized with the netCDF writes of a WriteBehind thread.
+    with NETCDF_LOCK:
+        with netCDF4.Dataset(radiosonde_fname) as interp_sonde:
+            height = interp_sonde[height_name][:]
+            speed = interp_sonde[speed_name][:]
+            wdir = interp_sonde[wdir_name][:]
+
+    hwind_prof = pyart.core.HorizontalWindProfile(height, speed, wdir)
+    return hwind_prof
+
+
+def _simulate_compact_velocity(radar, hwind_prof):
+    """
+    Interpolate the horizontal wind on the gates of each sweep, in a compact
+    form (nsweeps, ngates). The gate altitude is computed with the fixed
+    angle of the sweep instead of the elevation of each ray, as Py-ART
+    simulated_vel_from_profile does, so that the result only depends on the
+    scan strategy and can be reused for the following volumes. The actual
+    elevation of a PPI stays within about 0.1 deg of its fixed angle, i.e. a
+    gate altitude error below 300 m at 150 km, small compared to the
+    vertical resolution of the radiosonde winds once interpolated.
+
+    Parameters:
+    ===========
+    radar:
+        Py-ART radar data structure.
+    hwind_prof: HorizontalWindProfile
+        Horizontal wind profile.
+
+    Returns:
+    ========
+    compact: dict
+        u and v winds per sweep and range (nsweeps, ngates).
+    """
+    height = np.ma.filled(np.ma.masked_invalid(hwind_prof.height).astype(np.float64), np.NaN)
+    u_wind = np.ma.filled(np.ma.masked_invalid(hwind_prof.u_wind).astype(np.float64), np.NaN)
+    v_wind = np.ma.filled(np.ma.masked_invalid(hwind_prof.v_wind).astype(np.float64), np.NaN)
+    pos = np.isfinite(height) & np.isfinite(u_wind) & np.isfinite(v_wind)
+    height, u_wind, v_wind = height[pos], u_wind[pos], v_wind[pos]
+    order = np.argsort(height)
+    height, u_wind, v_wind = height[order], u_wind[order], v_wind[order]
+
+    rng = np.ma.getdata(radar.range['data'])
+    altitude = np.ma.getdata(radar.altitude['data']).ravel()[0]
+    elevation = np.ma.getdata(radar.elevation['data'])
+    fixed_angle = np.ma.getdata(radar.fixed_angle['data'])
+
+    u_gate = np.zeros((radar.nsweeps, radar.ngates), dtype=np.float32)
+    v_gate = np.zeros((radar.nsweeps, radar.ngates), dtype=np.float32)
+    for sweep, sl in enumerate(radar.iter_slice()):
+        elev = fixed_angle[sweep]
+        if not np.isfinite(elev):
+            elev = np.mean(elevation[sl])
+        _, _, z = pyart.core.antenna_to_cartesian(rng / 1000, 0, elev)
+        gate_altitude = z + altitude
+        u_gate[sweep] = np.interp(gate_altitude, height, u_wind, left=np.NaN, right=np.NaN)
+        v_gate[sweep] = np.interp(gate_altitude, height, v_wind, left=np.NaN, right=np.NaN)
+
+    compact = {'u': u_gate, 'v': v_gate}
+
+    return compact
+
+
 def get_simulated_wind_profile(radar, radiosonde_fname, height_name="height", speed_name="wspeed", wdir_name="wdir"):
     """
-    Simulate the horizontal wind profile for the radar.
+    Simulate the horizontal wind profile for the radar. The radiosonde wind
+    profile is cached per file and the winds interpolated on the gates are
+    cached per (radiosonde, scan strategy), so that they are only computed
+    once per day in a batch processing. Only the projection on the beam of
+    each ray is computed for every volume. Not called by the production line
+    (as in its original version): it provides the sim_velocity field used by
+    correct_velocity_unfolding and unfold_velocity(constrain_sounding=True).
 
     Parameters
     ==========
@@ -142,16 +277,34 @@ def get_simulated_wind_profile(radar, radiosonde_fname, height_name="height", sp
     sim_vel: dict
         Simulated velocity.
     """
-    interp_sonde = netCDF4.Dataset(radiosonde_fname)
-    hwind_prof = pyart.core.HorizontalWindProfile(interp_sonde[height_name],
-                                                  interp_sonde[speed_name],
-                                                  interp_sonde[wdir_name],)
-    sim_vel = pyart.util.simulated_vel_from_profile(radar, hwind_prof)
+    mtime = os.path.getmtime(radiosonde_fname)
+    key = (radiosonde_fname, mtime, height_name, speed_name, wdir_name, _geometry_key(radar))
     try:
-        sim_vel['units'] = "m/s"
-        sim_vel['standard_name'] = "simulated_radial_velocity"
-    except Exception:
-        pass
+        compact = _SIMVEL_CACHE[key]
+        _SIMVEL_CACHE.move_to_end(key)
+    except KeyError:
+        hwind_prof = _read_wind_profile(radiosonde_fname, mtime, height_name, speed_name, wdir_name)
+        compact = _simulate_compact_velocity(radar, hwind_prof)
+        _SIMVEL_CACHE[key] = compact
+        if len(_SIMVEL_CACHE) > _SIMVEL_CACHE_SIZE:
+            _SIMVEL_CACHE.popitem(last=False)
+
+    # Projection on the beam of each ray (actual azimuth and elevation),
+    # broadcast along range.
+    sweep_number = np.zeros(radar.nrays, dtype=np.int32)
+    for sweep, sl in enumerate(radar.iter_slice()):
+        sweep_number[sl] = sweep
+    azimuth = np.deg2rad(np.ma.getdata(radar.azimuth['data']))
+    cos_elev = np.cos(np.deg2rad(np.ma.getdata(radar.elevation['data'])))
+    sin_azimuth = (np.sin(azimuth) * cos_elev).astype(np.float32)
+    cos_azimuth = (np.cos(azimuth) * cos_elev).astype(np.float32)
+    sim_data = (compact['u'][sweep_number] * sin_azimuth[:, np.newaxis] +
+                compact['v'][sweep_number] * cos_azimuth[:, np.newaxis])
+
+    sim_vel = pyart.config.get_metadata('simulated_velocity')
+    sim_vel['data'] = np.ma.masked_invalid(sim_data)
+    sim_vel['units'] = "m/s"
+    sim_vel['standard_name'] = "simulated_radial_velocity"
 
     return sim_vel
 
@@ -211,7 +364,7 @@ def unfold_velocity(radar, my_gatefilter, bobby_params=False, constrain_sounding
             i = i + 1
         return gradient_vector
 
-    gf = deepcopy(my_gatefilter)
+    gf = my_gatefilter.copy()
     # Trying to determine Nyquist velocity
     try:
         v_nyq_vel = radar.instrument_parameters['nyquist_velocity']['data'][0]
@@ -269,3 +422,219 @@ def unfold_velocity(radar, my_gatefilter, bobby_params=False, constrain_sounding
     vdop_vel['description'] = "Velocity unfolded using Py-ART region based dealiasing algorithm."
 
     return vdop_vel
+
+
+@lazy_jit
+def _unfold_ambiguous_gates(vel, unfolded, resolved, vnyq, max_diff):
+    """
+    Continuity search restricted to the ambiguous gates. Each unresolved gate
+    is unfolded against its nearest resolved neighbour, along the range (both
+    directions) and then along the azimuth, until nothing changes anymore.
+    """
+    nrays, ngates = vel.shape
+    changed = True
+    while changed:
+        changed = False
+        for ray in range(nrays):
+            # Along range, outward then inward.
+            last = np.NaN
+            for gate in range(ngates):
+                if resolved[ray, gate]:
+                    last = unfolded[ray, gate]
+                elif np.isfinite(vel[ray, gate]) and np.isfinite(last):
+                    k = np.round((last - vel[ray, gate]) / (2 * vnyq))
+                    value = vel[ray, gate] + 2 * k * vnyq
+                    if np.abs(value - last) <= max_diff * vnyq:
+                        unfolded[ray, gate] = value
+                        resolved[ray, gate] = True
+                        last = value
+                        changed = True
+            last = np.NaN
+            for gate in range(ngates - 1, -1, -1):
+                if resolved[ray, gate]:
+                    last = unfolded[ray, gate]
+                elif np.isfinite(vel[ray, gate]) and np.isfinite(last):
+                    k = np.round((last - vel[ray, gate]) / (2 * vnyq))
+                    value = vel[ray, gate] + 2 * k * vnyq
+                    if np.abs(value - last) <= max_diff * vnyq:
+                        unfolded[ray, gate] = value
+                        resolved[ray, gate] = True
+                        last = value
+                        changed = True
+
+        # Along azimuth (the sweep wraps around).
+        for ray in range(nrays):
+            for gate in range(ngates):
+                if resolved[ray, gate] or not np.isfinite(vel[ray, gate]):
+                    continue
+                for neighbour in (ray - 1, (ray + 1) % nrays):
+                    if resolved[neighbour, gate]:
+                        last = unfolded[neighbour, gate]
+                        k = np.round((last - vel[ray, gate]) / (2 * vnyq))
+                        value = vel[ray, gate] + 2 * k * vnyq
+                        if np.abs(value - last) <= max_diff * vnyq:
+                            unfolded[ray, gate] = value
+                            resolved[ray, gate] = True
+                            changed = True
+                            break
+
+    return unfolded, resolved
+
+
+def update_velocity_reference(reference, radar, vel_name='VEL_UNFOLDED'):
+    """
+    Store the unfolded velocity of a volume as the first-guess field for the
+    next one. The reference is kept per sweep (indexed by its fixed angle)
+    with its rays sorted by azimuth.
+
+    Parameters:
+    ===========
+    reference: dict
+        Velocity reference, updated in place.
+    radar:
+        Py-ART radar structure.
+    vel_name: str
+        Name of the unfolded velocity field.
+    """
+    reference.clear()
+    try:
+        vel = radar.fields[vel_name]['data']
+    except KeyError:
+        return None
+
+    vel = np.ma.filled(np.ma.masked_invalid(vel).astype(np.float32), np.NaN)
+    azimuth = np.ma.getdata(radar.azimuth['data'])
+    elevation = np.ma.getdata(radar.elevation['data'])
+
+    sweeps = dict()
+    for sweep, sl in enumerate(radar.iter_slice()):
+        try:
+            angle = float(radar.fixed_angle['data'][sweep])
+        except Exception:
+            angle = float(np.mean(elevation[sl]))
+        order = np.argsort(azimuth[sl])
+        sweeps[round(angle, 1)] = {'azimuth': azimuth[sl][order],
+                                   'data': vel[sl][order]}
+
+    reference['time'] = num2date(radar.time['data'][0], radar.time['units'])
+    reference['sweeps'] = sweeps
+
+    return None
+
+
+def unfold_from_reference(radar, gatefilter, reference, vel_name='VEL', max_diff=0.4,
+                          min_resolved=0.9, max_age=1800):
+    """
+    Dealias Doppler velocity using the unfolded velocity of the previous
+    volume as a first-guess field. Gates close enough to the reference are
+    directly resolved, and the continuity search only runs on the remaining
+    ambiguous gates.
+
+    Parameters:
+    ===========
+    radar:
+        Py-ART radar structure.
+    gatefilter:
+        GateFilter
+    reference: dict
+        Velocity reference built by update_velocity_reference.
+    vel_name: str
+        Name of the (original) Doppler velocity field.
+    max_diff: float
+        Maximum difference with the reference, as a fraction of the Nyquist
+        velocity, for a gate to be considered resolved.
+    min_resolved: float
+        Minimum fraction of valid gates that must be resolved directly
+        against the reference (not by the continuity search). Below, the
+        reference is deemed not relevant and None is returned.
+    max_age: float
+        Maximum time difference in seconds with the reference volume.
+
+    Returns:
+    ========
+    vel_meta: dict
+        Unfolded Doppler velocity, or None if the reference can't be used.
+    """
+    if not reference:
+        return None
+
+    radar_date = num2date(radar.time['data'][0], radar.time['units'])
+    try:
+        age = abs((radar_date - reference['time']).total_seconds())
+    except Exception:
+        return None
+    if age > max_age:
+        return None
+
+    vel = radar.fields[vel_name]['data']
+    vel = np.ma.filled(np.ma.masked_invalid(vel).astype(np.float64), np.NaN)
+    vel[gatefilter.gate_excluded] = np.NaN
+    unfolded = np.zeros_like(vel) + np.NaN
+    azimuth = np.ma.getdata(radar.azimuth['data'])
+    elevation = np.ma.getdata(radar.elevation['data'])
+    ref_angles = np.array(list(reference['sweeps'].keys()))
+
+    nvalid = 0
+    nresolved = 0
+    for sweep, sl in enumerate(radar.iter_slice()):
+        try:
+            vnyq = radar.get_nyquist_vel(sweep)
+        except Exception:
+            vnyq = np.nanmax(np.abs(vel[sl]))
+
+        try:
+            angle = float(radar.fixed_angle['data'][sweep])
+        except Exception:
+            angle = float(np.mean(elevation[sl]))
+
+        vel_sweep = vel[sl]
+        nvalid += np.sum(np.isfinite(vel_sweep))
+        nearest_angle = ref_angles[np.argmin(np.abs(ref_angles - angle))]
+        if np.abs(nearest_angle - angle) > 0.3 or not np.isfinite(vnyq) or vnyq == 0:
+            continue
+        ref_sweep = reference['sweeps'][nearest_angle]
+
+        # Matching rays by nearest azimuth.
+        ref_azi = ref_sweep['azimuth']
+        pos = np.searchsorted(ref_azi, azimuth[sl]) % len(ref_azi)
+        prev = (pos - 1) % len(ref_azi)
+        dpos = np.abs((ref_azi[pos] - azimuth[sl] + 180) % 360 - 180)
+        dprev = np.abs((ref_azi[prev] - azimuth[sl] + 180) % 360 - 180)
+        pos = np.where(dprev < dpos, prev, pos)
+        dazi = np.minimum(dpos, dprev)
+
+        ngates = min(vel_sweep.shape[1], ref_sweep['data'].shape[1])
+        ref_data = np.zeros_like(vel_sweep) + np.NaN
+        ref_data[:, :ngates] = ref_sweep['data'][pos, :ngates]
+        ref_data[dazi > 2] = np.NaN
+
+        # Gates directly resolved against the reference.
+        k = np.round((ref_data - vel_sweep) / (2 * vnyq))
+        first_guess = vel_sweep + 2 * k * vnyq
+        resolved = np.isfinite(first_guess) & (np.abs(first_guess - ref_data) <= max_diff * vnyq)
+        unf_sweep = np.where(resolved, first_guess, np.NaN)
+        # Relevance of the reference, before the continuity search.
+        nresolved += np.sum(resolved)
+
+        # Continuity search on the ambiguous gates only. The Nyquist velocity
+        # can be a numpy float32: cast to the signature compiled by warmup.
+        unf_sweep, resolved = _unfold_ambiguous_gates(vel_sweep, unf_sweep, resolved, float(vnyq), float(max_diff))
+
+        # Gates still ambiguous: best guess from the reference, or raw value.
+        first_guess[~np.isfinite(first_guess)] = vel_sweep[~np.isfinite(first_guess)]
+        unf_sweep[~resolved] = first_guess[~resolved]
+        unfolded[sl] = unf_sweep
+
+    if nvalid == 0 or nresolved / nvalid < min_resolved:
+        return None
+
+    unfvel = np.ma.masked_invalid(unfolded).astype(np.float32)
+    np.ma.set_fill_value(unfvel, np.NaN)
+    vel_meta = pyart.config.get_metadata('velocity')
+    vel_meta['data'] = unfvel
+    vel_meta['_Least_significant_digit'] = 2
+    vel_meta['_FillValue'] = np.NaN
+    vel_meta['comment'] = 'Dealiased using the previous volume as reference.'
+    vel_meta['units'] = 'm/s'
+
+    return vel_meta
@@ -10,12 +10,18 @@ CPOL Level 1b main production line. These are the drivers function.
     :toctree: generated/
 
     process_and_save
+    prefetch_radars
+    process_sequence
     production_line
+    read_and_check
+    stage_configuration
 """
 # Python Standard Library
 import os
 import time
 import uuid
+import queue
+import threading
 import datetime
 import traceback
 import warnings
@@ -23,16 +29,22 @@ import warnings
 # Other Libraries
 import netCDF4
 import numpy as np
-import pyart
 
 # Custom modules.
-from .processing import attenuation
+from . import output
+from . import pipeline
+from . import profiling
+from . import instrumentation
+from . import manifest as manifest_db
+from .manifest import stage_configuration
 from .processing import filtering
 from .processing import gridding
-from .processing import hydrometeors
-from .processing import phase
 from .processing import radar_codes
-from .processing import velocity
+from .processing.fields import to_masked
+
+# Fields read from the input file, i.e. needed by the processing stages or
+# kept in the output. The others (TH, TV, DBZV, SNRV, ...) are never loaded.
+INPUT_FIELDS = pipeline.RAW_FIELDS
 
 
 def _mkdir(dir):
@@ -51,7 +63,185 @@ def _mkdir(dir):
     return None
 
 
-def process_and_save(radar_file_name, outpath, sound_dir=None, instrument='CPOL', use_unravel=True):
+def _get_output_filename(outpath_ppi, radar_start_date, instrument='CPOL', output_format='cfradial'):
+    """
+    Generate the output file name (and create its directories).
+
+    Parameters:
+    ===========
+        outpath_ppi: str
+            Output directory for the PPIs.
+        radar_start_date: datetime
+            Radar start time.
+        instrument: str
+            Name of radar.
+        output_format: str
+            'cfradial', 'zarr' or 'daily'.
+
+    Returns:
+    ========
+        outfilename: str
+            Output file name. For Zarr, path of the volume group in the daily
+            store. For 'daily', the daily time-stacked file.
+    """
+    outpath_ppi = os.path.join(outpath_ppi, str(radar_start_date.year))
+    _mkdir(outpath_ppi)
+    outpath_ppi = os.path.join(outpath_ppi, radar_start_date.strftime('%Y%m%d'))
+    _mkdir(outpath_ppi)
+
+    if output_format == 'daily':
+        if instrument == 'CPOL':
+            outfilename = "twp10cpolppi.b1.{}.nc".format(radar_start_date.strftime("%Y%m%d"))
+        else:
+            outfilename = "cfrad." + radar_start_date.strftime("%Y%m%d") + ".nc"
+    elif output_format == 'zarr':
+        if instrument == 'CPOL':
+            store = "twp10cpolppi.b1.{}.zarr".format(radar_start_date.strftime("%Y%m%d"))
+            outfilename = os.path.join(store, radar_start_date.strftime("%H%M00"))
+        else:
+            store = "cfrad." + radar_start_date.strftime("%Y%m%d") + ".zarr"
+            outfilename = os.path.join(store, radar_start_date.strftime("%H%M%S"))
+    elif instrument == 'CPOL':
+        outfilename = "twp10cpolppi.b1.{}00.nc".format(radar_start_date.strftime("%Y%m%d.%H%M"))
+    else:
+        outfilename = "cfrad." + radar_start_date.strftime("%Y%m%d_%H%M%S") + ".nc"
+
+    return os.path.join(outpath_ppi, outfilename)
+
+
+def _is_valid_output(outfilename, output_format='cfradial', products=None):
+    """
+    Check that an existing output file can be opened and has data: one of
+    the requested products, or any field if products is None.
+    """
+    if output_format == 'zarr':
+        import zarr
+        store, group_name = os.path.split(outfilename)
+        try:
+            group = zarr.open_group(store, mode='r')[group_name]
+            fields = [name for name, array in group.arrays() if array.ndim == 2 and array.shape[0] > 0]
+        except Exception:
+            return False
+    else:
+        try:
+            with netCDF4.Dataset(outfilename) as ncid:
+                if len(ncid.dimensions['time']) == 0:
+                    return False
+                fields = [name for name, var in ncid.variables.items() if var.dimensions == ('time', 'range')]
+        except Exception:
+            return False
+
+    if products is not None:
+        return any(product in fields for product in products)
+
+    return len(fields) > 0
+
+
+def _skip_output(outfilename, on_exists='skip', output_format='cfradial', radar_start_date=None, products=None):
+    """
+    Check if the output file already exists and should be kept.
+
+    Parameters:
+    ===========
+        outfilename: str
+            Output file name.
+        on_exists: str
+            Policy for existing output files: 'skip' keeps them, 'overwrite'
+            reprocesses them, and 'verify' keeps them only if they are valid.
+        output_format: str
+            'cfradial', 'zarr' or 'daily'.
+        radar_start_date: datetime
+            Radar start time, to look for the volume in a daily file.
+        products: list
+            Output products expected in a valid file (None for any field).
+
+    Returns:
+    ========
+        True if the processing of this file has to be skipped.
+    """
+    if output_format == 'daily':
+        if on_exists == 'overwrite':
+            return False
+        return output.has_stacked_volume(outfilename, radar_start_date)
+
+    if not os.path.exists(outfilename):
+        return False
+
+    if on_exists == 'skip':
+        return True
+    elif on_exists == 'verify':
+        return _is_valid_output(outfilename, output_format, products)
+
+    return False
+
+
+def _make_output_directories(outpath):
+    """
+    Create the output directories.
+
+    Parameters:
+    ===========
+        outpath: str
+            Path for saving output data.
+
+    Returns:
+    ========
+        outpath_ppi: str
+            Output directory for the PPIs.
+    """
+    today = datetime.datetime.utcnow()
+    _mkdir(outpath)
+    outpath = os.path.join(outpath, "v{}".format(today.strftime('%Y')))
+    _mkdir(outpath)
+    outpath_ppi = os.path.join(outpath, 'ppi')
+    _mkdir(outpath_ppi)
+
+    return outpath_ppi
+
+
+def _check_existing_output(radar_file_name, outpath_ppi, instrument='CPOL', on_exists='skip',
+                           output_format='cfradial', products=None):
+    """
+    Check if the output file already exists, using only the input metadata.
+
+    Parameters:
+    ===========
+        radar_file_name: str
+            Name of the input radar file.
+        outpath_ppi: str
+            Output directory for the PPIs.
+        instrument: str
+            Name of radar.
+        on_exists: str
+            Policy for existing output files (see _skip_output).
+        output_format: str
+            'cfradial', 'zarr' or 'daily'.
+        products: list
+            Output products expected in a valid file (None for any field).
+
+    Returns:
+    ========
+        outfilename: str
+            Output file name, None if the start time can't be read.
+        is_skipped: bool
+            True if the processing of this file has to be skipped.
+    """
+    with output.NETCDF_LOCK:
+        radar_start_date = radar_codes.get_radar_start_date(radar_file_name)
+    if radar_start_date is None:
+        return None, False
+
+    outfilename = _get_output_filename(outpath_ppi, radar_start_date, instrument, output_format)
+    with output.NETCDF_LOCK:
+        is_skipped = _skip_output(outfilename, on_exists, output_format, radar_start_date, products)
+
+    return outfilename, is_skipped
+
+
+def process_and_save(radar_file_name, outpath, sound_dir=None, instrument='CPOL', use_unravel=True,
+                     velocity_reference=None, on_exists='skip', manifest=None, encoding=None, writer=None,
+                     radar=None, output_format='cfradial', profile_file=None, trace_memory=False, hooks=None,
+                     products=None):
     """
     Call processing function and write data.
 
@@ -61,17 +251,57 @@ def process_and_save(radar_file_name, outpath, sound_dir=None, instrument='CPOL'
             Name of the input radar file.
         outpath: str
             Path for saving output data.
-        outpath_grid: str
-            Path for saving gridded data.
-        figure_path: str
-            Path for saving figures.
         sound_dir: str
             Path to radiosoundings directory.
         instrument: str
             Name of radar (only CPOL will change something).
-        linearz: bool
-            Gridding reflectivity in linear unit (True) or dBZ (False).
+        use_unravel: bool
+            Dealiasing with UNRAVEL (True) or region-based (False).
+        velocity_reference: dict
+            Unfolded velocity of the previous volume, used as first guess for
+            the dealiasing and updated in place (see production_line).
+        on_exists: str
+            What to do if the output file already exists: 'skip', 'overwrite'
+            or 'verify' (reprocess only if the existing file is corrupted).
+        manifest: str
+            Path to the SQLite manifest database in which to record the run.
+            None for no record.
+        encoding: dict
+            Compression parameters of the output file (deflate_level, shuffle,
+            chunksizes, quantize, pack_int16, field_encoding), see
+            output.set_field_encoding, or for Zarr (range_block, cname,
+            clevel, quantize, nthreads), see output.write_zarr, or for the daily
+            files (deflate_level, shuffle, quantize).
+        writer: output.WriteBehind
+            Background writer. If given, the output file is written
+            asynchronously (and the run recorded in the manifest once written).
+        radar:
+            Radar already read and checked with read_and_check (e.g. by
+            prefetch_radars). None to read the input file.
+        output_format: str
+            'cfradial' (one netCDF file per volume), 'zarr' (one group per
+            volume in a daily Zarr store, requires zarr) or 'daily' (all the
+            volumes of a day in one netCDF file, see output.DailyStackWriter).
+            A daily file must not be written by several processes at once.
+        profile_file: str
+            Append the timings and memory usage of each stage to this file
+            (CSV if it ends with .csv, JSONL otherwise).
+        trace_memory: bool
+            Record the memory allocated by each stage with tracemalloc.
+        hooks: list
+            Profiling hooks called around each stage, see production_line.
+        products: list
+            Output fields (see pipeline.OUTPUT_FIELDS), e.g. ['reflectivity',
+            'radar_estimated_rain_rate']. Only the stages needed for them are
+            run. None for all of them.
     """
+    if on_exists not in ['skip', 'overwrite', 'verify']:
+        raise ValueError(f"Unknown on_exists policy: {on_exists}.")
+    if output_format not in ['cfradial', 'zarr', 'daily']:
+        raise ValueError(f"Unknown output format: {output_format}.")
+    if products is not None:
+        pipeline.resolve_stages(products)
+
     today = datetime.datetime.utcnow()
     if instrument == 'CPOL':
         is_cpol = True
@@ -79,11 +309,7 @@ def process_and_save(radar_file_name, outpath, sound_dir=None, instrument='CPOL'
         is_cpol = False
 
     # Create directories.
-    _mkdir(outpath)
-    outpath = os.path.join(outpath, "v{}".format(today.strftime('%Y')))
-    _mkdir(outpath)
-    outpath_ppi = os.path.join(outpath, 'ppi')
-    _mkdir(outpath_ppi)
+    outpath_ppi = _make_output_directories(outpath)
     # outpath_grid = os.path.join(outpath, 'gridded')
     # _mkdir(outpath_grid)
     # figure_path = os.path.join(outpath, 'quicklooks')
@@ -95,34 +321,53 @@ def process_and_save(radar_file_name, outpath, sound_dir=None, instrument='CPOL'
     # _mkdir(outdir_70km)
     tick = time.time()
 
+    # Check if output file already exists, using only the input metadata.
+    outfilename, is_skipped = _check_existing_output(radar_file_name, outpath_ppi, instrument, on_exists,
+                                                     output_format, products)
+    if is_skipped:
+        print(f"Output file {outfilename} already exists.")
+        return None
+
+    config = stage_configuration(sound_dir, instrument, use_unravel, products)
+    profile = instrumentation.StageProfile(trace_memory=trace_memory)
+
+    def _record(status, outfilename=None, message=None):
+        # Record the run in the manifest, with the timings of each stage.
+        timings = dict(profile.timings(), total=time.time() - tick)
+        if manifest is not None:
+            manifest_db.record_run(manifest, radar_file_name, outfilename, status, config,
+                                   timings=timings, message=message)
+        if profile_file is not None:
+            profile.save(profile_file, input_file=radar_file_name, status=status)
+
     # Business start here.
-    with warnings.catch_warnings():
-        warnings.simplefilter('ignore')
-        radar = production_line(radar_file_name, sound_dir, is_cpol=is_cpol, use_unravel=use_unravel)
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            # With a background writer, the fields are read at once (under
+            # the netCDF lock) instead of on first access.
+            radar = production_line(radar_file_name, sound_dir, is_cpol=is_cpol, use_unravel=use_unravel,
+                                    velocity_reference=velocity_reference, lazy_loading=writer is None,
+                                    radar=radar, profile=profile, hooks=hooks, products=products)
+    except Exception as err:
+        _record('failed', message=repr(err))
+        raise
     # Business over.
 
     if radar is None:
         print(f'{radar_file_name} has not been processed. Check logs.')
+        _record('failed')
         return None
 
-    radar_start_date = netCDF4.num2date(radar.time['data'][0], radar.time['units'])
-    outpath_ppi = os.path.join(outpath_ppi, str(radar_start_date.year))
-    _mkdir(outpath_ppi)
-    outpath_ppi = os.path.join(outpath_ppi, radar_start_date.strftime('%Y%m%d'))
-    _mkdir(outpath_ppi)
-
-    # Generate output file name.
-    if instrument == 'CPOL':
-        outfilename = "twp10cpolppi.b1.{}00.nc".format(radar_start_date.strftime("%Y%m%d.%H%M"))
-    else:
-        outfilename = "cfrad." + radar_start_date.strftime("%Y%m%d_%H%M%S") + ".nc"
-
-    outfilename = os.path.join(outpath_ppi, outfilename)
-
-    # Check if output file already exists.
-    if os.path.isfile(outfilename):
-        print(f"Output file {outfilename} already exists.")
-        return None
+    if outfilename is None:
+        # Start time could not be read from the metadata.
+        radar_start_date = netCDF4.num2date(radar.time['data'][0], radar.time['units'])
+        outfilename = _get_output_filename(outpath_ppi, radar_start_date, instrument, output_format)
+        with output.NETCDF_LOCK:
+            is_skipped = _skip_output(outfilename, on_exists, output_format, radar_start_date, products)
+        if is_skipped:
+            print(f"Output file {outfilename} already exists.")
+            return None
 
     if is_cpol:
         # Lat/lon informations
@@ -170,7 +415,27 @@ def process_and_save(radar_file_name, outpath, sound_dir=None, instrument='CPOL'
         radar.metadata = metadata
 
     # Write results
-    pyart.io.write_cfradial(outfilename, radar, format='NETCDF4')
+    if encoding is None:
+        encoding = dict()
+
+    def _on_written(outfilename, error):
+        if error is None:
+            _record('success', outfilename)
+            print('%s processed in  %0.2fs.' % (os.path.basename(radar_file_name), (time.time() - tick)))
+        else:
+            _record('failed', message=repr(error))
+
+    if writer is not None:
+        writer.submit(outfilename, radar, callback=_on_written, output_format=output_format, **encoding)
+        return None
+
+    try:
+        with profile.stage('write'):
+            output.write(outfilename, radar, output_format=output_format, **encoding)
+    except Exception as err:
+        _on_written(outfilename, err)
+        raise
+    _on_written(outfilename, None)
 
     # Deleting all unwanted keys for gridded product.
     # logger.info("Gridding started.")
@@ -207,60 +472,212 @@ def process_and_save(radar_file_name, outpath, sound_dir=None, instrument='CPOL'
     #     logging.error('Problem while gridding.')
     #     raise
 
-    # Processing finished!
-    print('%s processed in  %0.2fs.' % (os.path.basename(radar_file_name), (time.time() - tick)))
-
     return None
 
 
-def production_line(radar_file_name, sound_dir, is_cpol=True, use_unravel=True):
+def prefetch_radars(flist, is_cpol=True, depth=1, products=None):
     """
-    Production line for correcting and estimating CPOL data radar parameters.
-    The naming convention for these parameters is assumed to be DBZ, ZDR, VEL,
-    PHIDP, KDP, SNR, RHOHV, and NCP. KDP, NCP, and SNR are optional and can be
-    recalculated.
+    Read the radar files in a background thread, ahead of their processing.
+    Files are read entirely (under the netCDF lock), and checked with
+    read_and_check.
+
+    Parameters:
+    ===========
+        flist: list
+            Input radar files.
+        is_cpol: bool
+            Name of radar (only CPOL will change something).
+        depth: int
+            Number of radars read in advance.
+        products: list
+            Output products, to read only the fields needed for them.
+
+    Returns:
+    ========
+        Generator of (radar_file_name, radar, error), radar being None and
+        error the exception if the file failed the checks.
+    """
+    prefetched = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def _reader():
+        for radar_file_name in flist:
+            if stop.is_set():
+                break
+            try:
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    radar = read_and_check(radar_file_name, is_cpol=is_cpol, lazy_loading=False,
+                                           products=products)
+                item = (radar_file_name, radar, None)
+            except Exception as err:
+                item = (radar_file_name, None, err)
+            prefetched.put(item)
+            del item
+        prefetched.put(None)
+
+    thread = threading.Thread(target=_reader, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = prefetched.get()
+            if item is None:
+                break
+            yield item
+    finally:
+        # Unblock the reader if the generator is not consumed entirely.
+        stop.set()
+        while thread.is_alive():
+            try:
+                prefetched.get(timeout=1)
+            except queue.Empty:
+                pass
+
+
+def process_sequence(flist, outpath, sound_dir=None, instrument='CPOL', use_unravel=True, warm_start=True,
+                     on_exists='skip', manifest=None, encoding=None, write_behind=2, prefetch=1,
+                     output_format='cfradial', profile_file=None, products=None):
+    """
+    Process a time-ordered sequence of radar files in the same process. The
+    next volumes are read in a background thread and the output of each
+    volume is written in another one, while the current volume is
+    processed. The unfolded velocity of each volume is used as first guess
+    for the dealiasing of the next one.
+
+    Parameters:
+    ===========
+        flist: list
+            Input radar files, sorted by time.
+        outpath: str
+            Path for saving output data.
+        sound_dir: str
+            Path to radiosoundings directory.
+        instrument: str
+            Name of radar (only CPOL will change something).
+        use_unravel: bool
+            Dealiasing algorithm.
+        warm_start: bool
+            Use the previous volume as first guess for the dealiasing.
+        on_exists: str
+            What to do if the output file already exists (see process_and_save).
+        manifest: str
+            Path to the SQLite manifest database.
+        encoding: dict
+            Compression parameters of the output files.
+        write_behind: int
+            Maximum number of volumes waiting to be written. 0 to write
+            synchronously.
+        prefetch: int
+            Number of volumes read in advance. 0 to read each file when it
+            is processed.
+        output_format: str
+            'cfradial', 'zarr' or 'daily'. The daily files are kept open and
+            written by a background writer (even if write_behind is 0).
+        profile_file: str
+            Append the timings and memory usage of each stage to this file.
+        products: list
+            Output products (see process_and_save).
+
+    Returns:
+    ========
+        errors: list
+            List of (file name, exception) of the failed volumes (input file name
+            for processing errors, output file name for writing errors).
+    """
+    if on_exists not in ['skip', 'overwrite', 'verify']:
+        raise ValueError(f"Unknown on_exists policy: {on_exists}.")
+    if output_format not in ['cfradial', 'zarr', 'daily']:
+        raise ValueError(f"Unknown output format: {output_format}.")
+    if products is not None:
+        pipeline.resolve_stages(products)
+
+    # Filter the existing outputs first, so that these files are not read.
+    outpath_ppi = _make_output_directories(outpath)
+    todo = []
+    for radar_file_name in flist:
+        outfilename, is_skipped = _check_existing_output(radar_file_name, outpath_ppi, instrument, on_exists,
+                                                         output_format, products)
+        if is_skipped:
+            print(f"Output file {outfilename} already exists.")
+        else:
+            todo.append(radar_file_name)
+
+    if prefetch > 0:
+        radars = prefetch_radars(todo, is_cpol=instrument == 'CPOL', depth=prefetch, products=products)
+    else:
+        radars = ((radar_file_name, None, None) for radar_file_name in todo)
+
+    velocity_reference = dict() if warm_start else None
+    stack = None
+    if output_format == 'daily':
+        stack = output.DailyStackWriter(**(encoding or dict()))
+        writer = output.WriteBehind(max(write_behind, 1), write_function=stack.write)
+        encoding = None
+    elif write_behind > 0:
+        writer = output.WriteBehind(write_behind)
+    else:
+        writer = None
+    config = stage_configuration(sound_dir, instrument, use_unravel, products)
+
+    errors = []
+    try:
+        for radar_file_name, radar, error in radars:
+            if error is not None:
+                # File dropped by the cheap checks of the prefetching.
+                print(f'{radar_file_name} rejected: {error}')
+                errors.append((radar_file_name, error))
+                if manifest is not None:
+                    manifest_db.record_run(manifest, radar_file_name, None, 'failed', config, message=repr(error))
+                continue
+
+            try:
+                # Existing outputs have already been filtered.
+                process_and_save(radar_file_name, outpath, sound_dir=sound_dir, instrument=instrument,
+                                 use_unravel=use_unravel, velocity_reference=velocity_reference,
+                                 on_exists='overwrite', manifest=manifest, encoding=encoding, writer=writer,
+                                 radar=radar, output_format=output_format, profile_file=profile_file,
+                                 products=products)
+            except Exception as err:
+                traceback.print_exc()
+                errors.append((radar_file_name, err))
+            del radar
+    finally:
+        if writer is not None:
+            errors += writer.close()
+        if stack is not None:
+            stack.close()
+
+    return errors
+
+
+def read_and_check(radar_file_name, is_cpol=True, lazy_loading=True, products=None):
+    """
+    Read the input radar file and run the cheap sanity checks (number of
+    sweeps, azimuth, reflectivity, date), so that bad files are rejected
+    before any processing.
 
     Parameters:
     ===========
     radar_file_name: str
         Name of the input radar file.
-    sound_dir: str
-        Path to radiosounding directory.
+    is_cpol: bool
+        Name of radar (only CPOL will change something).
+    lazy_loading: bool
+        Load the radar fields on first access.
+    products: list
+        Output products, to read only the fields needed for them (None for
+        all the INPUT_FIELDS).
 
     Returns:
     ========
     radar: Object
         Py-ART radar structure.
-
-    PLAN:
-    =====
-    01/ Read input radar file.
-    02/ Check if radar file OK (no problem with azimuth and reflectivity).
-    03/ Get radar date.
-    04/ Check if NCP field exists (creating a fake one if it doesn't)
-    05/ Check if RHOHV field exists (creating a fake one if it doesn't)
-    06/ Compute SNR and temperature using radiosoundings.
-    07/ Correct RHOHV using Ryzhkov algorithm.
-    08/ Create gatefilter (remove noise and incorrect data).
-    09/ Correct ZDR using Ryzhkov algorithm.
-    10/ Process and unfold raw PHIDP using wradlib and Vulpiani algorithm.
-    11/ Compute Giangrande's PHIDP using pyart.
-    12/ Unfold velocity using pyart.
-    13/ Compute attenuation for ZH
-    14/ Compute attenuation for ZDR
-    15/ Estimate Hydrometeors classification using csu toolbox.
-    16/ Estimate Rainfall rate using csu toolbox.
-    17/ Estimate DSD retrieval using csu toolbox.
-    18/ Removing fake/temporary fieds.
-    19/ Rename fields to pyart standard names.
-    20/ Plotting figure quicklooks.
-    21/ Hardcoding gatefilter.
     """
-    # !!! READING THE RADAR !!!
-    if is_cpol:
-        radar = pyart.io.read(radar_file_name)
-    else:
-        radar = radar_codes.read_radar(radar_file_name)
+    # Fields are only loaded on first access, so the file can be rejected by
+    # the following checks before decoding everything.
+    with output.NETCDF_LOCK:
+        radar = radar_codes.read_radar(radar_file_name, include_fields=pipeline.get_input_fields(products),
+                                       lazy=lazy_loading)
 
     # Correct data type manually
     try:
@@ -274,13 +691,13 @@ def production_line(radar_file_name, sound_dir, is_cpol=True, use_unravel=True):
         if radar.nsweeps < 10:
             raise ValueError(f'Problem with CPOL PPIs, only {radar.nsweeps} elevations.')
 
+    if not radar_codes.check_azimuth(radar):
+        raise TypeError(f"Azimuth field is empty in {radar_file_name}.")
+
     # Check if radar reflecitivity field is correct.
     if not radar_codes.check_reflectivity(radar):
         raise TypeError(f"Reflectivity field is empty in {radar_file_name}.")
 
-    if not radar_codes.check_azimuth(radar):
-        raise TypeError(f"Azimuth field is empty in {radar_file_name}.")
-
     if not radar_codes.check_year(radar):
         print(f'{radar_file_name} date probably wrong. Had to correct century.')
 
@@ -288,199 +705,123 @@ def production_line(radar_file_name, sound_dir, is_cpol=True, use_unravel=True):
     if azi_has_changed:
         radar.azimuth['data'] = new_azimuth
 
-    # Getting radar's date and time.
-    radar_start_date = netCDF4.num2date(radar.time['data'][0], radar.time['units'].replace("since", "since "))
     radar.time['units'] = radar.time['units'].replace("since", "since ")
 
-    # Get radiosoundings:
-    if sound_dir is not None:
-        radiosonde_fname = radar_codes.get_radiosoundings(sound_dir, radar_start_date)
+    return radar
 
-    # Correct Doppler velocity units.
-    try:
-        radar.fields['VEL']['units'] = "m/s"
-        vel_missing = False
-    except KeyError:
-        vel_missing = True
 
-    # Check if the nyquist velocity is present in the radar parameters.
-    if not vel_missing:
-        velocity.check_nyquist_velocity(radar)
+def production_line(radar_file_name, sound_dir, is_cpol=True, use_unravel=True, velocity_reference=None,
+                    lazy_loading=True, radar=None, profile=None, hooks=None, products=None):
+    """
+    Production line for correcting and estimating CPOL data radar parameters.
+    The naming convention for these parameters is assumed to be DBZ, ZDR, VEL,
+    PHIDP, KDP, SNR, RHOHV, and NCP. KDP, NCP, and SNR are optional and can be
+    recalculated.
 
-    # Looking for RHOHV field
-    # For CPOL, season 09/10, there are no RHOHV fields before March!!!!
-    try:
-        radar.fields['RHOHV']
-        fake_rhohv = False  # Don't need to delete this field cause it's legit.
-    except KeyError:
-        # Creating a fake RHOHV field.
-        fake_rhohv = True  # We delete this fake field later.
-        rho = pyart.config.get_metadata('cross_correlation_ratio')
-        rho['data'] = np.ones_like(radar.fields['DBZ']['data'])
-        radar.add_field('RHOHV', rho)
-        radar.add_field('RHOHV_CORR', rho)
-
-    # Compute SNR and extract radiosounding temperature.
-    # Requires radiosoundings
-    if sound_dir is not None:
-        try:
-            height, temperature, snr = radar_codes.snr_and_sounding(radar, radiosonde_fname)
-            radar.add_field('temperature', temperature, replace_existing=True)
-            radar.add_field('height', height, replace_existing=True)
-        except ValueError:
-            traceback.print_exc()
-            print(f"Impossible to compute SNR {radar_file_name}")
-            return None
+    Parameters:
+    ===========
+    radar_file_name: str
+        Name of the input radar file.
+    sound_dir: str
+        Path to radiosounding directory.
+    is_cpol: bool
+        Name of radar (only CPOL will change something).
+    use_unravel: bool
+        Dealias velocity using UNRAVEL (True) or Py-ART region based (False).
+    velocity_reference: dict
+        For sequential processing. If not None, the unfolded velocity of the
+        previous volume stored in it is used as first guess for the
+        dealiasing, and it is updated with the current volume afterward. Use
+        an empty dict for the first volume.
+    lazy_loading: bool
+        Load the radar fields on first access. Must be False if a
+        output.WriteBehind is running concurrently.
+    radar: Object
+        Radar already read by read_and_check. None to read radar_file_name.
+    profile: instrumentation.StageProfile
+        Records the wall time, CPU time and memory of each stage.
+    hooks: list
+        Profiling hooks called around each stage (see profiling). None to
+        use the hooks from the CPOL_PROFILE environment variable.
+    products: list
+        Output fields (see pipeline.OUTPUT_FIELDS). Only the stages needed
+        for them are run. None for all of them.
 
-        # Looking for SNR
-        try:
-            radar.fields['SNR']
-        except KeyError:
-            radar.add_field('SNR', snr, replace_existing=True)
+    Returns:
+    ========
+    radar: Object
+        Py-ART radar structure.
 
-    # Correct RHOHV
-    if not fake_rhohv:
-        rho_corr = radar_codes.correct_rhohv(radar)
-        radar.add_field_like('RHOHV', 'RHOHV_CORR', rho_corr, replace_existing=True)
+    PLAN:
+    =====
+    01/ Read input radar file.
+    02/ Check if radar file OK (no problem with azimuth and reflectivity).
+    03/ Get radar date.
+    04/ Run the stages needed for the requested products (see pipeline),
+        freeing the intermediate fields after their last use:
+        - Compute SNR and temperature using radiosoundings.
+        - Correct RHOHV using Ryzhkov algorithm (creating a fake one if it
+          doesn't exist).
+        - Correct ZDR using Ryzhkov algorithm.
+        - Create gatefilter (remove noise and incorrect data).
+        - Process and unfold raw PHIDP, and compute KDP.
+        - Unfold velocity.
+        - Compute attenuation for ZH
+        - Compute attenuation for ZDR
+        - Estimate Hydrometeors classification using csu toolbox.
+        - Estimate Rainfall rate using csu toolbox.
+        - Estimate DSD retrieval using csu toolbox.
+    05/ Rename fields to pyart standard names, removing fake fields.
+    06/ Hardcoding gatefilter (in place, all fields at once).
+    """
+    if profile is None:
+        profile = instrumentation.StageProfile()
+    if hooks is None:
+        hooks = profiling.hooks_from_env()
+    profile.hooks.extend(hooks)
+    if products is None:
+        products = list(pipeline.OUTPUT_FIELDS.keys())
 
-    # Correct ZDR
-    corr_zdr = radar_codes.correct_zdr(radar)
-    radar.add_field_like('ZDR', 'ZDR_CORR', corr_zdr, replace_existing=True)
+    # !!! READING THE RADAR !!!
+    if radar is None:
+        with profile.stage('read'):
+            radar = read_and_check(radar_file_name, is_cpol=is_cpol, lazy_loading=lazy_loading,
+                                   products=products)
 
-    # GateFilter
-    if is_cpol:
-        gatefilter = filtering.do_gatefilter_cpol(radar,
-                                                  refl_name='DBZ',
-                                                  phidp_name="PHIDP",
-                                                  rhohv_name='RHOHV_CORR',
-                                                  zdr_name="ZDR")
-    else:
-        gatefilter = filtering.do_gatefilter(radar,
-                                             refl_name='DBZ',
-                                             phidp_name="PHIDP",
-                                             rhohv_name='RHOHV_CORR',
-                                             zdr_name="ZDR")
+    # Getting radar's date and time.
+    radar_start_date = netCDF4.num2date(radar.time['data'][0], radar.time['units'])
 
-    # Check if NCP exists.
-    try:
-        radar.fields['NCP']
-        fake_ncp = False
-    except KeyError:
-        fake_ncp = True
-        ncp = pyart.config.get_metadata('normalized_coherent_power')
-        ncp['data'] = np.zeros_like(radar.fields['RHOHV']['data'])
-        ncp['data'][gatefilter.gate_included] = 1
-        radar.add_field('NCP', ncp)
-
-    phidp, kdp = phase.valentin_phase_processing(radar, gatefilter, phidp_name='PHIDP')
-    radar.add_field('PHIDP_VAL', phidp)
-    radar.add_field('KDP_VAL', kdp)
-    kdp_field_name = 'KDP_VAL'
-    phidp_field_name = 'PHIDP_VAL'
-
-    # Unfold VELOCITY
-    if not vel_missing:
-        # Dealias velocity.
-        unfvel_tick = time.time()
-        if use_unravel:
-            vdop_unfold = velocity.unravel(radar, gatefilter)
-        else:
-            vdop_unfold = velocity.unfold_velocity(radar, gatefilter)
-        radar.add_field('VEL_UNFOLDED', vdop_unfold, replace_existing=True)
-        print('Doppler velocity unfolded in %0.2f s.' % (time.time() - unfvel_tick))
-
-    # Correct Attenuation ZH
-    zh_corr = attenuation.correct_attenuation_zh_pyart(radar, phidp_field=phidp_field_name)
-    radar.add_field('DBZ_CORR', zh_corr, replace_existing=True)
-    # radar.add_field('specific_attenuation_reflectivity', atten_spec, replace_existing=True)
-
-    # Correct Attenuation ZDR
-    zdr_corr = attenuation.correct_attenuation_zdr(radar, gatefilter=gatefilter, phidp_name=phidp_field_name, zdr_name='ZDR_CORR')
-    radar.add_field('ZDR_CORR_ATTEN', zdr_corr)
-
-    # Hydrometeors classification
-    hydro_class = hydrometeors.hydrometeor_classification(radar,
-                                                          gatefilter,
-                                                          kdp_name=kdp_field_name,
-                                                          zdr_name='ZDR_CORR_ATTEN')
-
-    radar.add_field('radar_echo_classification', hydro_class, replace_existing=True)
-
-    # Rainfall rate
-    rainfall = hydrometeors.rainfall_rate(radar, gatefilter, kdp_name=kdp_field_name,
-                                          refl_name='DBZ_CORR', zdr_name='ZDR_CORR_ATTEN')
-    radar.add_field("radar_estimated_rain_rate", rainfall)
-
-    # DSD retrieval
-    nw_dict, d0_dict = hydrometeors.dsd_retrieval(radar, gatefilter, kdp_name=kdp_field_name, zdr_name='ZDR_CORR_ATTEN')
-    radar.add_field("D0", d0_dict)
-    radar.add_field("NW", nw_dict)
-
-    # Removing fake and useless fields.
-    if fake_ncp:
-        radar.fields.pop('NCP')
-
-    if fake_rhohv:
-        radar.fields.pop("RHOHV")
-        radar.fields.pop("RHOHV_CORR")
-
-    # Remove obsolete fields:
-    for obsolete_key in ["Refl", "PHI_UNF", "PHI_CORR", "height", 'TH', 'TV', 'ZDR_CORR',
-                         'RHOHV']:
-        try:
-            radar.fields.pop(obsolete_key)
-        except KeyError:
-            continue
-
-    # Rename fields to pyart defaults.
-    fields_names = [('VEL', 'raw_velocity'),
-                    ('VEL_UNFOLDED', 'velocity'),
-                    ('DBZ', 'total_power'),
-                    ('DBZ_CORR', 'reflectivity'),
-                    ('RHOHV_CORR', 'cross_correlation_ratio'),
-                    ('ZDR', 'differential_reflectivity'),
-                    ('ZDR_CORR_ATTEN', 'corrected_differential_reflectivity'),
-                    ('PHIDP', 'differential_phase'),
-                    ('PHIDP_BRINGI', 'bringi_differential_phase'),
-                    ('PHIDP_GG', 'giangrande_differential_phase'),
-                    ('PHIDP_VAL', 'corrected_differential_phase'),
-                    ('KDP', 'specific_differential_phase'),
-                    ('KDP_BRINGI', 'bringi_specific_differential_phase'),
-                    ('KDP_GG', 'giangrande_specific_differential_phase'),
-                    ('KDP_VAL', 'corrected_specific_differential_phase'),
-                    ('WIDTH', 'spectrum_width'),
-                    ('SNR', 'signal_to_noise_ratio'),
-                    ('NCP', 'normalized_coherent_power'),
-                    ('DBZV', 'reflectivity_v'),
-                    ('WRADV', 'spectrum_width_v'),
-                    ('SNRV', 'signal_to_noise_ratio_v'),
-                    ('SQIV', 'normalized_coherent_power_v')]
-
-    for old_key, new_key in fields_names:
-        try:
-            radar.add_field(new_key, radar.fields.pop(old_key), replace_existing=True)
-        except KeyError:
-            continue
-
-    hardcode_keys = ["reflectivity",
-                     "radar_echo_classification",
-                     "corrected_differential_reflectivity",
-                     "region_dealias_velocity",
-                     "D0", "NW"]
-    for mykey in hardcode_keys:
-        try:
-            radar.fields[mykey]['data'] = filtering.filter_hardcoding(radar.fields[mykey]['data'], gatefilter)
-        except KeyError:
-            continue
-
-    goodkeys = ["radar_echo_classification", "D0", "NW", "velocity", "total_power", "raw_velocity",
-                "reflectivity", "cross_correlation_ratio", "corrected_differential_reflectivity", "radar_estimated_rain_rate",
-                "corrected_differential_phase", "corrected_specific_differential_phase", "spectrum_width"]
-    # Delete working variables.
-    for k in list(radar.fields.keys()):
-        if k not in goodkeys:
-            radar.fields.pop(k)
-
-    # TODO: Set Deflate Level
+    # Correct Doppler velocity units.
+    if 'VEL' in radar.fields.keys():
+        radar.fields['VEL']['units'] = "m/s"
+
+    context = {'radar_file_name': radar_file_name,
+               'radar_start_date': radar_start_date,
+               'sound_dir': sound_dir,
+               'is_cpol': is_cpol,
+               'use_unravel': use_unravel,
+               'velocity_reference': velocity_reference,
+               'fake_rhohv': False}
+    if not pipeline.run_stages(radar, context, products, profile):
+        return None
+
+    with profile.stage('finalize', radar):
+        # Rename fields to pyart defaults.
+        fields = dict()
+        for new_key in products:
+            old_key = pipeline.OUTPUT_FIELDS[new_key]
+            if old_key not in radar.fields.keys():
+                continue
+            if old_key == 'RHOHV_CORR' and context['fake_rhohv']:
+                continue
+            fields[new_key] = radar.fields.pop(old_key)
+        radar.fields.clear()
+        for new_key, field in fields.items():
+            # Internal float32/NaN fields to Py-ART masked arrays.
+            radar.add_field(new_key, to_masked(field))
+
+    if 'gatefilter' in context:
+        with profile.stage('hardcoding', radar):
+            filtering.filter_hardcoding_fields(radar, pipeline.HARDCODED_FIELDS, context['gatefilter'])
 
     return radar
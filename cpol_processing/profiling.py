@@ -0,0 +1,229 @@
+"""
+Profiling hooks called around the processing stages (see
+instrumentation.StageProfile). They can be enabled without changing the code
+with the CPOL_PROFILE environment variable, e.g.:
+
+    CPOL_PROFILE="cprofile=/tmp/profiles,sample=phase,numba"
+
+@title: profiling
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    hooks_from_env
+    parse_hooks
+    CProfileHook
+    NumbaCompileHook
+    SamplingHook
+    StageHook
+"""
+# Python Standard Library
+import os
+import sys
+import cProfile
+import threading
+import collections
+
+
+# Hooks created from the environment, per process id and specification.
+_ENV_HOOKS = dict()
+
+
+class StageHook:
+    """
+    Base class of the hooks. on_stage_start is called with the stage name
+    before the stage, and on_stage_end with the stage name and its record
+    (dict, that can be completed) after the stage.
+    """
+    def on_stage_start(self, name):
+        pass
+
+    def on_stage_end(self, name, record):
+        pass
+
+
+class CProfileHook(StageHook):
+    """
+    Run cProfile on each stage and dump the statistics in a file per stage
+    (open them with pstats or snakeviz).
+
+    Parameters:
+    ===========
+    outpath: str
+        Output directory.
+    stages: list
+        Names of the stages to profile (all if None).
+    """
+    def __init__(self, outpath='.', stages=None):
+        self.outpath = outpath
+        self.stages = stages
+        self._profiler = None
+        self._count = 0
+
+    def on_stage_start(self, name):
+        if self.stages is not None and name not in self.stages:
+            return None
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def on_stage_end(self, name, record):
+        if self._profiler is None:
+            return None
+        self._profiler.disable()
+        self._count += 1
+        outfilename = os.path.join(self.outpath, f"{os.getpid()}_{self._count:04}_{name}.prof")
+        self._profiler.dump_stats(outfilename)
+        self._profiler = None
+        record['cprofile'] = outfilename
+
+
+class SamplingHook(StageHook):
+    """
+    Statistical line profiler of one stage: the stack of the thread running
+    the stage is sampled at regular intervals from a background thread, and
+    the most frequent lines are reported.
+
+    Parameters:
+    ===========
+    stage: str
+        Name of the stage to sample.
+    interval: float
+        Sampling interval in seconds.
+    nlines: int
+        Number of lines to report.
+    outfilename: str
+        Append the report to this file (print it if None).
+    """
+    def __init__(self, stage, interval=0.005, nlines=20, outfilename=None):
+        self.stage = stage
+        self.interval = interval
+        self.nlines = nlines
+        self.outfilename = outfilename
+        self._thread = None
+        self._stop = threading.Event()
+        self._counts = collections.Counter()
+
+    def _sample(self, thread_id):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                continue
+            # Count every line of the stack, so that the time spent in the
+            # functions called from a line is attributed to it.
+            seen = set()
+            while frame is not None:
+                line = (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+                if line not in seen:
+                    self._counts[line] += 1
+                    seen.add(line)
+                frame = frame.f_back
+            self._counts['total'] += 1
+
+    def on_stage_start(self, name):
+        if name != self.stage:
+            return None
+        self._counts.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, args=(threading.get_ident(),), daemon=True)
+        self._thread.start()
+
+    def on_stage_end(self, name, record):
+        if self._thread is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+        total = self._counts.pop('total', 0)
+        report = [f"Sampling of stage {name}: {total} samples every {self.interval} s."]
+        for (filename, lineno, funcname), count in self._counts.most_common(self.nlines):
+            report.append(f"{100 * count / max(total, 1):6.1f}% {filename}:{lineno} ({funcname})")
+        report = "\n".join(report)
+
+        if self.outfilename is None:
+            print(report)
+        else:
+            with open(self.outfilename, 'a') as fid:
+                fid.write(report + "\n")
+
+
+class NumbaCompileHook(StageHook):
+    """
+    Measure the time spent compiling numba functions during each stage,
+    stored as 'numba_compile_time' in the stage record.
+    """
+    def __init__(self):
+        self._listener = None
+
+    def on_stage_start(self, name):
+        from numba.core import event
+
+        self._listener = event.TimingListener()
+        event.register("numba:compile", self._listener)
+
+    def on_stage_end(self, name, record):
+        from numba.core import event
+
+        if self._listener is None:
+            return None
+        event.unregister("numba:compile", self._listener)
+        record['numba_compile_time'] = self._listener.duration if self._listener.done else 0
+        self._listener = None
+
+
+def parse_hooks(spec):
+    """
+    Create the hooks from a specification string: comma separated list of
+    'cprofile[=outpath]', 'sample=stage' and 'numba'.
+
+    Parameters:
+    ===========
+    spec: str
+        Hooks specification, e.g. "cprofile=/tmp/profiles,sample=phase".
+
+    Returns:
+    ========
+    hooks: list
+        List of StageHook.
+    """
+    hooks = []
+    if not spec:
+        return hooks
+
+    for item in spec.split(','):
+        name, _, value = item.strip().partition('=')
+        if name == 'cprofile':
+            outpath = value or '.'
+            os.makedirs(outpath, exist_ok=True)
+            hooks.append(CProfileHook(outpath))
+        elif name == 'sample':
+            if not value:
+                raise ValueError("A stage name is required for the sampling hook, e.g. sample=phase.")
+            hooks.append(SamplingHook(value))
+        elif name == 'numba':
+            hooks.append(NumbaCompileHook())
+        elif name:
+            raise ValueError(f"Unknown profiling hook: {name}.")
+
+    return hooks
+
+
+def hooks_from_env():
+    """
+    Create the hooks from the CPOL_PROFILE environment variable (see
+    parse_hooks). The hooks are created once per process and reused for all
+    its volumes, so that the numbered cProfile dumps of a pool worker do not
+    overwrite each other.
+
+    Returns:
+    ========
+    hooks: list
+        List of StageHook.
+    """
+    key = (os.getpid(), os.environ.get('CPOL_PROFILE', ''))
+    if key not in _ENV_HOOKS:
+        _ENV_HOOKS[key] = parse_hooks(key[1])
+
+    return _ENV_HOOKS[key]
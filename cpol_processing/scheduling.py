@@ -0,0 +1,286 @@
+"""
+Cost-aware scheduling of the radar files: the processing time of each file is
+predicted from its size, its number of sweeps and the runtimes recorded in
+the manifest, so that the longest files are processed first and the end of a
+batch is not held up by a slow file started last. The timeout of each file
+is derived from the runtimes of similar files.
+
+@title: scheduling
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    _file_month
+    _size_bucket
+    fit_runtime_model
+    get_nsweeps
+    get_timeout_table
+    get_timeouts
+    order_by_cost
+    predict_runtimes
+"""
+# Python Standard Library
+import os
+import re
+
+# Other Libraries
+import numpy as np
+
+
+def get_nsweeps(radar_file_name):
+    """
+    Number of sweeps of a radar file, read from the file header only.
+
+    Parameters:
+    ===========
+    radar_file_name: str
+        Radar file name (ODIM H5 or CF/Radial).
+
+    Returns:
+    ========
+    nsweeps: int
+        Number of sweeps (None if it cannot be read).
+    """
+    try:
+        if ".h5" in radar_file_name or ".hdf" in radar_file_name:
+            import h5py
+
+            with h5py.File(radar_file_name, 'r') as hfile:
+                return len([k for k in hfile if k.startswith("dataset")])
+
+        import netCDF4
+        from .output import NETCDF_LOCK
+
+        with NETCDF_LOCK:
+            with netCDF4.Dataset(radar_file_name) as ncid:
+                return len(ncid.dimensions['sweep'])
+    except Exception:
+        return None
+
+
+def fit_runtime_model(runs, min_runs=10):
+    """
+    Fit the processing time as a linear function of the input file size,
+    from the successful runs recorded in the manifest.
+
+    Parameters:
+    ===========
+    runs: dict
+        Runs of the manifest, see manifest.get_latest_runs.
+    min_runs: int
+        Minimum number of runs needed to fit the model.
+
+    Returns:
+    ========
+    model: tuple
+        (intercept in s, slope in s per byte), None if there are not enough
+        runs.
+    """
+    size, runtime = [], []
+    for run in runs.values():
+        if run['status'] != 'success' or not run['input_size'] or not run['timings']:
+            continue
+        try:
+            runtime.append(float(run['timings']['total']))
+        except (KeyError, TypeError, ValueError):
+            continue
+        size.append(run['input_size'])
+
+    if len(runtime) < min_runs:
+        return None
+
+    slope, intercept = np.polyfit(np.array(size, dtype=np.float64), np.array(runtime), 1)
+    if slope < 0:
+        # Size does not explain the runtime, use the mean.
+        return float(np.mean(runtime)), 0.0
+
+    return float(intercept), float(slope)
+
+
+def predict_runtimes(flist, runs=None, count_sweeps=True):
+    """
+    Predict the processing time of each file. The runtime of a previous run of
+    the same file is used if it is in the manifest. Otherwise it is predicted
+    from the file size (see fit_runtime_model), and scaled by the number of
+    sweeps relative to the median of flist (incomplete volumes are cheaper).
+    Without enough history, the prediction is only relative (the file size
+    scaled by the number of sweeps).
+
+    Parameters:
+    ===========
+    flist: list
+        Input radar files.
+    runs: dict
+        Runs of the manifest, see manifest.get_latest_runs. None for no
+        history.
+    count_sweeps: bool
+        Read the number of sweeps of each file. Opening every file is slow
+        for a whole campaign.
+
+    Returns:
+    ========
+    predictions: dict
+        Predicted runtime for each file.
+    """
+    if runs is None:
+        runs = dict()
+    model = fit_runtime_model(runs)
+
+    nsweeps = {f: get_nsweeps(f) if count_sweeps else None for f in flist}
+    known = [n for n in nsweeps.values() if n]
+    median_nsweeps = np.median(known) if len(known) > 0 else None
+
+    predictions = dict()
+    for radar_file_name in flist:
+        run = runs.get(os.path.abspath(radar_file_name))
+        try:
+            if model is not None and run['status'] == 'success':
+                predictions[radar_file_name] = float(run['timings']['total'])
+                continue
+        except (KeyError, TypeError, ValueError):
+            pass
+
+        try:
+            size = os.path.getsize(radar_file_name)
+        except OSError:
+            size = 0
+
+        if model is not None:
+            cost = model[0] + model[1] * size
+        else:
+            cost = float(size)
+        if nsweeps[radar_file_name] and median_nsweeps:
+            cost *= nsweeps[radar_file_name] / median_nsweeps
+        predictions[radar_file_name] = cost
+
+    return predictions
+
+
+def order_by_cost(flist, runs=None):
+    """
+    Sort the files by decreasing predicted processing time.
+
+    Parameters:
+    ===========
+    flist: list
+        Input radar files.
+    runs: dict
+        Runs of the manifest, see manifest.get_latest_runs.
+
+    Returns:
+    ========
+    flist: list
+        Input radar files, longest first.
+    predictions: dict
+        Predicted runtime for each file (see predict_runtimes).
+    """
+    predictions = predict_runtimes(flist, runs)
+    flist = sorted(flist, key=lambda f: predictions[f], reverse=True)
+
+    return flist, predictions
+
+
+def _file_month(radar_file_name):
+    """
+    Month of a radar file, from the date (YYYYMMDD) in its name or path.
+    None if there is no date.
+    """
+    for name in [os.path.basename(radar_file_name), radar_file_name]:
+        match = re.search(r"(?:19|20)\d{2}(0[1-9]|1[0-2])(?:0[1-9]|[12]\d|3[01])", name)
+        if match is not None:
+            return int(match.group(1))
+
+    return None
+
+
+def _size_bucket(size):
+    """
+    Size bucket of a file: log2 of its size in MB, rounded down.
+    """
+    return int(np.floor(np.log2(max(size, 1) / 2**20)))
+
+
+def get_timeout_table(runs, percentile=99, margin=1.5, min_runs=20):
+    """
+    Timeouts derived from the runtimes of the successful runs in the
+    manifest: margin times the given percentile of the runtimes of similar
+    files, i.e. same month, size bucket and dealiasing algorithm. Runtimes are
+    also pooled over all months, for the keys with too few runs.
+
+    Parameters:
+    ===========
+    runs: dict
+        Runs of the manifest, see manifest.get_latest_runs.
+    percentile: float
+        Percentile of the runtimes.
+    margin: float
+        Multiplicative margin on the percentile.
+    min_runs: int
+        Minimum number of runs for a key.
+
+    Returns:
+    ========
+    table: dict
+        Timeout in seconds for each (month, size bucket, use_unravel) key,
+        month being None for the runtimes of all months.
+    """
+    runtimes = dict()
+    for run in runs.values():
+        if run['status'] != 'success' or not run['input_size'] or not run['timings']:
+            continue
+        try:
+            runtime = float(run['timings']['total'])
+            use_unravel = bool((run['config'] or dict()).get('use_unravel', True))
+        except (KeyError, TypeError, ValueError):
+            continue
+        bucket = _size_bucket(run['input_size'])
+        for month in [_file_month(run['input_path']), None]:
+            runtimes.setdefault((month, bucket, use_unravel), []).append(runtime)
+
+    table = dict()
+    for key, values in runtimes.items():
+        if len(values) >= min_runs:
+            table[key] = margin * float(np.percentile(values, percentile))
+
+    return table
+
+
+def get_timeouts(flist, table, use_unravel=True, default=180, minimum=30):
+    """
+    Timeout of each file, from the timeouts of similar files (see
+    get_timeout_table).
+
+    Parameters:
+    ===========
+    flist: list
+        Input radar files.
+    table: dict
+        Timeouts of the similar files, see get_timeout_table.
+    use_unravel: bool
+        Dealiasing algorithm.
+    default: float
+        Timeout of the files without similar files in the table.
+    minimum: float
+        Minimum timeout.
+
+    Returns:
+    ========
+    timeouts: dict
+        Timeout in seconds for each file.
+    """
+    timeouts = dict()
+    for radar_file_name in flist:
+        try:
+            bucket = _size_bucket(os.path.getsize(radar_file_name))
+        except OSError:
+            timeouts[radar_file_name] = default
+            continue
+
+        timeout = table.get((_file_month(radar_file_name), bucket, use_unravel))
+        if timeout is None:
+            timeout = table.get((None, bucket, use_unravel), default)
+        timeouts[radar_file_name] = max(timeout, minimum)
+
+    return timeouts
@@ -0,0 +1,286 @@
+"""
+Task queue on a shared filesystem, for campaigns spread over several jobs and
+nodes. Each task is a file in the queue directory. A worker claims a task by
+creating its lease file (atomic exclusive creation), renews the lease while
+the task is running, and marks the task as done at the end. Leases that are
+not renewed (e.g. job killed at walltime) expire and are taken over by other
+workers, by exclusive creation of the lease of the next attempt. Only atomic
+exclusive file creation is used, which works on network filesystems where
+SQLite locking does not.
+
+@title: taskqueue
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    TaskQueue
+"""
+# Python Standard Library
+import os
+import json
+import time
+import socket
+
+
+class TaskQueue:
+    """
+    Task queue stored in a directory of a shared filesystem. The lease of the
+    n-th attempt of a task is the file leases/<task_id>.<n>.lease; the
+    current lease is the one of the highest attempt. Taking over an expired
+    lease is the exclusive creation of the next attempt's lease, so only one
+    worker can get it.
+
+    Parameters:
+    ===========
+    path: str
+        Queue directory.
+    lease_time: float
+        A lease not renewed for lease_time seconds is expired.
+    max_attempts: int
+        Number of expired leases after which a task is marked as failed
+        (e.g. a file that kills its worker).
+    """
+    def __init__(self, path, lease_time=600, max_attempts=3):
+        self.path = path
+        self.lease_time = lease_time
+        self.max_attempts = max_attempts
+        self._tasks_dir = os.path.join(path, 'tasks')
+        self._leases_dir = os.path.join(path, 'leases')
+        self._done_dir = os.path.join(path, 'done')
+        # Attempt of the leases held by this worker.
+        self._attempts = dict()
+
+    def _lease_file(self, task_id, attempt):
+        return os.path.join(self._leases_dir, f"{task_id}.{attempt}.lease")
+
+    def _done_file(self, task_id):
+        return os.path.join(self._done_dir, task_id + '.json')
+
+    def _write_new(self, filename, content):
+        # Exclusive creation: fails if another worker created it first.
+        fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        with os.fdopen(fd, 'w') as fid:
+            json.dump(content, fid)
+
+    def create(self, tasks, config=None):
+        """
+        Create the queue (or add tasks to an existing one).
+
+        Parameters:
+        ===========
+        tasks: list
+            Task descriptions (JSON serializable dicts), processed in this
+            order.
+        config: dict
+            Configuration shared by all the tasks.
+        """
+        for dirname in [self._tasks_dir, self._leases_dir, self._done_dir]:
+            os.makedirs(dirname, exist_ok=True)
+        if config is not None:
+            with open(os.path.join(self.path, 'config.json'), 'w') as fid:
+                json.dump(config, fid)
+
+        start = len(os.listdir(self._tasks_dir))
+        for cnt, task in enumerate(tasks):
+            self._write_new(os.path.join(self._tasks_dir, f"{start + cnt:08}.json"), task)
+
+        return None
+
+    def get_config(self):
+        """
+        Configuration shared by all the tasks.
+
+        Returns:
+        ========
+        config: dict
+            Configuration given at the creation of the queue.
+        """
+        try:
+            with open(os.path.join(self.path, 'config.json')) as fid:
+                return json.load(fid)
+        except FileNotFoundError:
+            return dict()
+
+    def _current_attempts(self):
+        """
+        Highest attempt of the leases of each task.
+        """
+        attempts = dict()
+        for name in os.listdir(self._leases_dir):
+            try:
+                task_id, attempt, _ = name.split('.')
+                attempt = int(attempt)
+            except ValueError:
+                continue
+            attempts[task_id] = max(attempts.get(task_id, 0), attempt)
+
+        return attempts
+
+    def _is_expired(self, task_id, attempt):
+        try:
+            mtime = os.path.getmtime(self._lease_file(task_id, attempt))
+        except FileNotFoundError:
+            # Released without a done file (e.g. removed by hand).
+            return True
+
+        return time.time() - mtime >= self.lease_time
+
+    def claim(self):
+        """
+        Claim the next available task: not done, not leased or with an
+        expired lease.
+
+        Returns:
+        ========
+        task_id: str
+            Task identifier (None if there is no task left).
+        task: dict
+            Task description.
+        """
+        done = set(os.listdir(self._done_dir))
+        attempts = self._current_attempts()
+        for name in sorted(os.listdir(self._tasks_dir)):
+            task_id = name[:-len('.json')]
+            if task_id + '.json' in done:
+                continue
+
+            previous = attempts.get(task_id, 0)
+            if previous > 0:
+                if not self._is_expired(task_id, previous):
+                    continue
+                if previous >= self.max_attempts:
+                    self._mark_failed(task_id, f'Lease expired {previous} times.')
+                    continue
+
+            lease = {'host': socket.gethostname(), 'pid': os.getpid(), 'attempt': previous + 1,
+                     'start': time.time()}
+            try:
+                self._write_new(self._lease_file(task_id, previous + 1), lease)
+            except FileExistsError:
+                # Another worker claimed it first.
+                continue
+
+            if os.path.exists(self._done_file(task_id)):
+                # Completed by another worker in the meantime.
+                os.remove(self._lease_file(task_id, previous + 1))
+                continue
+
+            with open(os.path.join(self._tasks_dir, name)) as fid:
+                task = json.load(fid)
+            self._attempts[task_id] = previous + 1
+
+            return task_id, task
+
+        return None, None
+
+    def get_attempt(self, task_id):
+        """
+        Attempt number of a task claimed by this worker.
+
+        Parameters:
+        ===========
+        task_id: str
+            Task identifier.
+
+        Returns:
+        ========
+        attempt: int
+            1 for the first claim, more if the task was reclaimed after its
+            lease expired (None if this worker does not hold it).
+        """
+        return self._attempts.get(task_id)
+
+    def renew(self, task_id):
+        """
+        Renew the lease of a running task.
+
+        Parameters:
+        ===========
+        task_id: str
+            Task identifier.
+
+        Returns:
+        ========
+        is_owner: bool
+            False if the lease expired and was taken over by another worker.
+        """
+        attempt = self._attempts.get(task_id)
+        if attempt is None:
+            return False
+        try:
+            os.utime(self._lease_file(task_id, attempt))
+        except FileNotFoundError:
+            return False
+
+        return self._current_attempts().get(task_id, 0) == attempt
+
+    def _mark_failed(self, task_id, message):
+        result = {'status': 'failed', 'message': message, 'host': socket.gethostname(), 'end': time.time()}
+        try:
+            self._write_new(self._done_file(task_id), result)
+        except FileExistsError:
+            pass
+
+    def complete(self, task_id, status, message=None):
+        """
+        Mark a task as done and release its lease.
+
+        Parameters:
+        ===========
+        task_id: str
+            Task identifier.
+        status: str
+            'success' or 'failed'.
+        message: str
+            Error message.
+        """
+        result = {'status': status, 'message': message, 'host': socket.gethostname(), 'end': time.time()}
+        try:
+            self._write_new(self._done_file(task_id), result)
+        except FileExistsError:
+            pass
+
+        # Only the lease of this worker is released.
+        attempt = self._attempts.pop(task_id, None)
+        if attempt is not None:
+            try:
+                os.remove(self._lease_file(task_id, attempt))
+            except FileNotFoundError:
+                pass
+
+        return None
+
+    def status(self):
+        """
+        Progress of the queue.
+
+        Returns:
+        ========
+        status: dict
+            Number of tasks in total, pending, running (valid lease), expired
+            (lease not renewed), done successfully and failed.
+        """
+        tasks = [name[:-len('.json')] for name in os.listdir(self._tasks_dir)]
+        done = dict()
+        for name in os.listdir(self._done_dir):
+            try:
+                with open(os.path.join(self._done_dir, name)) as fid:
+                    done[name[:-len('.json')]] = json.load(fid)['status']
+            except (ValueError, KeyError):
+                continue
+
+        attempts = self._current_attempts()
+        status = {'total': len(tasks), 'pending': 0, 'running': 0, 'expired': 0, 'success': 0, 'failed': 0}
+        for task_id in tasks:
+            if task_id in done:
+                status['success' if done[task_id] == 'success' else 'failed'] += 1
+            elif task_id not in attempts:
+                status['pending'] += 1
+            elif self._is_expired(task_id, attempts[task_id]):
+                status['expired'] += 1
+            else:
+                status['running'] += 1
+
+        return status
@@ -0,0 +1,56 @@
+"""
+Warm-up of the worker processes: the numba kernels are compiled (or loaded
+from the on-disk cache) on the dtypes used by the production line, when the
+worker starts instead of during its first volume. Use warm_up as the
+initializer of the worker pools.
+
+@title: warmup
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    warm_up
+"""
+# Other Libraries
+import numpy as np
+
+from . import instrumentation
+from . import profiling
+
+
+def warm_up(profile_file=None):
+    """
+    Compile the numba kernels of the processing stages on representative
+    dtypes. With cache=True, only the first worker ever compiles them, the
+    others load them from the cache.
+
+    Parameters:
+    ===========
+    profile_file: str
+        Append the warm-up record ('warmup' stage, with the numba compile
+        time) to this JSONL (or .csv) file.
+
+    Returns:
+    ========
+    warmup_time: float
+        Warm-up time in seconds.
+    """
+    from .processing import phase
+    from .processing import velocity
+
+    profile = instrumentation.StageProfile(hooks=[profiling.NumbaCompileHook()])
+    with profile.stage('warmup'):
+        # Signatures used by phase.valentin_phase_processing and
+        # velocity.unfold_from_reference, which cast their arguments to these
+        # dtypes (float32 PHIDP, float64 velocities and Python floats).
+        phase.elim_isolated(np.zeros(3, dtype=np.float32))
+        phase.populate_radials(np.zeros(3, dtype=np.float64), 3)
+        vel = np.zeros((2, 3), dtype=np.float64)
+        velocity._unfold_ambiguous_gates(vel, vel.copy(), np.ones((2, 3), dtype=np.bool_), 10.0, 0.4)
+
+    if profile_file is not None:
+        profile.save(profile_file, input_file=None, status='warmup')
+
+    return profile.records[0]['wall_time']
@@ -0,0 +1,109 @@
+"""
+Benchmark of the import time of cpol_processing and of its heavy
+dependencies. Each import is timed in a fresh interpreter (as a new pool
+worker or a radar_single.py run would pay it), and the heavy dependencies
+loaded by the import are listed.
+
+@title: benchmark_import
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    main
+    time_import
+"""
+# Python Standard Library
+import sys
+import json
+import argparse
+import subprocess
+
+# Other Libraries
+import crayons
+import numpy as np
+
+
+HEAVY_MODULES = ['pyart', 'netCDF4', 'scipy', 'sklearn', 'numba', 'csu_radartools', 'unravel']
+
+_TIMER = """
+import sys, json, time, warnings
+warnings.simplefilter('ignore')
+tick = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - tick
+print(json.dumps([elapsed, [m for m in {heavy} if m in sys.modules]]))
+"""
+
+
+def time_import(module, repeat=5):
+    """
+    Import time of a module in fresh interpreters.
+
+    Parameters:
+    ===========
+    module: str
+        Module name.
+    repeat: int
+        Number of interpreters.
+
+    Returns:
+    ========
+    times: list
+        Import time in seconds of each run.
+    loaded: list
+        Heavy dependencies loaded by the import.
+    """
+    code = _TIMER.format(module=module, heavy=HEAVY_MODULES)
+    times, loaded = [], []
+    for _ in range(repeat):
+        rslt = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        elapsed, loaded = json.loads(rslt.stdout.strip().splitlines()[-1])
+        times.append(elapsed)
+
+    return times, loaded
+
+
+def main():
+    """
+    Print the import time of each module.
+    """
+    print(f"{'Module':<40} {'Median (s)':>10} {'Min (s)':>10}  Heavy dependencies loaded")
+    for module in MODULES:
+        try:
+            times, loaded = time_import(module, REPEAT)
+        except subprocess.CalledProcessError as error:
+            print(crayons.red(f"{module:<40} import failed: {error.stderr.strip().splitlines()[-1]}"))
+            continue
+        print(f"{module:<40} {np.median(times):>10.3f} {np.min(times):>10.3f}  {', '.join(loaded)}")
+
+    return None
+
+
+if __name__ == '__main__':
+    parser_description = "Benchmark of the import time of cpol_processing and its dependencies."
+    parser = argparse.ArgumentParser(description=parser_description)
+    parser.add_argument(
+        '-m',
+        '--modules',
+        dest='modules',
+        type=str,
+        default=','.join(['cpol_processing', 'cpol_processing.production', 'cpol_processing.processing.phase',
+                          'cpol_processing.processing.velocity', 'cpol_processing.processing.hydrometeors'] +
+                         HEAVY_MODULES),
+        help='Comma separated list of modules to import.')
+    parser.add_argument(
+        '-n',
+        '--repeat',
+        dest='repeat',
+        type=int,
+        default=5,
+        help='Number of fresh interpreters per module.')
+
+    args = parser.parse_args()
+    MODULES = args.modules.split(',')
+    REPEAT = args.repeat
+
+    print(crayons.yellow(f"Import time over {REPEAT} fresh interpreters."))
+    main()
@@ -0,0 +1,81 @@
+"""
+Benchmark of the CF/Radial output compression settings. Reports the write
+time and the file size for each setting.
+
+@title: benchmark_output
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    main
+"""
+# Python Standard Library
+import os
+import argparse
+import tempfile
+import warnings
+
+# Other Libraries
+import crayons
+
+
+def main():
+    """
+    Write the input radar file with each compression setting.
+    """
+    settings = [{'deflate_level': 0, 'shuffle': False, 'quantize': False},
+                {'deflate_level': 1, 'shuffle': False, 'quantize': False},
+                {'deflate_level': 4, 'shuffle': False, 'quantize': False},
+                {'deflate_level': 1, 'shuffle': True, 'quantize': False},
+                {'deflate_level': 1, 'shuffle': True, 'quantize': True},
+                {'deflate_level': 4, 'shuffle': True, 'quantize': True},
+                {'deflate_level': 9, 'shuffle': True, 'quantize': True},
+                {'deflate_level': 1, 'shuffle': True, 'quantize': True, 'pack_int16': True},
+                {'deflate_level': 4, 'shuffle': True, 'quantize': True, 'pack_int16': True}]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        import pyart
+        from cpol_processing import output
+
+        radar = pyart.io.read(INFILE)
+        with tempfile.TemporaryDirectory(dir=OUTPATH) as tmpdir:
+            results = output.benchmark_write(radar, tmpdir, settings)
+
+    print(f"{'Setting':<80} {'Time (s)':>10} {'Size (MB)':>10}")
+    for rslt in results:
+        setting = ", ".join(f"{k}={v}" for k, v in rslt['setting'].items())
+        print(f"{setting:<80} {rslt['write_time']:>10.2f} {rslt['file_size'] / 2**20:>10.2f}")
+
+    return None
+
+
+if __name__ == '__main__':
+    parser_description = "Benchmark of the output compression settings on a (processed) radar file."
+    parser = argparse.ArgumentParser(description=parser_description)
+    parser.add_argument(
+        '-i',
+        '--input',
+        dest='infile',
+        type=str,
+        help='Input file',
+        required=True)
+    parser.add_argument(
+        '-o',
+        '--output',
+        dest='outdir',
+        type=str,
+        help='Directory for temporary files.',
+        default=tempfile.gettempdir())
+
+    args = parser.parse_args()
+    INFILE = args.infile
+    OUTPATH = args.outdir
+
+    if not os.path.isfile(INFILE):
+        parser.error("Invalid input file.")
+
+    print(crayons.yellow(f"Benchmarking output compression with {INFILE}."))
+    main()
@@ -1,57 +1,272 @@
+"""
+Generate the PBS job scripts of a campaign. The input tree is inventoried,
+and the walltime, memory and number of CPUs of each job are fitted from the
+runtimes recorded in the manifest and the peak memory recorded in the stage
+profiles. Several months can be packed into one job.
+
+@title: generate_qsub_scripts
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    configuration_file
+    get_worker_memory
+    main
+"""
 import os
-import glob
-import datetime
+import sys
+import argparse
 import calendar
+import datetime
+
+import numpy as np
+
+from cpol_processing import campaign
+from cpol_processing import manifest
 
 
-def configuration_file(start_date='19990101', end_date='19990131', walltime=10):
+def configuration_file(start_date='19990101', end_date='19990131', walltime=10, ncpus=16, mem=32, queue=None,
+                       extra_args=''):
+    """
+    PBS job script.
+
+    Parameters:
+    ===========
+    start_date: str
+        First day (YYYYMMDD).
+    end_date: str
+        Last day (YYYYMMDD).
+    walltime: float
+        Walltime in hours.
+    ncpus: int
+        Number of CPUs.
+    mem: int
+        Memory in GB.
+    queue: str
+        PBS queue. None for express if the walltime is 7 hours or less, normal
+        otherwise.
+    extra_args: str
+        Extra arguments of radar_pack.py.
+
+    Returns:
+    ========
+    conf_txt: str
+        Job script.
+    """
+    if queue is None:
+        queue = "express" if walltime <= 7 else "normal"
+    seconds = int(np.ceil(walltime * 3600))
+    time = "%02i:%02i:%02i" % (seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
     conf_txt = """#!/bin/bash
 #PBS -P kl02
-#PBS -q normal
-#PBS -l walltime={time}:00:00
-#PBS -l mem=32GB
+#PBS -q {queue}
+#PBS -l walltime={time}
+#PBS -l mem={mem}GB
 #PBS -l wd
-#PBS -l ncpus=16
+#PBS -l ncpus={ncpus}
 #PBS -lother=gdata1
 conda activate radar
-python new_multiproc_manager.py -s {sdate} -e {edate}
-""".format(time=walltime, sdate=start_date, edate=end_date)
-    if walltime <= 7:
-        conf_txt = conf_txt.replace("normal", "express")
+python radar_pack.py -s {sdate} -e {edate} -j {ncpus}{extra}
+""".format(queue=queue, time=time, mem=mem, ncpus=ncpus, sdate=start_date, edate=end_date,
+           extra=' ' + extra_args if extra_args else '')
 
     return conf_txt
 
-for year in range(1997, 2018):
-    for month in range(1, 13):
-        if month > 7 and month < 10:
-            continue
 
-        if month < 8:
-            season_st = ((year - 1) % 100)
-            season_nd = ((year) % 100)
-        else:
-            season_st = (year % 100)
-            season_nd = ((year + 1) % 100)
-        season = "%02i%02i" % (season_st, season_nd)
- 
-        indir = "/g/data/hj10/cpol_level_1a/ppi"
-        indir += "/%i/%i%02i" % (year, year, month)
-        dirlist = glob.glob(indir + "*")
-        print(indir)
-        if len(dirlist) == 0:
-            continue
-
-        _, ed = calendar.monthrange(year, month)
-        sdatestr = "%i%02i%02i" % (year, month, 1)
-        edatestr = "%i%02i%02i" % (year, month, ed)
-        if month == 10 or month == 5:
-            f = configuration_file(sdatestr, edatestr, 5)
-        elif month == 11:
-            f = configuration_file(sdatestr, edatestr, 7)
-        else:
-            f = configuration_file(sdatestr, edatestr, 10)
+def get_worker_memory(flist, peak_memory, percentile=99, default=2 * 2**30):
+    """
+    Peak memory of a worker processing a list of files: percentile of the
+    peak RSS recorded for these files, or for all the files if none of them
+    was profiled.
+
+    Parameters:
+    ===========
+    flist: list
+        Input radar files.
+    peak_memory: dict
+        Peak RSS for each input file, see campaign.load_peak_memory.
+    percentile: float
+        Percentile of the peak RSS.
+    default: float
+        Worker memory in bytes without profiles.
+
+    Returns:
+    ========
+    worker_memory: float
+        Peak memory of a worker in bytes.
+    """
+    values = [peak_memory[os.path.abspath(f)] for f in flist if os.path.abspath(f) in peak_memory]
+    if len(values) == 0:
+        values = list(peak_memory.values())
+    if len(values) == 0:
+        return default
 
+    return float(np.percentile(values, percentile))
 
-        fname = "qlevel1b_%i%02i.pbs" % (year, month)
-        with open(fname, 'w') as fid:
+
+def main():
+    """
+    Write one job script per job.
+    """
+    start = datetime.datetime.strptime(START_DATE, "%Y%m%d")
+    end = datetime.datetime.strptime(END_DATE, "%Y%m%d")
+    runs = manifest.get_latest_runs(MANIFEST) if MANIFEST is not None else None
+    peak_memory = campaign.load_peak_memory(PROFILE_FILE) if PROFILE_FILE is not None else dict()
+
+    months = campaign.group_by_month(campaign.get_inventory(INPATH, start, end))
+    groups = []
+    for (year, month), files in months.items():
+        flist = [f for f, _ in files]
+        runtimes = campaign.predict_file_runtimes(flist, runs, default_runtime=DEFAULT_RUNTIME)
+        nbytes = sum(size for _, size in files)
+        print("%i-%02i: %i files, %.1f GB, %.1f CPU hours." % (year, month, len(flist), nbytes / 2**30,
+                                                               sum(runtimes.values()) / 3600))
+        groups.append(((year, month), list(runtimes.values())))
+
+    flist = [f for files in months.values() for f, _ in files]
+    worker_memory = get_worker_memory(flist, peak_memory)
+    kwargs = {'worker_memory': worker_memory, 'target_walltime': TARGET_WALLTIME * 3600,
+              'max_ncpus': MAX_NCPUS, 'margin': MARGIN}
+    if PACK:
+        jobs = campaign.pack_jobs(groups, **kwargs)
+    else:
+        jobs = [([label], campaign.estimate_resources(runtimes, **kwargs)) for label, runtimes in groups]
+
+    os.makedirs(OUTDIR, exist_ok=True)
+    for labels, resources in jobs:
+        (syear, smonth), (eyear, emonth) = labels[0], labels[-1]
+        _, ed = calendar.monthrange(eyear, emonth)
+        sdatestr = "%i%02i%02i" % (syear, smonth, 1)
+        edatestr = "%i%02i%02i" % (eyear, emonth, ed)
+        walltime = resources['walltime'] / 3600
+        if walltime > TARGET_WALLTIME:
+            print(f"Job {sdatestr}-{edatestr} needs {walltime:.1f} hours with {resources['ncpus']} CPUs.")
+
+        f = configuration_file(sdatestr, edatestr, walltime, resources['ncpus'],
+                               int(np.ceil(resources['memory'] / 2**30)), QUEUE, EXTRA_ARGS)
+        if len(labels) == 1:
+            fname = "qlevel1b_%i%02i.pbs" % (syear, smonth)
+        else:
+            fname = "qlevel1b_%i%02i_%i%02i.pbs" % (syear, smonth, eyear, emonth)
+        with open(os.path.join(OUTDIR, fname), 'w') as fid:
             fid.write(f)
+
+    print(f"{len(jobs)} job scripts written in {OUTDIR}.")
+
+    return None
+
+
+if __name__ == '__main__':
+    INPATH = "/g/data/hj10/cpol_level_1a/ppi/"
+
+    parser_description = "Generate the PBS job scripts of a campaign, with fitted resources."
+    parser = argparse.ArgumentParser(description=parser_description)
+    parser.add_argument(
+        '-s',
+        '--start-date',
+        dest='start_date',
+        default='19970101',
+        type=str,
+        help='Starting date.')
+    parser.add_argument(
+        '-e',
+        '--end-date',
+        dest='end_date',
+        default='20171231',
+        type=str,
+        help='Ending date.')
+    parser.add_argument(
+        '-i',
+        '--inpath',
+        dest='inpath',
+        default=INPATH,
+        type=str,
+        help='Input directory (year/YYYYMMDD/ tree).')
+    parser.add_argument(
+        '-o',
+        '--outdir',
+        dest='outdir',
+        default='.',
+        type=str,
+        help='Output directory of the job scripts.')
+    parser.add_argument(
+        '--manifest',
+        dest='manifest',
+        default=None,
+        type=str,
+        help='SQLite manifest database, for the runtimes of the processed files.')
+    parser.add_argument(
+        '--profile-file',
+        dest='profile_file',
+        default=None,
+        type=str,
+        help='Stage profiles (JSONL or .csv), for the peak memory of the workers.')
+    parser.add_argument(
+        '--default-runtime',
+        dest='default_runtime',
+        default=120,
+        type=float,
+        help='Mean processing time of a file in seconds, without enough history in the manifest.')
+    parser.add_argument(
+        '--target-walltime',
+        dest='target_walltime',
+        default=10,
+        type=float,
+        help='Target walltime of a job in hours.')
+    parser.add_argument(
+        '--max-ncpus',
+        dest='max_ncpus',
+        default=16,
+        type=int,
+        help='Maximum number of CPUs of a job.')
+    parser.add_argument(
+        '--margin',
+        dest='margin',
+        default=1.2,
+        type=float,
+        help='Multiplicative margin on the walltime and memory.')
+    parser.add_argument(
+        '--pack',
+        dest='pack',
+        action='store_true',
+        help='Pack several months into one job, within the target walltime.')
+    parser.add_argument(
+        '-q',
+        '--queue',
+        dest='queue',
+        default=None,
+        type=str,
+        help='PBS queue (default: express for jobs of 7 hours or less, normal otherwise).')
+    parser.add_argument(
+        '--extra-args',
+        dest='extra_args',
+        default='',
+        type=str,
+        help='Extra arguments of radar_pack.py (e.g. "--manifest manifest.db").')
+
+    args = parser.parse_args()
+    START_DATE = args.start_date
+    END_DATE = args.end_date
+    INPATH = args.inpath
+    OUTDIR = args.outdir
+    MANIFEST = args.manifest
+    PROFILE_FILE = args.profile_file
+    DEFAULT_RUNTIME = args.default_runtime
+    TARGET_WALLTIME = args.target_walltime
+    MAX_NCPUS = args.max_ncpus
+    MARGIN = args.margin
+    PACK = args.pack
+    QUEUE = args.queue
+    EXTRA_ARGS = args.extra_args
+
+    try:
+        if datetime.datetime.strptime(START_DATE, "%Y%m%d") > datetime.datetime.strptime(END_DATE, "%Y%m%d"):
+            parser.error('End date older than start date.')
+    except ValueError:
+        parser.error('Invalid dates.')
+        sys.exit()
+
+    main()
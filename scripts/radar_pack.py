@@ -12,8 +12,10 @@ Tested on CPOL.
 .. autosummary::
     :toctree: generated/
 
-    chunks
     main
+    main_day
+    run_pool
+    welcome_message
 """
 # Python Standard Library
 import os
@@ -25,17 +27,80 @@ import traceback
 
 import crayons
 
-from concurrent.futures import TimeoutError
+from concurrent.futures import TimeoutError, wait, FIRST_COMPLETED
 from pebble import ProcessPool, ProcessExpired
 
+from cpol_processing import manifest
+from cpol_processing import scheduling
+from cpol_processing.warmup import warm_up
 
-def chunks(l, n):
+
+def run_pool(arglist, ncpus, max_tasks=16, timeout=180, retry_timeout=None, profile_file=None, function=None):
     """
-    Yield successive n-sized chunks from l.
-    From http://stackoverflow.com/a/312464
+    Process all the files with a single pool of workers. The tasks are fed
+    continuously to the workers, which are replaced after max_tasks tasks to
+    contain memory leaks. Each worker compiles the numba kernels when it
+    starts (see warmup). A task processed with UNRAVEL that times out is
+    retried once with the (cheaper) region-based dealiasing.
+
+    Parameters:
+    ===========
+    arglist: list
+        Arguments of function for each task.
+    ncpus: int
+        Number of workers.
+    max_tasks: int
+        Number of tasks after which a worker is replaced (0 for never).
+    timeout: float or dict
+        Maximum processing time of a task in seconds, or dict of the timeout
+        of each task (keyed by its first argument).
+    retry_timeout: float or dict
+        Timeout of the retries (same as timeout if None).
+    profile_file: str
+        Append the warm-up record of each worker to this file.
+    function: function
+        main (one task per file, default) or main_day (one task per day).
     """
-    for i in range(0, len(l), n):
-        yield l[i:i + n]
+    def _get_timeout(timeouts, infile):
+        if isinstance(timeouts, dict):
+            return timeouts[infile]
+        return timeouts
+
+    if retry_timeout is None:
+        retry_timeout = timeout
+    if function is None:
+        function = main
+
+    with ProcessPool(max_workers=ncpus, max_tasks=max_tasks, initializer=warm_up,
+                     initargs=(profile_file,)) as pool:
+        futures = dict()
+        for inargs in arglist:
+            future = pool.schedule(function, args=(inargs,), timeout=_get_timeout(timeout, inargs[0]))
+            futures[future] = (inargs, False)
+
+        while len(futures) > 0:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                inargs, is_retry = futures.pop(future)
+                infile = inargs[0]
+                try:
+                    future.result()
+                except TimeoutError as error:
+                    print("%s took longer than %d seconds" % (infile, error.args[1]))
+                    if not is_retry and inargs[3]:
+                        # Retry with region-based dealiasing, overwriting any partial output.
+                        print(f"Retrying {infile} with region-based dealiasing.")
+                        retry_args = inargs[:3] + (False, 'overwrite') + inargs[5:]
+                        retry = pool.schedule(function, args=(retry_args,),
+                                              timeout=_get_timeout(retry_timeout, infile))
+                        futures[retry] = (retry_args, True)
+                except ProcessExpired as error:
+                    print("%s: %s. Exit code: %d" % (infile, error, error.exitcode))
+                except Exception as error:
+                    print("%s raised %s" % (infile, error))
+                    print(error.traceback)  # Python's traceback of remote process
+
+    return None
 
 
 def main(inargs):
@@ -46,26 +111,63 @@ def main(inargs):
 
     Parameters:
     ===========
-    infile: str
-        Name of the input radar file.
-    outpath: str
-        Path for saving output data.
+    inargs: tuple
+        (infile, outpath, sound_dir, use_unravel, on_exists, manifest,
+        profile_file, products, output_format): arguments of
+        process_and_save.
     """
     import warnings
-    import traceback
 
-    infile, outpath, sound_dir, use_unravel = inargs
+    infile, outpath, sound_dir, use_unravel, on_exists, manifest, profile_file, products, output_format = inargs
 
     with warnings.catch_warnings():
         warnings.simplefilter('ignore')
         import cpol_processing
 
     try:
-        cpol_processing.process_and_save(infile, outpath, sound_dir=sound_dir, use_unravel=use_unravel)
+        cpol_processing.process_and_save(infile, outpath, sound_dir=sound_dir, use_unravel=use_unravel,
+                                         on_exists=on_exists, manifest=manifest, profile_file=profile_file,
+                                         products=products, output_format=output_format)
+    except Exception:
+        traceback.print_exc()
+        return None
+
+    return None
+
+
+def main_day(inargs):
+    """
+    Process the files of a day, in time order, in the same worker with
+    process_sequence: the dealiasing of each volume starts from the previous
+    one, the next volume is read and the previous one written while a volume
+    is processed, and a daily file is written by a single writer.
+
+    Parameters:
+    ===========
+    inargs: tuple
+        (day, outpath, sound_dir, use_unravel, on_exists, manifest,
+        profile_file, products, output_format, flist): arguments of
+        process_sequence, flist being the input files of the day.
+    """
+    import warnings
+
+    day, outpath, sound_dir, use_unravel, on_exists, manifest, profile_file, products, output_format, flist = inargs
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        from cpol_processing import production
+
+    try:
+        errors = production.process_sequence(flist, outpath, sound_dir=sound_dir, use_unravel=use_unravel,
+                                             on_exists=on_exists, manifest=manifest, output_format=output_format,
+                                             profile_file=profile_file, products=products)
     except Exception:
         traceback.print_exc()
         return None
 
+    for name, error in errors:
+        print(f"{day}: {name} failed: {error!r}")
+
     return None
 
 
@@ -119,12 +221,86 @@ calculation, and rainfall rate estimation."""
         required=True)
     parser.add_argument('--unravel', dest='unravel', action='store_true')
     parser.add_argument('--no-unravel', dest='unravel', action='store_false')
+    parser.add_argument(
+        '--on-exists',
+        dest='on_exists',
+        default='skip',
+        choices=['skip', 'overwrite', 'verify'],
+        help='What to do with already existing output files.')
+    parser.add_argument(
+        '--manifest',
+        dest='manifest',
+        default=None,
+        type=str,
+        help='SQLite manifest database. Only new, failed, or stale files are processed.')
+    parser.add_argument(
+        '--profile-file',
+        dest='profile_file',
+        default=None,
+        type=str,
+        help='Append the timings and memory usage of each processing stage to this JSONL (or .csv) file.')
+    parser.add_argument(
+        '--products',
+        dest='products',
+        default=None,
+        type=str,
+        help='Comma separated list of output fields, e.g. "velocity" (default: all). Only the stages needed for them are run.')
+    parser.add_argument(
+        '-j',
+        '--ncpus',
+        dest='ncpus',
+        default=os.cpu_count(),
+        type=int,
+        help='Number of worker processes.')
+    parser.add_argument(
+        '--max-tasks',
+        dest='max_tasks',
+        default=16,
+        type=int,
+        help='Number of files processed by a worker before it is replaced (0 for never).')
+    parser.add_argument(
+        '--timeout',
+        dest='timeout',
+        default=180,
+        type=float,
+        help='Maximum processing time of a file in seconds, for the files without similar runs in the manifest (with --manifest, the timeouts come from the runtimes of similar files).')
+    parser.add_argument(
+        '--order',
+        dest='order',
+        default='cost',
+        choices=['cost', 'name'],
+        help='Processing order: longest predicted runtime first (from file size, sweeps and manifest history) or file name. With --by-day, the days are ordered by their total predicted runtime.')
+    parser.add_argument(
+        '--by-day',
+        dest='by_day',
+        action='store_true',
+        help='One task per day: the files of a day are processed in time order by the same worker (warm-start dealiasing, prefetching, write-behind).')
+    parser.add_argument(
+        '--format',
+        dest='output_format',
+        default='cfradial',
+        choices=['cfradial', 'zarr', 'daily'],
+        help='Output format. daily (one netCDF file per day) requires --by-day.')
     parser.set_defaults(unravel=True)
 
     args = parser.parse_args()
     START_DATE = args.start_date
     END_DATE = args.end_date
     USE_UNRAVEL = args.unravel
+    ON_EXISTS = args.on_exists
+    MANIFEST = args.manifest
+    PROFILE_FILE = args.profile_file
+    PRODUCTS = args.products.split(',') if args.products is not None else None
+    NCPUS = args.ncpus
+    MAX_TASKS = args.max_tasks
+    TIMEOUT = args.timeout
+    ORDER = args.order
+    BY_DAY = args.by_day
+    OUTPUT_FORMAT = args.output_format
+    if OUTPUT_FORMAT == 'daily' and not BY_DAY:
+        # Each volume would reopen the daily file, and the workers would wait
+        # for each other's lock on it.
+        parser.error('The daily output format requires --by-day.')
 
     # Display infos
     welcome_message()
@@ -140,6 +316,9 @@ calculation, and rainfall rate estimation."""
         parser.error('Invalid dates.')
         sys.exit()
 
+    runs = manifest.get_latest_runs(MANIFEST) if MANIFEST is not None else None
+    arglist = []
+    daylist = []
     for day in date_range:
         input_dir = os.path.join(INPATH, str(day.year), day.strftime("%Y%m%d"), "*.*")
         flist = sorted(glob.glob(input_dir))
@@ -149,22 +328,55 @@ calculation, and rainfall rate estimation."""
 
         print(f'{len(flist)} files found for ' + day.strftime("%Y-%b-%d"))
 
-        for flist_chunk in chunks(flist, 16):
-            arglist = [(f, OUTPATH, SOUND_DIR, USE_UNRAVEL) for f in flist_chunk]
-
-            with ProcessPool() as pool:
-                future = pool.map(main, arglist, timeout=180)
-                iterator = future.result()
-
-                while True:
-                    try:
-                        result = next(iterator)
-                    except StopIteration:
-                        break
-                    except TimeoutError as error:
-                        print("function took longer than %d seconds" % error.args[1])
-                    except ProcessExpired as error:
-                        print("%s. Exit code: %d" % (error, error.exitcode))
-                    except Exception as error:
-                        print("function raised %s" % error)
-                        print(error.traceback)  # Python's traceback of remote process
+        on_exists = {f: ON_EXISTS for f in flist}
+        if MANIFEST is not None:
+            config = manifest.stage_configuration(SOUND_DIR, 'CPOL', USE_UNRAVEL, PRODUCTS)
+            flist = manifest.select_files(MANIFEST, flist, config)
+            for f in flist:
+                # Stale output from a previous successful run.
+                if runs.get(os.path.abspath(f), {}).get('status') == 'success':
+                    on_exists[f] = 'overwrite'
+            print(f'{len(flist)} files to process according to the manifest.')
+
+        arglist += [(f, OUTPATH, SOUND_DIR, USE_UNRAVEL, on_exists[f], MANIFEST, PROFILE_FILE, PRODUCTS,
+                     OUTPUT_FORMAT) for f in flist]
+        if len(flist) > 0:
+            daylist.append((day.strftime("%Y%m%d"), flist))
+
+    if ORDER == 'cost':
+        # Longest predicted runtime first.
+        flist, predictions = scheduling.order_by_cost([inargs[0] for inargs in arglist], runs)
+        rank = {f: cnt for cnt, f in enumerate(flist)}
+        arglist.sort(key=lambda inargs: rank[inargs[0]])
+
+    flist = [inargs[0] for inargs in arglist]
+    timeout, retry_timeout = TIMEOUT, TIMEOUT
+    if runs is not None:
+        # Timeouts from the runtimes of similar files.
+        table = scheduling.get_timeout_table(runs)
+        timeout = scheduling.get_timeouts(flist, table, USE_UNRAVEL, default=TIMEOUT)
+        retry_timeout = scheduling.get_timeouts(flist, table, False, default=TIMEOUT)
+
+    if BY_DAY:
+        # The files of a day stay in time order (the dealiasing of a volume
+        # starts from the previous one): the ordering by cost only applies
+        # to the days, longest total predicted runtime first. A day times
+        # out after the sum of the timeouts of its files.
+        on_exists = {inargs[0]: inargs[4] for inargs in arglist}
+        if ORDER == 'cost':
+            daylist.sort(key=lambda item: sum(predictions[f] for f in item[1]), reverse=True)
+        timeout = {day: sum(timeout[f] if isinstance(timeout, dict) else timeout for f in files)
+                   for day, files in daylist}
+        retry_timeout = {day: sum(retry_timeout[f] if isinstance(retry_timeout, dict) else retry_timeout
+                                  for f in files) for day, files in daylist}
+        # One on_exists policy per day: overwrite if any file is stale.
+        arglist = [(day, OUTPATH, SOUND_DIR, USE_UNRAVEL,
+                    'overwrite' if any(on_exists[f] == 'overwrite' for f in files) else ON_EXISTS,
+                    MANIFEST, PROFILE_FILE, PRODUCTS, OUTPUT_FORMAT, files) for day, files in daylist]
+        print(f'{len(daylist)} days ({len(flist)} files) to process with {NCPUS} workers.')
+        run_pool(arglist, NCPUS, max_tasks=MAX_TASKS, timeout=timeout, retry_timeout=retry_timeout,
+                 profile_file=PROFILE_FILE, function=main_day)
+    else:
+        print(f'{len(arglist)} files to process with {NCPUS} workers.')
+        run_pool(arglist, NCPUS, max_tasks=MAX_TASKS, timeout=timeout, retry_timeout=retry_timeout,
+                 profile_file=PROFILE_FILE)
@@ -0,0 +1,265 @@
+"""
+Dry run of a campaign: walks the INPATH/year/YYYYMMDD tree used by
+radar_pack.py and reports, for each month, the number of input files, the
+days without data, the expected CPU hours and output storage, and the
+outputs that already exist. Nothing is processed, unless a benchmark sample
+is requested to calibrate the estimate.
+
+@title: radar_plan
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    benchmark
+    main
+"""
+# Python Standard Library
+import os
+import sys
+import time
+import random
+import argparse
+import calendar
+import datetime
+import tempfile
+import traceback
+
+import crayons
+
+from cpol_processing import campaign
+from cpol_processing import manifest
+
+
+def benchmark(flist, nsample):
+    """
+    Process a random sample of files in a temporary directory, to measure the
+    processing time and the output size. A file that raises an exception is
+    recorded as failed, and the estimate comes from the other files.
+
+    Parameters:
+    ===========
+    flist: list
+        Input radar files.
+    nsample: int
+        Number of files to process.
+
+    Returns:
+    ========
+    runtime: float
+        Mean processing time of a file in seconds (None if all the files
+        failed).
+    ratio: float
+        Output size over input size (None if nothing was written).
+    failed: list
+        Files that raised an exception.
+    """
+    import warnings
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        import cpol_processing
+
+    def _dir_size(path):
+        return sum(os.path.getsize(os.path.join(dirpath, f)) for dirpath, _, filenames in os.walk(path)
+                   for f in filenames)
+
+    sample = random.sample(flist, min(nsample, len(flist)))
+    runtimes, failed, insize, outsize = [], [], 0, 0
+    with tempfile.TemporaryDirectory() as outpath:
+        for radar_file_name in sample:
+            size = _dir_size(outpath)
+            tick = time.time()
+            try:
+                cpol_processing.process_and_save(radar_file_name, outpath, sound_dir=SOUND_DIR,
+                                                 use_unravel=USE_UNRAVEL, on_exists='overwrite')
+            except Exception as error:
+                print("%s raised %s" % (radar_file_name, error))
+                traceback.print_exc()
+                failed.append(radar_file_name)
+                continue
+            runtimes.append(time.time() - tick)
+            insize += os.path.getsize(radar_file_name)
+            outsize += _dir_size(outpath) - size
+
+    runtime = sum(runtimes) / len(runtimes) if len(runtimes) > 0 else None
+    ratio = outsize / insize if outsize > 0 else None
+
+    return runtime, ratio, failed
+
+
+def main(start, end):
+    """
+    Print the estimate of each month and of the whole campaign.
+
+    Parameters:
+    ===========
+    start: datetime
+        First day.
+    end: datetime
+        Last day.
+    """
+    inventory = campaign.get_inventory(INPATH, start, end)
+    if len(inventory) == 0:
+        print(crayons.red("No file found."))
+        return None
+
+    runs = manifest.get_latest_runs(MANIFEST) if MANIFEST is not None else None
+    default_runtime, ratio = DEFAULT_RUNTIME, None
+    if runs is not None:
+        ratio = campaign.get_output_ratio(runs)
+    if NSAMPLE > 0:
+        flist = [f for files in inventory.values() for f, _ in files]
+        sample_runtime, sample_ratio, failed = benchmark(flist, NSAMPLE)
+        ratio = sample_ratio if sample_ratio is not None else ratio
+        nsuccess = min(NSAMPLE, len(flist)) - len(failed)
+        if len(failed) > 0:
+            print(crayons.red(f"{len(failed)} files of the benchmark failed: {', '.join(failed)}"))
+        if sample_runtime is not None:
+            default_runtime = sample_runtime
+            print(f"Benchmark of {nsuccess} files: {default_runtime:.1f} s per file.")
+        else:
+            print(crayons.red(f"Benchmark failed, using the default runtime of {default_runtime:.1f} s per file."))
+    if ratio is None:
+        ratio = DEFAULT_RATIO
+
+    outpath_ppi = os.path.join(OUTPATH, "v{}".format(datetime.datetime.utcnow().strftime('%Y')), 'ppi')
+
+    header = "%-8s %6s %9s %9s %10s %10s %10s %9s" % ('month', 'days', 'files', 'input GB', 'CPU hours',
+                                                     'output GB', 'existing', 'exist GB')
+    print(header)
+    print('-' * len(header))
+    months = campaign.group_by_month(inventory)
+    totals = dict.fromkeys(['files', 'nbytes', 'cpu', 'output', 'existing', 'existing_bytes'], 0)
+    for cnt in range((end.year - start.year) * 12 + end.month - start.month + 1):
+        year, month = start.year + (start.month - 1 + cnt) // 12, (start.month - 1 + cnt) % 12 + 1
+        files = months.get((year, month), [])
+        days = [day for day in inventory if (day.year, day.month) == (year, month)]
+        ndays = calendar.monthrange(year, month)[1]
+        if (year, month) == (start.year, start.month):
+            ndays -= start.day - 1
+        if (year, month) == (end.year, end.month):
+            ndays -= calendar.monthrange(year, month)[1] - end.day
+
+        if len(files) == 0:
+            print(crayons.red("%04i-%02i  %2i/%-3i   no data" % (year, month, 0, ndays)))
+            continue
+
+        flist = [f for f, _ in files]
+        nbytes = sum(size for _, size in files)
+        cpu = sum(campaign.predict_file_runtimes(flist, runs, default_runtime=default_runtime).values()) / 3600
+        existing, existing_bytes = 0, 0
+        for day in days:
+            noutputs, outbytes = campaign.count_outputs(outpath_ppi, day)
+            existing += noutputs
+            existing_bytes += outbytes
+
+        print("%04i-%02i  %2i/%-3i %9i %9.1f %10.1f %10.1f %10i %9.1f" % (
+            year, month, len(days), ndays, len(flist), nbytes / 2**30, cpu, ratio * nbytes / 2**30, existing,
+            existing_bytes / 2**30))
+        totals['files'] += len(flist)
+        totals['nbytes'] += nbytes
+        totals['cpu'] += cpu
+        totals['output'] += ratio * nbytes
+        totals['existing'] += existing
+        totals['existing_bytes'] += existing_bytes
+
+    print('-' * len(header))
+    print("%-15s %9i %9.1f %10.1f %10.1f %10i %9.1f" % (
+        'total', totals['files'], totals['nbytes'] / 2**30, totals['cpu'], totals['output'] / 2**30,
+        totals['existing'], totals['existing_bytes'] / 2**30))
+
+    return None
+
+
+if __name__ == '__main__':
+    """
+    Global variables definition.
+    """
+    # Main global variables (Path directories).
+    INPATH = "/g/data/hj10/cpol_level_1a/ppi/"
+    OUTPATH = "/g/data/hj10/cpol_level_1b/"
+    SOUND_DIR = "/g/data2/rr5/CPOL_radar/DARWIN_radiosonde"
+
+    # Parse arguments
+    parser_description = """Dry run of a campaign: file counts, CPU hours and
+storage per month, and existing outputs."""
+    parser = argparse.ArgumentParser(description=parser_description)
+    parser.add_argument(
+        '-s',
+        '--start-date',
+        dest='start_date',
+        default=None,
+        type=str,
+        help='Starting date.',
+        required=True)
+    parser.add_argument(
+        '-e',
+        '--end-date',
+        dest='end_date',
+        default=None,
+        type=str,
+        help='Ending date.',
+        required=True)
+    parser.add_argument(
+        '-i',
+        '--inpath',
+        dest='inpath',
+        default=INPATH,
+        type=str,
+        help='Input directory (year/YYYYMMDD/ tree).')
+    parser.add_argument(
+        '-o',
+        '--outpath',
+        dest='outpath',
+        default=OUTPATH,
+        type=str,
+        help='Output directory, to count the existing outputs.')
+    parser.add_argument('--unravel', dest='unravel', action='store_true')
+    parser.add_argument('--no-unravel', dest='unravel', action='store_false')
+    parser.add_argument(
+        '--manifest',
+        dest='manifest',
+        default=None,
+        type=str,
+        help='SQLite manifest database, for the stored timings and output sizes.')
+    parser.add_argument(
+        '--sample',
+        dest='sample',
+        default=0,
+        type=int,
+        help='Number of files to benchmark (processed in a temporary directory).')
+    parser.add_argument(
+        '--default-runtime',
+        dest='default_runtime',
+        default=120,
+        type=float,
+        help='Mean processing time of a file in seconds, without benchmark or history in the manifest.')
+    parser.add_argument(
+        '--default-ratio',
+        dest='default_ratio',
+        default=1.0,
+        type=float,
+        help='Output size over input size, without benchmark or outputs in the manifest.')
+    parser.set_defaults(unravel=True)
+
+    args = parser.parse_args()
+    INPATH = args.inpath
+    OUTPATH = args.outpath
+    USE_UNRAVEL = args.unravel
+    MANIFEST = args.manifest
+    NSAMPLE = args.sample
+    DEFAULT_RUNTIME = args.default_runtime
+    DEFAULT_RATIO = args.default_ratio
+
+    try:
+        start = datetime.datetime.strptime(args.start_date, "%Y%m%d")
+        end = datetime.datetime.strptime(args.end_date, "%Y%m%d")
+    except ValueError:
+        parser.error('Invalid dates.')
+        sys.exit()
+    if start > end:
+        parser.error('End date older than start date.')
+
+    main(start, end)
@@ -0,0 +1,341 @@
+"""
+Raw radar PPIs processing of a campaign with a task queue on a shared
+filesystem. The queue is created once (init), then any number of jobs, on any
+node, pull files from it (work) until it is empty. Files of jobs killed at
+walltime are reprocessed by the other jobs once their lease has expired.
+
+    python radar_queue.py init -q /scratch/queue -s 20060101 -e 20060331
+    python radar_queue.py work -q /scratch/queue -j 16    # in each PBS job
+    python radar_queue.py status -q /scratch/queue
+
+@title: radar_queue
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+
+.. autosummary::
+    :toctree: generated/
+
+    init_queue
+    main
+    print_status
+    work
+"""
+# Python Standard Library
+import os
+import sys
+import glob
+import time
+import argparse
+import datetime
+
+import crayons
+
+from concurrent.futures import TimeoutError, wait, FIRST_COMPLETED
+from pebble import ProcessPool, ProcessExpired
+
+from cpol_processing import manifest
+from cpol_processing import scheduling
+from cpol_processing.taskqueue import TaskQueue
+from cpol_processing.warmup import warm_up
+
+
+def main(task, config):
+    """
+    Process one file of the queue (in a worker process).
+
+    Parameters:
+    ===========
+    task: dict
+        Task description: input file name, on_exists policy and dealiasing
+        algorithm.
+    config: dict
+        Configuration of the queue (output path, radiosoundings, ...).
+    """
+    import warnings
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        import cpol_processing
+
+    cpol_processing.process_and_save(task['infile'], config['outpath'], sound_dir=config['sound_dir'],
+                                     use_unravel=task['use_unravel'], on_exists=task['on_exists'],
+                                     manifest=config['manifest'], profile_file=config['profile_file'],
+                                     products=config['products'])
+
+    return None
+
+
+def init_queue(queue, start, end):
+    """
+    Create the queue with the files between the start and end dates. The
+    files are ordered by decreasing predicted runtime, and their timeouts are
+    derived from the manifest if there is one (see scheduling).
+
+    Parameters:
+    ===========
+    queue: TaskQueue
+        Task queue.
+    start: datetime
+        First day.
+    end: datetime
+        Last day.
+    """
+    runs = manifest.get_latest_runs(MANIFEST) if MANIFEST is not None else None
+    date_range = [start + datetime.timedelta(days=x) for x in range(0, (end - start).days + 1)]
+
+    on_exists = dict()
+    for day in date_range:
+        input_dir = os.path.join(INPATH, str(day.year), day.strftime("%Y%m%d"), "*.*")
+        flist = sorted(glob.glob(input_dir))
+        if len(flist) == 0:
+            continue
+        if MANIFEST is not None:
+            config = manifest.stage_configuration(SOUND_DIR, 'CPOL', USE_UNRAVEL, PRODUCTS)
+            flist = manifest.select_files(MANIFEST, flist, config)
+        for f in flist:
+            # Stale output from a previous successful run.
+            if runs is not None and runs.get(os.path.abspath(f), {}).get('status') == 'success':
+                on_exists[f] = 'overwrite'
+            else:
+                on_exists[f] = ON_EXISTS
+
+    flist, _ = scheduling.order_by_cost(list(on_exists.keys()), runs)
+    table = scheduling.get_timeout_table(runs) if runs is not None else dict()
+    timeouts = scheduling.get_timeouts(flist, table, USE_UNRAVEL, default=TIMEOUT)
+    retry_timeouts = scheduling.get_timeouts(flist, table, False, default=TIMEOUT)
+
+    tasks = [{'infile': f, 'on_exists': on_exists[f], 'use_unravel': USE_UNRAVEL,
+              'timeout': timeouts[f], 'retry_timeout': retry_timeouts[f]} for f in flist]
+    config = {'outpath': OUTPATH, 'sound_dir': SOUND_DIR, 'manifest': MANIFEST,
+              'profile_file': PROFILE_FILE, 'products': PRODUCTS}
+    queue.create(tasks, config)
+    print(f"{len(tasks)} files added to the queue {queue.path}.")
+
+    return None
+
+
+def work(queue, ncpus, max_tasks=16, stop_after=None):
+    """
+    Pull files from the queue and process them with a pool of workers, until
+    the queue is empty. The leases of the running files are renewed while
+    waiting, and a file whose lease was taken over by another job is
+    cancelled. A file reclaimed from a job that died is reprocessed with
+    on_exists='overwrite', as its output may be truncated. Each worker
+    compiles the numba kernels when it starts (see warmup). A file that
+    times out with UNRAVEL is retried once with the region-based dealiasing.
+
+    Parameters:
+    ===========
+    queue: TaskQueue
+        Task queue.
+    ncpus: int
+        Number of workers.
+    max_tasks: int
+        Number of tasks after which a worker is replaced (0 for never).
+    stop_after: float
+        Stop claiming files after this many seconds (e.g. the job walltime
+        minus the longest processing time). None to run until the queue is
+        empty.
+    """
+    config = queue.get_config()
+    renew_interval = queue.lease_time / 4
+    tick = time.time()
+
+    with ProcessPool(max_workers=ncpus, max_tasks=max_tasks, initializer=warm_up,
+                     initargs=(config.get('profile_file'),)) as pool:
+        running = dict()
+        accepting = True
+        while True:
+            if stop_after is not None and time.time() - tick > stop_after:
+                accepting = False
+            while accepting and len(running) < ncpus:
+                task_id, task = queue.claim()
+                if task_id is None:
+                    accepting = False
+                    break
+                if queue.get_attempt(task_id) > 1:
+                    # The previous job may have been killed while writing:
+                    # do not keep a truncated output file.
+                    task = dict(task, on_exists='overwrite')
+                future = pool.schedule(main, args=(task, config), timeout=task.get('timeout', TIMEOUT))
+                running[future] = (task_id, task, False)
+
+            if len(running) == 0:
+                break
+
+            done, _ = wait(running, timeout=renew_interval, return_when=FIRST_COMPLETED)
+            for future, (task_id, task, _) in list(running.items()):
+                if future not in done and not queue.renew(task_id):
+                    # Lease expired and taken over by another job, which
+                    # writes the same output.
+                    print(f"{task['infile']} was taken over by another job.")
+                    future.cancel()
+                    running.pop(future)
+
+            for future in done:
+                task_id, task, is_retry = running.pop(future)
+                infile = task['infile']
+                try:
+                    future.result()
+                    queue.complete(task_id, 'success')
+                except TimeoutError as error:
+                    print("%s took longer than %d seconds" % (infile, error.args[1]))
+                    if not is_retry and task['use_unravel']:
+                        print(f"Retrying {infile} with region-based dealiasing.")
+                        task = dict(task, use_unravel=False, on_exists='overwrite')
+                        retry = pool.schedule(main, args=(task, config),
+                                              timeout=task.get('retry_timeout', TIMEOUT))
+                        running[retry] = (task_id, task, True)
+                    else:
+                        queue.complete(task_id, 'failed', message='timeout')
+                except ProcessExpired as error:
+                    print("%s: %s. Exit code: %d" % (infile, error, error.exitcode))
+                    queue.complete(task_id, 'failed', message=str(error))
+                except Exception as error:
+                    print("%s raised %s" % (infile, error))
+                    print(error.traceback)  # Python's traceback of remote process
+                    queue.complete(task_id, 'failed', message=repr(error))
+
+    return None
+
+
+def print_status(queue):
+    """
+    Print the progress of the queue.
+
+    Parameters:
+    ===========
+    queue: TaskQueue
+        Task queue.
+    """
+    status = queue.status()
+    total = max(status['total'], 1)
+    print(f"Queue {queue.path}: {status['total']} files.")
+    for key in ['pending', 'running', 'expired', 'success', 'failed']:
+        print(f"\t- {key:<8} {status[key]:>8} ({100 * status[key] / total:5.1f}%)")
+
+    return None
+
+
+if __name__ == '__main__':
+    """
+    Global variables definition.
+    """
+    # Main global variables (Path directories).
+    INPATH = "/g/data/hj10/cpol_level_1a/ppi/"
+    OUTPATH = "/g/data/hj10/cpol_level_1b/"
+    SOUND_DIR = "/g/data2/rr5/CPOL_radar/DARWIN_radiosonde"
+
+    # Parse arguments
+    parser_description = """Raw radar PPIs processing with a task queue shared
+by several jobs. Create the queue with init, run work in each job, and check
+the progress with status."""
+    parser = argparse.ArgumentParser(description=parser_description)
+    parser.add_argument('command', choices=['init', 'work', 'status'], help='Queue command.')
+    parser.add_argument(
+        '-q',
+        '--queue',
+        dest='queue',
+        type=str,
+        help='Queue directory (on a filesystem shared by all the jobs).',
+        required=True)
+    parser.add_argument(
+        '-s',
+        '--start-date',
+        dest='start_date',
+        default=None,
+        type=str,
+        help='Starting date (init).')
+    parser.add_argument(
+        '-e',
+        '--end-date',
+        dest='end_date',
+        default=None,
+        type=str,
+        help='Ending date (init).')
+    parser.add_argument('--unravel', dest='unravel', action='store_true')
+    parser.add_argument('--no-unravel', dest='unravel', action='store_false')
+    parser.add_argument(
+        '--on-exists',
+        dest='on_exists',
+        default='skip',
+        choices=['skip', 'overwrite', 'verify'],
+        help='What to do with already existing output files (init).')
+    parser.add_argument(
+        '--manifest',
+        dest='manifest',
+        default=None,
+        type=str,
+        help='SQLite manifest database (init). Only new, failed, or stale files are queued.')
+    parser.add_argument(
+        '--profile-file',
+        dest='profile_file',
+        default=None,
+        type=str,
+        help='Append the timings and memory usage of each processing stage to this JSONL (or .csv) file (init).')
+    parser.add_argument(
+        '--products',
+        dest='products',
+        default=None,
+        type=str,
+        help='Comma separated list of output fields (init, default: all).')
+    parser.add_argument(
+        '--timeout',
+        dest='timeout',
+        default=180,
+        type=float,
+        help='Maximum processing time of a file in seconds, for the files without similar runs in the manifest.')
+    parser.add_argument(
+        '-j',
+        '--ncpus',
+        dest='ncpus',
+        default=os.cpu_count(),
+        type=int,
+        help='Number of worker processes (work).')
+    parser.add_argument(
+        '--max-tasks',
+        dest='max_tasks',
+        default=16,
+        type=int,
+        help='Number of files processed by a worker before it is replaced (work).')
+    parser.add_argument(
+        '--stop-after',
+        dest='stop_after',
+        default=None,
+        type=float,
+        help='Stop claiming new files after this many seconds (work), e.g. walltime minus the longest file.')
+    parser.add_argument(
+        '--lease-time',
+        dest='lease_time',
+        default=600,
+        type=float,
+        help='A file whose lease has not been renewed for this many seconds is given to another job.')
+    parser.set_defaults(unravel=True)
+
+    args = parser.parse_args()
+    USE_UNRAVEL = args.unravel
+    ON_EXISTS = args.on_exists
+    MANIFEST = args.manifest
+    PROFILE_FILE = args.profile_file
+    PRODUCTS = args.products.split(',') if args.products is not None else None
+    TIMEOUT = args.timeout
+
+    queue = TaskQueue(args.queue, lease_time=args.lease_time)
+    if args.command == 'init':
+        try:
+            start = datetime.datetime.strptime(args.start_date, "%Y%m%d")
+            end = datetime.datetime.strptime(args.end_date, "%Y%m%d")
+        except (TypeError, ValueError):
+            parser.error('Invalid dates.')
+            sys.exit()
+        if start > end:
+            parser.error('End date older than start date.')
+        print(crayons.yellow(f"Creating queue {args.queue} between {args.start_date} and {args.end_date}."))
+        init_queue(queue, start, end)
+    elif args.command == 'work':
+        if not os.path.isdir(os.path.join(args.queue, 'tasks')):
+            parser.error('Queue does not exist, create it with init.')
+        work(queue, args.ncpus, max_tasks=args.max_tasks, stop_after=args.stop_after)
+        print(crayons.green("No file left in the queue."))
+    else:
+        print_status(queue)
@@ -43,7 +43,11 @@ def main():
     with warnings.catch_warnings():
         warnings.simplefilter('ignore')
         import cpol_processing
-        cpol_processing.process_and_save(INFILE, OUTPATH, SOUND_DIR, use_unravel=USE_UNRAVEL)
+        from cpol_processing import profiling
+        hooks = profiling.parse_hooks(PROFILE) if PROFILE is not None else None
+        cpol_processing.process_and_save(INFILE, OUTPATH, SOUND_DIR, use_unravel=USE_UNRAVEL, on_exists=ON_EXISTS,
+                                         output_format=OUTPUT_FORMAT, profile_file=PROFILE_FILE, hooks=hooks,
+                                         products=PRODUCTS)
 
     print(crayons.green("Process completed."))
 
@@ -89,6 +93,36 @@ calculation, and rainfall rate estimation."""
 
     parser.add_argument('--unravel', dest='unravel', action='store_true')
     parser.add_argument('--no-unravel', dest='unravel', action='store_false')
+    parser.add_argument(
+        '--on-exists',
+        dest='on_exists',
+        default='skip',
+        choices=['skip', 'overwrite', 'verify'],
+        help='What to do if the output file already exists.')
+    parser.add_argument(
+        '--format',
+        dest='output_format',
+        default='cfradial',
+        choices=['cfradial', 'zarr', 'daily'],
+        help='Output format (zarr writes one group per volume in a daily store, daily appends the volume to a daily netCDF file).')
+    parser.add_argument(
+        '--profile',
+        dest='profile',
+        default=None,
+        type=str,
+        help='Profiling hooks, e.g. "cprofile=/tmp/profiles,sample=phase,numba" (default: CPOL_PROFILE env variable).')
+    parser.add_argument(
+        '--profile-file',
+        dest='profile_file',
+        default=None,
+        type=str,
+        help='Append the timings and memory usage of each processing stage to this JSONL (or .csv) file.')
+    parser.add_argument(
+        '--products',
+        dest='products',
+        default=None,
+        type=str,
+        help='Comma separated list of output fields, e.g. "reflectivity,radar_estimated_rain_rate" (default: all). Only the stages needed for them are run.')
     parser.set_defaults(unravel=True)
 
     args = parser.parse_args()
@@ -96,6 +130,11 @@ calculation, and rainfall rate estimation."""
     OUTPATH = args.outdir
     SOUND_DIR =  args.rs_dir
     USE_UNRAVEL = args.unravel
+    ON_EXISTS = args.on_exists
+    OUTPUT_FORMAT = args.output_format
+    PROFILE = args.profile
+    PROFILE_FILE = args.profile_file
+    PRODUCTS = args.products.split(',') if args.products is not None else None
 
     if not os.path.isfile(INFILE):
         parser.error("Invalid input file.")
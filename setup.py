@@ -21,6 +21,11 @@ REQUIRED = [
     "arm_pyart", "numpy", "csu_radartools", "crayons", "netCDF4", "scipy", "numba", "unravel"
 ]
 
+# What packages are optional?
+EXTRAS = {
+    'zarr': ['zarr'],
+}
+
 # The rest you shouldn't have to touch too much :)
 # ------------------------------------------------
 # Except, perhaps the License and Trove Classifiers!
@@ -89,6 +94,7 @@ setup(
     #     'console_scripts': ['mycli=mymodule:cli'],
     # },
     install_requires=REQUIRED,
+    extras_require=EXTRAS,
     include_package_data=True,
     license='ISC',
     classifiers=[
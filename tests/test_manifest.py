@@ -0,0 +1,66 @@
+"""
+Tests of the selection of the files to (re)process: manifest and existing
+output files.
+
+@title: test_manifest
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+"""
+import os
+
+import netCDF4
+
+from cpol_processing import manifest
+from cpol_processing import production
+
+
+CONFIG = {'instrument': 'CPOL', 'use_unravel': True, 'sound_dir': None}
+
+
+def test_select_files(tmp_path):
+    db = str(tmp_path / 'manifest.db')
+    done, failed, new = [str(tmp_path / name) for name in ['done.nc', 'failed.nc', 'new.nc']]
+    for name in [done, failed, new]:
+        with open(name, 'wb') as fid:
+            fid.write(b'radar')
+
+    manifest.record_run(db, done, 'out.nc', 'success', CONFIG)
+    manifest.record_run(db, failed, None, 'failed', CONFIG, message='error')
+    assert manifest.select_files(db, [done, failed, new], CONFIG) == [failed, new]
+
+    # Stale: other configuration, or input file changed since.
+    assert manifest.select_files(db, [done], dict(CONFIG, use_unravel=False)) == [done]
+    with open(done, 'ab') as fid:
+        fid.write(b'more data')
+    assert manifest.select_files(db, [done], CONFIG) == [done]
+
+
+def test_skip_output(tmp_path):
+    missing = str(tmp_path / 'missing.nc')
+    assert not production._skip_output(missing, 'skip')
+
+    corrupted = str(tmp_path / 'corrupted.nc')
+    with open(corrupted, 'wb') as fid:
+        fid.write(b'not a netcdf file')
+    assert production._skip_output(corrupted, 'skip')
+    assert not production._skip_output(corrupted, 'verify')
+    assert not production._skip_output(corrupted, 'overwrite')
+
+    valid = str(tmp_path / 'valid.nc')
+    with netCDF4.Dataset(valid, 'w') as ncid:
+        ncid.createDimension('time', 2)
+        ncid.createDimension('range', 3)
+        ncid.createVariable('velocity', 'f4', ('time', 'range'))[:] = 0
+    assert production._skip_output(valid, 'verify')
+    assert os.path.exists(valid)
+
+    # No data field.
+    empty = str(tmp_path / 'empty.nc')
+    with netCDF4.Dataset(empty, 'w') as ncid:
+        ncid.createDimension('time', 2)
+        ncid.createVariable('time', 'f8', ('time',))[:] = 0
+    assert not production._skip_output(empty, 'verify')
+
+    # Products selected when the file was written.
+    assert production._skip_output(valid, 'verify', products=['velocity', 'reflectivity'])
+    assert not production._skip_output(valid, 'verify', products=['reflectivity'])
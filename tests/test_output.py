@@ -0,0 +1,53 @@
+"""
+Tests of the daily time-stacked output.
+
+@title: test_output
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+"""
+import time
+import multiprocessing
+
+import netCDF4
+import numpy as np
+import pyart
+import pytest
+
+from cpol_processing import output
+
+
+def _make_radar(minute):
+    radar = pyart.testing.make_empty_ppi_radar(20, 36, 2)
+    radar.time['units'] = f'seconds since 2006-01-20T10:{minute:02d}:00Z'
+    radar.range['data'] = np.arange(20) * 250. + 125
+    dbz = pyart.config.get_metadata('reflectivity')
+    dbz['data'] = np.ma.masked_invalid(np.full((radar.nrays, radar.ngates), minute, dtype=np.float32))
+    radar.add_field('reflectivity', dbz)
+    return radar
+
+
+def _hold_daily_file(outfilename, started):
+    with output.DailyStackWriter() as stack:
+        stack.write(outfilename, _make_radar(0))
+        started.set()
+        time.sleep(1)
+        stack.write(outfilename, _make_radar(10))
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork', reason='Requires fork.')
+def test_daily_file_concurrent_writers(tmp_path):
+    outfilename = str(tmp_path / 'daily.nc')
+    ctx = multiprocessing.get_context('fork')
+    started = ctx.Event()
+    proc = ctx.Process(target=_hold_daily_file, args=(outfilename, started))
+    proc.start()
+    started.wait(timeout=30)
+
+    # Per-file write from another process, while the day is being written.
+    output.write(outfilename, _make_radar(5), output_format='daily')
+    proc.join()
+
+    assert proc.exitcode == 0
+    with netCDF4.Dataset(outfilename) as ncid:
+        assert len(ncid['time']) == 3
+        assert sorted(ncid['reflectivity'][:, 0, 0].tolist()) == [0, 5, 10]
@@ -0,0 +1,66 @@
+"""
+Tests of the stage selection and of the freeing of the fields.
+
+@title: test_pipeline
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+"""
+import numpy as np
+import pytest
+
+from cpol_processing import pipeline
+from cpol_processing import instrumentation
+
+
+class FakeRadar:
+    def __init__(self, names):
+        self.fields = {name: {'data': np.zeros((2, 3), dtype=np.float32)} for name in names}
+
+
+def test_resolve_stages_velocity():
+    stages, needed = pipeline.resolve_stages(['velocity'])
+    assert [stage.name for stage in stages] == ['sounding', 'rhohv', 'gatefilter', 'velocity']
+    assert 'PHIDP_VAL' not in needed
+    assert 'WIDTH' not in needed
+
+
+def test_resolve_stages_unknown_product():
+    with pytest.raises(ValueError):
+        pipeline.resolve_stages(['not_a_product'])
+
+
+def test_get_input_fields():
+    assert pipeline.get_input_fields(['total_power']) == ['DBZ']
+    assert pipeline.get_input_fields(['velocity']) == ['DBZ', 'ZDR', 'VEL', 'PHIDP', 'RHOHV', 'SNR']
+    assert pipeline.get_input_fields() == pipeline.RAW_FIELDS
+
+
+def test_run_stages_frees_fields(monkeypatch):
+    seen = dict()
+
+    def _fake(stage):
+        def function(radar, context):
+            seen[stage.name] = set(radar.fields) | ({'gatefilter'} if 'gatefilter' in context else set())
+            for name in stage.outputs:
+                if name == 'gatefilter':
+                    context['gatefilter'] = object()
+                else:
+                    radar.fields[name] = {'data': np.zeros((2, 3), dtype=np.float32)}
+        return function
+
+    stages = [stage._replace(function=_fake(stage)) for stage in pipeline.STAGES]
+    monkeypatch.setattr(pipeline.resolve_stages, '__defaults__', (stages,))
+
+    radar = FakeRadar(pipeline.RAW_FIELDS)
+    context = dict()
+    profile = instrumentation.StageProfile()
+    assert pipeline.run_stages(radar, context, ['velocity'], profile)
+
+    assert list(seen) == ['sounding', 'rhohv', 'gatefilter', 'velocity']
+    # Read but not used.
+    assert 'WIDTH' not in seen['sounding']
+    # Freed after their last use, by the gatefilter stage.
+    assert seen['velocity'] == {'DBZ', 'VEL', 'gatefilter'}
+    assert set(radar.fields) == {'VEL_UNFOLDED'}
+    assert 'gatefilter' not in context
+    assert [record['stage'] for record in profile.records] == list(seen)
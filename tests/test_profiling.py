@@ -0,0 +1,23 @@
+"""
+Tests of the profiling hooks.
+
+@title: test_profiling
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+"""
+import os
+
+from cpol_processing import profiling
+from cpol_processing import instrumentation
+
+
+def test_cprofile_dumps_of_successive_volumes(tmp_path, monkeypatch):
+    monkeypatch.setenv('CPOL_PROFILE', f"cprofile={tmp_path}")
+    for _ in range(2):
+        # One profile per volume, as in production_line.
+        profile = instrumentation.StageProfile()
+        profile.hooks.extend(profiling.hooks_from_env())
+        with profile.stage('phase'):
+            pass
+
+    assert len(os.listdir(tmp_path)) == 2
@@ -0,0 +1,64 @@
+"""
+Smoke test of the worker pool of scripts/radar_pack.py.
+
+@title: test_radar_pack
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+"""
+import os
+import sys
+import subprocess
+import multiprocessing
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+import radar_pack  # noqa: E402
+
+import cpol_processing  # noqa: E402
+from cpol_processing import production  # noqa: E402
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='The patched process_and_save is inherited by the workers only with fork.')
+def test_run_pool_one_file(tmp_path, monkeypatch):
+    marker = tmp_path / 'called.txt'
+
+    def process_and_save(infile, outpath, **kwargs):
+        with open(marker, 'a') as fid:
+            fid.write(f"{infile} {outpath} {kwargs['use_unravel']} {kwargs['on_exists']}\n")
+
+    monkeypatch.setattr(cpol_processing, 'process_and_save', process_and_save)
+    profile_file = str(tmp_path / 'profile.jsonl')
+    inargs = ('radar.nc', str(tmp_path), None, True, 'skip', None, None, None, 'cfradial')
+    radar_pack.run_pool([inargs], 1, timeout=120, profile_file=profile_file)
+
+    assert marker.read_text() == f"radar.nc {tmp_path} True skip\n"
+    # Warm-up record of the worker.
+    assert os.path.exists(profile_file)
+
+
+@pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                    reason='The patched process_sequence is inherited by the workers only with fork.')
+def test_run_pool_one_day(tmp_path, monkeypatch):
+    marker = tmp_path / 'called.txt'
+
+    def process_sequence(flist, outpath, **kwargs):
+        with open(marker, 'a') as fid:
+            fid.write(f"{','.join(flist)} {kwargs['on_exists']} {kwargs['output_format']}\n")
+        return []
+
+    monkeypatch.setattr(production, 'process_sequence', process_sequence)
+    flist = ['radar_0000.nc', 'radar_0010.nc']
+    inargs = ('20060120', str(tmp_path), None, True, 'skip', None, None, None, 'daily', flist)
+    radar_pack.run_pool([inargs], 1, timeout={'20060120': 120}, function=radar_pack.main_day)
+
+    # One task for the day, with its files in time order.
+    assert marker.read_text() == "radar_0000.nc,radar_0010.nc skip daily\n"
+
+
+def test_launcher_does_not_load_pyart():
+    code = "import sys, radar_pack; print('pyart' in sys.modules)"
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    rslt = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True, env=env)
+    assert rslt.stdout.strip().splitlines()[-1] == 'False'
@@ -0,0 +1,88 @@
+"""
+Tests of the queue worker of scripts/radar_queue.py.
+
+@title: test_radar_queue
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+"""
+import os
+import sys
+import time
+import threading
+import multiprocessing
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'scripts'))
+import radar_queue  # noqa: E402
+
+import cpol_processing  # noqa: E402
+from cpol_processing.taskqueue import TaskQueue  # noqa: E402
+
+CONFIG = {'outpath': '/tmp', 'sound_dir': None, 'manifest': None, 'profile_file': None, 'products': None}
+
+pytestmark = pytest.mark.skipif(multiprocessing.get_start_method() != 'fork',
+                                reason='The patched process_and_save is inherited by the workers only with fork.')
+
+
+@pytest.fixture(autouse=True)
+def script_globals(monkeypatch):
+    # Defined by the command line of the script.
+    monkeypatch.setattr(radar_queue, 'TIMEOUT', 180, raising=False)
+
+
+def test_reclaimed_task_overwrites(tmp_path, monkeypatch):
+    marker = tmp_path / 'called.txt'
+
+    def process_and_save(infile, outpath, **kwargs):
+        with open(marker, 'a') as fid:
+            fid.write(kwargs['on_exists'] + "\n")
+
+    monkeypatch.setattr(cpol_processing, 'process_and_save', process_and_save)
+    path = str(tmp_path / 'queue')
+    dead = TaskQueue(path, lease_time=60)
+    dead.create([{'infile': 'a.nc', 'on_exists': 'skip', 'use_unravel': False, 'timeout': 60}], CONFIG)
+    task_id, _ = dead.claim()
+    old = time.time() - 120
+    os.utime(dead._lease_file(task_id, 1), (old, old))
+
+    queue = TaskQueue(path, lease_time=60)
+    radar_queue.work(queue, 1)
+    assert marker.read_text() == "overwrite\n"
+    assert queue.status()['success'] == 1
+
+
+def test_taken_over_task_is_cancelled(tmp_path, monkeypatch):
+    def process_and_save(infile, outpath, **kwargs):
+        time.sleep(60)
+
+    monkeypatch.setattr(cpol_processing, 'process_and_save', process_and_save)
+    path = str(tmp_path / 'queue')
+    queue = TaskQueue(path, lease_time=2)
+    queue.create([{'infile': 'a.nc', 'on_exists': 'skip', 'use_unravel': False, 'timeout': 120}], CONFIG)
+
+    errors = []
+
+    def _work():
+        try:
+            radar_queue.work(queue, 1)
+        except Exception as error:
+            errors.append(error)
+
+    thread = threading.Thread(target=_work)
+    thread.start()
+    lease_file = queue._lease_file('00000000', 1)
+    while not os.path.exists(lease_file):
+        time.sleep(0.1)
+
+    # The lease expires (e.g. the job was suspended) and another job takes it.
+    old = time.time() - 10
+    os.utime(lease_file, (old, old))
+    other = TaskQueue(path, lease_time=2)
+    assert other.claim()[0] == '00000000'
+    thread.join(timeout=30)
+
+    assert not thread.is_alive()
+    assert errors == []
+    assert queue.status()['success'] == 0
+    assert queue.status()['running'] == 1
@@ -0,0 +1,92 @@
+"""
+Tests of the shared-filesystem task queue.
+
+@title: test_taskqueue
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+"""
+import os
+import time
+import multiprocessing
+
+from cpol_processing.taskqueue import TaskQueue
+
+
+def _expire(queue, task_id, attempt):
+    lease_file = queue._lease_file(task_id, attempt)
+    old = time.time() - 2 * queue.lease_time
+    os.utime(lease_file, (old, old))
+
+
+def _claim(path, barrier, results):
+    queue = TaskQueue(path, lease_time=60)
+    barrier.wait()
+    task_id, _ = queue.claim()
+    results.put(task_id)
+
+
+def test_competing_claimers_expired_lease(tmp_path):
+    path = str(tmp_path)
+    queue = TaskQueue(path, lease_time=60)
+    queue.create([{'infile': 'a.nc'}])
+    task_id, _ = queue.claim()
+    _expire(queue, task_id, 1)
+
+    nclaimers = 8
+    ctx = multiprocessing.get_context('fork')
+    barrier = ctx.Barrier(nclaimers)
+    results = ctx.Queue()
+    procs = [ctx.Process(target=_claim, args=(path, barrier, results)) for _ in range(nclaimers)]
+    for proc in procs:
+        proc.start()
+    claimed = [results.get(timeout=30) for _ in procs]
+    for proc in procs:
+        proc.join()
+
+    assert claimed.count(task_id) == 1
+    assert claimed.count(None) == nclaimers - 1
+    assert queue.status()['running'] == 1
+    # The first worker lost its lease.
+    assert not queue.renew(task_id)
+
+
+def test_claim_after_takeover_by_other_worker(tmp_path):
+    # Worker B sees the expired lease, worker C takes it over first: B must not get it.
+    path = str(tmp_path)
+    first = TaskQueue(path, lease_time=60)
+    first.create([{'infile': 'a.nc'}])
+    task_id, _ = first.claim()
+    _expire(first, task_id, 1)
+
+    second, third = TaskQueue(path, lease_time=60), TaskQueue(path, lease_time=60)
+    attempts = second._current_attempts()
+    assert third.claim()[0] == task_id
+    second._current_attempts = lambda: attempts
+    assert second.claim() == (None, None)
+
+
+def test_claim_expiry_round_trip(tmp_path):
+    path = str(tmp_path)
+    worker, other = TaskQueue(path, lease_time=60, max_attempts=2), TaskQueue(path, lease_time=60, max_attempts=2)
+    worker.create([{'infile': 'a.nc'}, {'infile': 'b.nc'}], config={'outpath': '/tmp'})
+    assert other.get_config() == {'outpath': '/tmp'}
+
+    first, task = worker.claim()
+    assert task == {'infile': 'a.nc'}
+    assert worker.get_attempt(first) == 1
+    second, _ = other.claim()
+    assert second != first
+    assert worker.claim() == (None, None)
+    assert worker.status()['running'] == 2
+
+    worker.complete(first, 'success')
+    _expire(other, second, 1)
+    assert worker.status() == {'total': 2, 'pending': 0, 'running': 0, 'expired': 1, 'success': 1, 'failed': 0}
+
+    # Reclaimed once, then marked as failed when it expires again.
+    assert worker.claim()[0] == second
+    assert worker.get_attempt(second) == 2
+    assert worker.renew(second)
+    _expire(worker, second, 2)
+    assert other.claim() == (None, None)
+    assert worker.status()['failed'] == 1
@@ -0,0 +1,56 @@
+"""
+Tests of the cached radiosonde wind profile and simulated velocity.
+
+@title: test_velocity
+@author: Valentin Louf <valentin.louf@monash.edu>
+@institution: Bureau of Meteorology
+"""
+import netCDF4
+import numpy as np
+import pyart
+
+from cpol_processing.processing import velocity
+
+
+def _make_radar(jitter=0):
+    radar = pyart.testing.make_empty_ppi_radar(50, 36, 3)
+    radar.range['data'] = np.arange(50) * 1000. + 500
+    radar.altitude['data'][:] = 50
+    radar.fixed_angle['data'][:] = [0.5, 1.5, 2.5]
+    radar.elevation['data'][:] = np.repeat(radar.fixed_angle['data'], 36)
+    radar.azimuth['data'] = radar.azimuth['data'] + jitter
+    return radar
+
+
+def _make_sounding(fname):
+    with netCDF4.Dataset(fname, 'w') as ncid:
+        ncid.createDimension('level', 20)
+        ncid.createVariable('height', 'f8', ('level',))[:] = np.linspace(0, 10000, 20)
+        ncid.createVariable('wspeed', 'f8', ('level',))[:] = np.linspace(2, 30, 20)
+        ncid.createVariable('wdir', 'f8', ('level',))[:] = np.linspace(90, 270, 20)
+
+
+def test_simulated_velocity_cache(tmp_path):
+    sonde = str(tmp_path / 'sonde.nc')
+    _make_sounding(sonde)
+    velocity._SIMVEL_CACHE.clear()
+    velocity._read_wind_profile.cache_clear()
+
+    radar = _make_radar()
+    sim_vel = velocity.get_simulated_wind_profile(radar, sonde)
+    with netCDF4.Dataset(sonde) as ncid:
+        hwind_prof = pyart.core.HorizontalWindProfile(ncid['height'][:], ncid['wspeed'][:], ncid['wdir'][:])
+    reference = pyart.util.simulated_vel_from_profile(radar, hwind_prof)
+    assert np.ma.allclose(sim_vel['data'], reference['data'], atol=1e-3)
+
+    # Next volume of the same scan strategy: both caches are hit.
+    sim_vel = velocity.get_simulated_wind_profile(_make_radar(jitter=0.3), sonde)
+    assert velocity._read_wind_profile.cache_info().misses == 1
+    assert len(velocity._SIMVEL_CACHE) == 1
+    assert sim_vel['data'].shape == (radar.nrays, radar.ngates)
+
+    # Another scan strategy.
+    other = _make_radar()
+    other.fixed_angle['data'][:] = [0.9, 1.8, 3.1]
+    velocity.get_simulated_wind_profile(other, sonde)
+    assert len(velocity._SIMVEL_CACHE) == 2